@@ -36,6 +36,8 @@ peakIntegrators = [ ( "std",  SGIntegrator(window_size=11, order=2) ) ,
                     ( "sum", SumIntegrator() ) ,
                     ( "emg_exact", SimplifiedEMGIntegrator() ) ,
                     ( "emg_with_baseline", SimplifiedEMGIntegrator(fit_baseline=True) ) ,
+                    ( "emg_batch", BatchEMGIntegrator() ) ,
+                    ( "emg_with_baseline_batch", BatchEMGIntegrator(fit_baseline=True) ) ,
                     ( "no_integration", NoIntegration() ) ,
                    ]
 
@@ -21,10 +21,13 @@ class FD(batch_runner.BatchRunner):
         print len(table), "features found"
         return table
 
-    def write(self, result, destinationDir, path):
+    def outputPath(self, destinationDir, path):
         import os.path
         basename, ext = os.path.splitext(os.path.basename(path))
-        savePath = os.path.join(destinationDir, basename + ".csv")
+        return os.path.join(destinationDir, basename + ".csv")
+
+    def write(self, result, destinationDir, path):
+        savePath = self.outputPath(destinationDir, path)
         print "save to ", savePath
         result.storeCSV(savePath)
 
@@ -36,6 +39,9 @@ def runCentwave(pattern=None, destination=None, configid="std", **params):
       files of type *.mzML*, *.mzXML* and *.mzData*.
     - *destination* is a target folder where the results are stored as *.csv* files
     - *configid* is a preconfiugred setting id, but following key pairs as *ppm=20* override this.
+    - *n_workers* is the number of processes used for processing the files in parallel,
+      *skip_existing=True* skips input files which have an up to date *.csv* file, see
+      :py:meth:`~emzed.core.batch_runner.BatchRunner.run`.
 
     Examples:
 
@@ -84,6 +90,9 @@ def runMatchedFilter(pattern=None, destination=None, configid="std", **params):
       files of type *.mzML*, *.mzXML* and *.mzData*.
     - *destination* is a target folder where the results are stored as *.csv* files
     - *configid* is a preconfiugred setting id, but following key pairs as *ppm=20* override this.
+    - *n_workers* is the number of processes used for processing the files in parallel,
+      *skip_existing=True* skips input files which have an up to date *.csv* file, see
+      :py:meth:`~emzed.core.batch_runner.BatchRunner.run`.
 
     Examples:
 
@@ -139,6 +148,9 @@ def runMetaboFeatureFinder(pattern=None, destination=None, configid="std", **par
       files of type *.mzML*, *.mzXML* and *.mzData*.
     - *destination* is a target folder where the results are stored as *.csv* files
     - *configid* is a preconfiugred setting id, but following key pairs as *ppm=20* override this.
+    - *n_workers* is the number of processes used for processing the files in parallel,
+      *skip_existing=True* skips input files which have an up to date *.csv* file, see
+      :py:meth:`~emzed.core.batch_runner.BatchRunner.run`.
 
     Examples:
 
@@ -7,6 +7,10 @@ def runPeakPickerHiRes(pattern=None, destination=None, configid=None, **params):
     - *destination* is the path of the output file
     - *configid* is
 
+    *n_workers* and *skip_existing* control parallel processing and
+    skipping of up to date results, see
+    :py:meth:`~emzed.core.batch_runner.BatchRunner.run`.
+
     You can add modifications to the standard parameters, e. g.
     *signal_to_noise*, as named arguments.
 
@@ -73,9 +77,12 @@ def runPeakPickerHiRes(pattern=None, destination=None, configid=None, **params):
             picked = self.pp.pickPeakMap(pm, showProgress=True)
             return picked
 
-        def write(self, result, destinationDir, path):
+        def outputPath(self, destinationDir, path):
             basename, ext = os.path.splitext(os.path.basename(path))
-            savePath = os.path.join(destinationDir, basename + "_centroided.mzML")
+            return os.path.join(destinationDir, basename + "_centroided.mzML")
+
+        def write(self, result, destinationDir, path):
+            savePath = self.outputPath(destinationDir, path)
             print "save to ", savePath
             io.storePeakMap(result, savePath)
 
@@ -1,5 +1,12 @@
 #encoding: utf-8
 
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+
 class BatchRunner(object):
 
     """ Base class for batch jobs on the file system.
@@ -22,9 +29,31 @@ class BatchRunner(object):
         """ writes result to destinationDir. path is the path of the input file"""
         raise NotImplementedError("you have to override this method")
 
-    def run(self, pattern=None, destination=None, configid=None, **params):
+    def outputPath(self, destinationDir, path):
+        """ returns path of the file write creates for input file path, or None
+            if not known. used by run for skipping inputs which are processed already
+        """
+        return None
+
+    def run(self, pattern=None, destination=None, configid=None, n_workers=1,
+            skip_existing=False, **params):
+        """ processes all files matching pattern.
+
+            n_workers > 1 processes the files in so many worker processes,
+            n_workers = 0 means "use all cpu cores", n_workers = -1 means "use
+            all but one cpu cores", etc. at least one and at most one worker
+            per file is used. the worker processes are forked after setup, on
+            windows the runner must be picklable.
 
-        import glob, os.path
+            if skip_existing is True inputs with an output file (see outputPath)
+            newer than the input are skipped.
+
+            a failing input does not stop processing of the other inputs, the
+            errors are reported at the end. collected results are returned in
+            the order of the inputs.
+        """
+
+        import glob
 
         if pattern is None:
             from .. import gui
@@ -62,14 +91,9 @@ class BatchRunner(object):
 
         self.setup(config)
 
-        count = 0
-        results = []
+        jobs = []
+        skipped = 0
         for path in files:
-
-            result = self.process(path)
-            if result is None:
-                continue
-
             if destination is None:
                 destinationDir = os.path.dirname(path)
             else:
@@ -79,13 +103,119 @@ class BatchRunner(object):
                 except:
                     pass # verzeichnisse schon vorhanden
 
-            self.write(result, destinationDir, path)
-            if self.collectResults:
-                results.append(result)
-            count += 1
+            if skip_existing and self._isUpToDate(destinationDir, path):
+                print "skip", path
+                skipped += 1
+                continue
+            jobs.append((len(jobs), path, destinationDir))
+
+        messages, n_workers = _check_num_workers(n_workers, len(jobs))
+        if messages:
+            print "\n".join(messages)
 
+        started = time.time()
+        if n_workers == 1:
+            outcomes = (_process_file(self, job) for job in jobs)
+        else:
+            outcomes = _process_parallel(self, jobs, n_workers)
+
+        count = 0
+        failed = []
+        results = [None] * len(jobs)
+        for done, (index, result, written, error) in enumerate(outcomes, 1):
+            if error is not None:
+                failed.append((index, error))
+            elif written:
+                results[index] = result
+                count += 1
+            print "finished %d of %d inputs" % (done, len(jobs))
+
+        needed = time.time() - started
         print
         print "analyzed %d inputs" % count
+        if skipped:
+            print "skipped %d inputs which are up to date" % skipped
+        if jobs:
+            print "needed %.1f seconds with %d processes, %.2f inputs per minute" % (
+                needed, n_workers, len(jobs) * 60.0 / max(needed, 1e-3))
+        for index, error in sorted(failed):
+            __, path, __ = jobs[index]
+            print
+            print "processing %s FAILED:" % path
+            print error
         print
         if self.collectResults:
-            return results
+            return [result for result in results if result is not None]
+
+    def _isUpToDate(self, destinationDir, path):
+        outputPath = self.outputPath(destinationDir, path)
+        if outputPath is None or not os.path.exists(outputPath):
+            return False
+        return os.path.getmtime(outputPath) >= os.path.getmtime(path)
+
+
+def _check_num_workers(n_workers, n_jobs):
+
+    messages = []
+    if multiprocessing.current_process().daemon and n_workers != 1:
+        messages.append("WARNING: you choose n_workers = %d but the batch already runs inside "
+                        "a daemon process which is not allowed. therefore set n_workers = 1"
+                        % n_workers)
+        n_workers = 1
+
+    if n_workers <= 0:
+        n_workers = max(1, multiprocessing.cpu_count() + n_workers)
+
+    # no need to start more processes than we have inputs:
+    n_workers = max(1, min(n_workers, n_jobs))
+    return messages, n_workers
+
+
+def _process_file(runner, (index, path, destinationDir)):
+    """returns tuple (index, result, written, error), error is None or a formatted
+    traceback"""
+    try:
+        result = runner.process(path)
+        if result is None:
+            return index, None, False, None
+        runner.write(result, destinationDir, path)
+        if not runner.collectResults:
+            result = None
+        return index, result, True, None
+    except Exception:
+        return index, None, False, traceback.format_exc()
+
+
+# the runner in a worker process, forked workers inherit it from the parent process:
+_runner = None
+
+
+def _init_worker(runner):
+    global _runner
+    _runner = runner
+
+
+def _process_in_worker(job):
+    return _process_file(_runner, job)
+
+
+def _process_parallel(runner, jobs, n_workers):
+    """yields the outcomes of _process_file in order of completion"""
+    global _runner
+    _runner = runner
+    if sys.platform == "win32":
+        # no fork on windows:
+        pool = multiprocessing.Pool(n_workers, _init_worker, (runner,))
+    else:
+        pool = multiprocessing.Pool(n_workers)
+    try:
+        outcomes = pool.imap_unordered(_process_in_worker, jobs)
+        for __ in range(len(jobs)):
+            # next() with timeout avoids bug when trying to stop jobs using ^C
+            yield outcomes.next(2 ** 31)
+        # at least needed on win, else worker processes accumulate:
+        pool.close()
+        pool.join()
+    finally:
+        pool.terminate()
+        _runner = None
@@ -22,7 +22,7 @@ class Elements(Table):
     def __init__(self):
         self.__dict__ = Elements.__we_are_all_one  # shared state
 
-        if not hasattr(self, "rows"):
+        if "_colNames" not in self.__dict__:
             #path = os.path.dirname(os.path.abspath(__file__))
             path = pyopenms.File.find("CHEMISTRY/Elements.xml", [])
             param = pyopenms.Param()
@@ -83,7 +83,7 @@ class MonoIsotopicElements(Table):
     def __init__(self):
         self.__dict__ = MonoIsotopicElements.__we_are_all_one
 
-        if not hasattr(self, "rows"): # empty on first run
+        if "_colNames" not in self.__dict__: # empty on first run
             elements = Elements()
             self.rows = []
             # find monoisotopic data for each element
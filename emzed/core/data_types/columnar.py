@@ -0,0 +1,235 @@
+# encoding: utf-8
+from __future__ import print_function, division, absolute_import
+
+import struct
+
+import dill
+import numpy as np
+
+
+class Column(object):
+
+    """holds the values of one table column.
+
+    columns of type int, float and bool are stored as a typed numpy array plus a boolean array
+    ``valid`` which flags the cells which are not None. all other columns are stored as numpy
+    object arrays, ``valid`` is None in this case.
+    """
+
+    __slots__ = ("data", "valid")
+
+    _dtypes = {int: np.int64, float: np.float64, bool: np.bool_}
+
+    def __init__(self, data, valid=None):
+        self.data = data
+        self.valid = valid
+
+    @classmethod
+    def from_values(clz, values, type_):
+        values = list(values)
+        n = len(values)
+        dtype = clz._dtypes.get(type_)
+        if dtype is not None:
+            # we only use typed storage if the conversion is loss free, tables do not enforce
+            # the declared column types, so an int column might contain floats or longs:
+            if all(type(v) is type_ or v is None for v in values):
+                valid = np.fromiter((v is not None for v in values), dtype=bool, count=n)
+                filled = [0 if v is None else v for v in values]
+                try:
+                    data = np.array(filled, dtype=dtype)
+                except OverflowError:
+                    pass
+                else:
+                    return clz(data, valid)
+        # assigning a list to an object array slice would unpack nested sequences, so:
+        data = np.empty((n,), dtype=object)
+        for i, v in enumerate(values):
+            data[i] = v
+        return clz(data)
+
+    @property
+    def is_typed(self):
+        return self.valid is not None
+
+    def __len__(self):
+        return len(self.data)
+
+    def has_missing_values(self):
+        if self.valid is not None:
+            return not self.valid.all()
+        return any(v is None for v in self.data)
+
+    def take(self, indices):
+        """indices is an integer array, negative entries create missing values"""
+        indices = np.asarray(indices, dtype=np.int64)
+        missing = indices < 0
+        if not missing.any():
+            if self.valid is not None:
+                return Column(self.data[indices], self.valid[indices])
+            return Column(self.data[indices])
+
+        safe_indices = np.where(missing, 0, indices)
+        if self.valid is not None:
+            if len(self.data):
+                data = self.data[safe_indices]
+                valid = self.valid[safe_indices]
+            else:
+                data = np.zeros(len(indices), dtype=self.data.dtype)
+                valid = np.zeros(len(indices), dtype=bool)
+            valid[missing] = False
+            return Column(data, valid)
+        data = np.empty((len(indices),), dtype=object)
+        if len(self.data):
+            data[:] = self.data[safe_indices]
+        data[missing] = None
+        return Column(data)
+
+    def to_array(self):
+        """returns values as numpy array as needed for evaluating expressions. this is a typed
+        array if the column has no missing values, else an object array with None entries.
+        """
+        if self.valid is None or self.valid.all():
+            return self.data
+        result = self.data.astype(object)
+        result[~self.valid] = None
+        return result
+
+    def to_list(self):
+        values = self.data.tolist()
+        if self.valid is not None and not self.valid.all():
+            for i in np.where(~self.valid)[0]:
+                values[i] = None
+        return values
+
+
+class ColumnStore(object):
+
+    """column wise storage of the rows of a table"""
+
+    def __init__(self, columns, n_rows):
+        assert all(len(c) == n_rows for c in columns)
+        self.columns = columns
+        self.n_rows = n_rows
+
+    @classmethod
+    def from_rows(clz, rows, types):
+        n_rows = len(rows)
+        if n_rows:
+            cols = zip(*rows)
+        else:
+            cols = [()] * len(types)
+        columns = [Column.from_values(col, type_) for (col, type_) in zip(cols, types)]
+        return clz(columns, n_rows)
+
+    def __len__(self):
+        return self.n_rows
+
+    def to_rows(self):
+        if not self.columns:
+            return [[] for __ in range(self.n_rows)]
+        return map(list, zip(*[c.to_list() for c in self.columns]))
+
+    def take(self, indices):
+        indices = np.asarray(indices, dtype=np.int64)
+        return ColumnStore([c.take(indices) for c in self.columns], len(indices))
+
+    def select_columns(self, col_indices):
+        return ColumnStore([self.columns[i] for i in col_indices], self.n_rows)
+
+    def insert_column(self, position, column):
+        assert len(column) == self.n_rows
+        self.columns.insert(position, column)
+
+    def drop_column(self, position):
+        del self.columns[position]
+
+    def hstack(self, other):
+        assert self.n_rows == other.n_rows
+        return ColumnStore(self.columns + other.columns, self.n_rows)
+
+
+# binary file format for ColumnStore objects, written after the version line of
+# Table.store:
+#
+#   magic line
+#   8 bytes little endian offset of the header
+#   blocks, each starting at a multiple of BLOCK_ALIGNMENT:
+#       typed columns: values as raw array followed by a bitmap of the valid cells
+#       object columns: pickled list of values
+#   header: pickled dict with the table attributes and the positions of the blocks
+#
+# typed columns are memory mapped when loading, object columns are only unpickled for the
+# selected columns.
+
+COLUMNAR_MAGIC = "emzed_columnar\n"
+BLOCK_ALIGNMENT = 64
+
+
+def _align(fp):
+    padding = -fp.tell() % BLOCK_ALIGNMENT
+    fp.write("\0" * padding)
+    return fp.tell()
+
+
+def write_columns(fp, store, attributes):
+    """writes ``store`` and the dict ``attributes`` at the current position of ``fp``, which
+    must be opened for writing and reading"""
+    fp.write(COLUMNAR_MAGIC)
+    offset_position = fp.tell()
+    fp.write(struct.pack("<Q", 0))
+
+    blocks = []
+    for column in store.columns:
+        start = _align(fp)
+        if column.is_typed:
+            data = np.ascontiguousarray(column.data)
+            fp.write(data.tostring())
+            valid_start = fp.tell()
+            fp.write(np.packbits(column.valid).tostring())
+            blocks.append(("typed", data.dtype.str, start, valid_start))
+        else:
+            dill.dump(list(column.data), fp)
+            blocks.append(("object", None, start, fp.tell() - start))
+
+    header_start = fp.tell()
+    dill.dump(dict(attributes=attributes, n_rows=store.n_rows, blocks=blocks), fp)
+    fp.seek(offset_position)
+    fp.write(struct.pack("<Q", header_start))
+    fp.seek(0, 2)
+
+
+def read_columns_header(fp):
+    """reads header written by :py:func:`write_columns`, ``fp`` must be positioned after the
+    magic line. returns the table attributes and a layout for :py:func:`read_columns`"""
+    header_start, = struct.unpack("<Q", fp.read(8))
+    fp.seek(header_start)
+    header = dill.load(fp)
+    return header["attributes"], (header["n_rows"], header["blocks"])
+
+
+def read_columns(path, fp, layout, col_indices):
+    """returns ColumnStore with the columns ``col_indices`` of the file ``path``. the arrays of
+    typed columns are memory mapped (copy on write), so only the accessed parts are read
+    from disk."""
+    n_rows, blocks = layout
+    columns = []
+    for i in col_indices:
+        kind, dtype, start, extra = blocks[i]
+        if kind == "typed":
+            if n_rows:
+                data = np.memmap(path, dtype=dtype, mode="c", offset=start, shape=(n_rows,))
+                bits = np.memmap(path, dtype=np.uint8, mode="r", offset=extra,
+                                 shape=((n_rows + 7) // 8,))
+                valid = np.unpackbits(bits)[:n_rows].astype(bool)
+            else:
+                data = np.zeros((0,), dtype=dtype)
+                valid = np.zeros((0,), dtype=bool)
+            columns.append(Column(data, valid))
+        else:
+            fp.seek(start)
+            values = dill.loads(fp.read(extra))
+            data = np.empty((n_rows,), dtype=object)
+            for j, v in enumerate(values):
+                data[j] = v
+            columns.append(Column(data))
+    return ColumnStore(columns, n_rows)
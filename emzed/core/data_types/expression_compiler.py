@@ -0,0 +1,413 @@
+# encoding: utf-8
+"""
+Calling ``_eval`` on the root of an expression tree evaluates every node on its own: numerical
+columns are converted to numpy arrays wherever they appear, missing values are handled with
+object arrays and subexpressions which appear several times are evaluated several times.
+
+``compile_expression`` turns an expression tree into an evaluation plan instead. The plan is a
+list of steps without duplicates, children come before their parents. Every column is
+converted once to a numpy array of numerical dtype plus a boolean array which flags the values
+which are not None. Comparisons, arithmetic and logic operations are computed on these arrays
+and masks, all other expressions are evaluated on the results of their children as ``_eval``
+does. So the results are the same as those of ``_eval``.
+"""
+
+import numpy as np
+
+from .expressions import (AndExpression, BinaryExpression, ColumnExpression, CompExpression,
+                          FunctionExpression, IsNoneExpression, IsNotNoneExpression,
+                          NotExpression, OrExpression, Value, XorExpression, _basic_num_types,
+                          common_type)
+
+
+def compile_expression(expr):
+    if not isinstance(expr, CompiledExpression):
+        expr = CompiledExpression(expr)
+    return expr
+
+
+def _split(values, type_):
+    """splits numerical values into an array of numerical dtype and a validity mask, the
+    mask is None if no value is missing. returns (None, None) if values can not be
+    converted."""
+    if isinstance(values, np.ndarray):
+        if values.dtype.kind in "biuf":
+            return values, None
+        values = values.tolist()
+    valid = np.fromiter((v is not None for v in values), dtype=bool, count=len(values))
+    if valid.all():
+        valid = None
+    else:
+        fill = type_(0)
+        values = [fill if v is None else v for v in values]
+    data = np.array(values)
+    if data.ndim != 1 or data.dtype.kind not in "biuf":
+        return None, None
+    return data, valid
+
+
+class _Vector(object):
+
+    """result of a step. if ``typed`` is set, ``data`` is a numpy array of numerical dtype and
+    ``valid`` flags the values which are not None, or is None if no value is missing. other
+    results are kept as ``_eval`` returns them.
+    """
+
+    __slots__ = ("data", "valid", "idx", "type_", "typed")
+
+    def __init__(self, data, valid, idx, type_, typed):
+        self.data = data
+        self.valid = valid
+        self.idx = idx
+        self.type_ = type_
+        self.typed = typed
+
+    @classmethod
+    def from_arrays(clz, data, valid, idx, type_):
+        if valid is not None and valid.all():
+            valid = None
+        return clz(data, valid, idx, type_, True)
+
+    @classmethod
+    def from_eval_result(clz, result):
+        values, idx, type_ = result
+        if type_ in _basic_num_types:
+            data, valid = _split(values, type_)
+            if data is not None:
+                return clz(data, valid, idx, type_, True)
+        return clz(values, None, idx, type_, False)
+
+    def __len__(self):
+        return len(self.data)
+
+    def valid_mask(self):
+        if self.valid is None:
+            return np.ones((len(self.data),), dtype=bool)
+        return self.valid
+
+    def eval_result(self):
+        """converts to the representation ``_eval`` uses: missing values are None entries of
+        an object array"""
+        if not self.typed or self.valid is None:
+            return self.data, self.idx, self.type_
+        values = self.data.astype(object)
+        values[~self.valid] = None
+        return values, self.idx, self.type_
+
+    def operand(self):
+        """as :py:meth:`eval_result`, but boolean arrays are converted to object arrays as
+        ``_eval`` creates them for comparisons, numpy refuses arithmetic on boolean
+        arrays"""
+        values, idx, type_ = self.eval_result()
+        if isinstance(values, np.ndarray) and values.dtype.kind == "b":
+            values = values.astype(object)
+        return values, idx, type_
+
+    def flags(self):
+        """truth values as boolean array, missing values are False"""
+        if self.typed:
+            flags = self.data.astype(bool)
+            if self.valid is not None:
+                flags &= self.valid
+            return flags
+        return np.array([bool(v) for v in self.data], dtype=bool)
+
+
+def _both_valid(left, right, n):
+    """combined validity mask for operands which are broadcast to length n"""
+    masks = [v.valid if len(v.valid) == n else np.repeat(v.valid, n)
+             for v in (left, right) if v.valid is not None]
+    if not masks:
+        return None
+    if len(masks) == 1:
+        return masks[0]
+    return masks[0] & masks[1]
+
+
+class _ColumnStep(object):
+
+    children = ()
+
+    def __init__(self, expr):
+        self.expr = expr
+        # the ctx entry of the last run and its conversion, so in nested loop joins the columns
+        # of the right table are converted once and not for every row of the left table:
+        self.last = (None, None)
+
+    def run(self, ctx, results):
+        expr = self.expr
+        cx = ctx.get(expr.table) if ctx is not None else None
+        if cx is None:
+            return _Vector.from_eval_result(expr._eval(None))
+        entry = cx.get(expr.colname)
+        last_entry, vector = self.last
+        if entry is not last_entry:
+            vector = _Vector.from_eval_result(entry)
+            self.last = (entry, vector)
+        return vector
+
+
+class _ValueStep(object):
+
+    children = ()
+
+    def __init__(self, expr):
+        self.vector = _Vector.from_eval_result(expr._eval(None))
+
+    def run(self, ctx, results):
+        return self.vector
+
+
+class _FallbackStep(object):
+
+    """evaluates expressions the compiler does not know with ``_eval``"""
+
+    children = ()
+
+    def __init__(self, expr):
+        self.expr = expr
+
+    def run(self, ctx, results):
+        return _Vector.from_eval_result(self.expr._eval(ctx))
+
+
+class _CompareStep(object):
+
+    def __init__(self, expr, left, right):
+        self.expr = expr
+        self.children = (left, right)
+
+    def run(self, ctx, results):
+        expr = self.expr
+        left, right = [results[i] for i in self.children]
+        if not (left.typed and right.typed):
+            return _Vector.from_eval_result(expr._compare(left.eval_result(),
+                                                          right.eval_result()))
+        nl, nr = len(left), len(right)
+        assert nl <= 1 or nr <= 1 or nl == nr, "column lengths do not fit"
+        if nl == 0 or nr == 0:
+            return _Vector.from_arrays(np.zeros((0,), dtype=bool), None, None, bool)
+
+        # for sorted columns we use binary search. missing values break the order, they
+        # compare as False on this path, as in CompExpression._compare:
+        if nr == 1 and right.valid is None and left.idx is not None:
+            if left.valid is None:
+                data = expr.fastcomp(left.data, right.data[0])
+            else:
+                data = expr.comparator(left.data, right.data) & left.valid
+            return _Vector.from_arrays(data, None, None, bool)
+        if nl == 1 and left.valid is None and right.idx is not None:
+            if right.valid is None:
+                data = expr.rfastcomp(left.data[0], right.data)
+            else:
+                data = expr.comparator(left.data, right.data) & right.valid
+            return _Vector.from_arrays(data, None, None, bool)
+
+        data = expr.comparator(left.data, right.data)
+        return _Vector.from_arrays(data, _both_valid(left, right, len(data)), None, bool)
+
+
+class _BinaryStep(object):
+
+    def __init__(self, expr, left, right):
+        self.expr = expr
+        self.children = (left, right)
+
+    def run(self, ctx, results):
+        expr = self.expr
+        left, right = [results[i] for i in self.children]
+        ll, lr = len(left), len(right)
+        if not (left.typed and right.typed) or ll == lr == 0 \
+                or "b" in (left.data.dtype.kind, right.data.dtype.kind):
+            # numpy does not subtract boolean arrays, BinaryExpression._combine handles them:
+            return _Vector.from_eval_result(expr._combine(left.operand(), right.operand()))
+        assert ll == 1 or lr == 1 or ll == lr, "can not cast sizes %d and %d" % (ll, lr)
+
+        # as in BinaryExpression._combine:
+        idx = None
+        if ll == 1:
+            if expr.symbol in "+-":
+                idx = right.idx
+            elif expr.symbol in "*/" and left.data[0] > 0:
+                idx = right.idx
+        if lr == 1:
+            if expr.symbol in "+-":
+                idx = left.idx
+            elif expr.symbol in "*/" and right.data[0] > 0:
+                idx = left.idx
+
+        n = lr if ll == 1 else ll
+        valid = _both_valid(left, right, n)
+        rdata = right.data
+        if expr.symbol == "/":
+            # division by zero results in None:
+            by_zero = rdata == 0
+            if by_zero.any():
+                rdata = np.where(by_zero, 1, rdata)
+                if valid is None:
+                    valid = np.ones((n,), dtype=bool)
+                valid = valid & ~by_zero
+
+        ct = expr.res_type or common_type(left.type_, right.type_)
+        data = expr.efun(left.data, rdata).astype(ct)  # downcast: 2/3 -> 0 for int
+        if data.dtype.kind not in "biuf":
+            return _Vector.from_eval_result(expr._combine(left.operand(), right.operand()))
+        return _Vector.from_arrays(data, valid, idx, ct)
+
+
+class _LogicStep(object):
+
+    """three valued logic: None is "unknown", so ``False & None`` is ``False`` and
+    ``True | None`` is ``True``, see the operation tables of the logic expressions"""
+
+    def __init__(self, expr, left, right):
+        self.expr = expr
+        self.children = (left, right)
+
+    def run(self, ctx, results):
+        expr = self.expr
+        left, right = [results[i] for i in self.children]
+        if not (left.typed and right.typed and left.data.dtype == bool
+                and right.data.dtype == bool):
+            return _Vector.from_eval_result(expr._combine(left.eval_result(),
+                                                          right.eval_result()))
+        nl, nr = len(left), len(right)
+        if nl != 1 and nr != 1 and nl != nr:
+            raise Exception("operands for or-operation have different length %s and %s"
+                            % (nl, nr))
+        lv, rv = left.valid_mask(), right.valid_mask()
+        if isinstance(expr, XorExpression):
+            return _Vector.from_arrays(left.data ^ right.data, lv & rv, None, bool)
+
+        l_true, r_true = left.data & lv, right.data & rv
+        l_false, r_false = ~left.data & lv, ~right.data & rv
+        if isinstance(expr, AndExpression):
+            data = l_true & r_true
+            valid = data | l_false | r_false
+        else:
+            data = l_true | r_true
+            valid = data | (l_false & r_false)
+        return _Vector.from_arrays(data, valid, None, bool)
+
+
+class _NotStep(object):
+
+    def __init__(self, expr, child):
+        self.expr = expr
+        self.children = (child,)
+
+    def run(self, ctx, results):
+        child = results[self.children[0]]
+        if not child.typed:
+            return _Vector.from_eval_result(self.expr._apply(child.eval_result()))
+        return _Vector.from_arrays(child.data == 0, child.valid, None, bool)
+
+
+class _FunctionStep(object):
+
+    def __init__(self, expr, child):
+        self.expr = expr
+        self.children = (child,)
+
+    def run(self, ctx, results):
+        child = results[self.children[0]]
+        return _Vector.from_eval_result(self.expr._apply(child.eval_result()))
+
+
+class _IsNoneStep(object):
+
+    def __init__(self, expr, child):
+        self.negate = isinstance(expr, IsNotNoneExpression)
+        self.children = (child,)
+
+    def run(self, ctx, results):
+        child = results[self.children[0]]
+        if child.typed:
+            missing = ~child.valid_mask()
+        else:
+            missing = np.array([v is None for v in child.data], dtype=bool)
+        return _Vector.from_arrays(~missing if self.negate else missing, None, None, bool)
+
+
+def _value_key(value):
+    try:
+        hash(value)
+    except TypeError:
+        return id(value)
+    # 1, 1.0 and True are equal keys, but have different results:
+    return (type(value), value)
+
+
+class CompiledExpression(object):
+
+    """evaluation plan for an expression, see the module doc. ``evaluate`` returns the same
+    as ``expr._eval``, ``evaluate_flags`` the truth values of the result as a boolean array.
+
+    Example::
+
+        compiled = compile_expression((t.mz >= 100) & (t.mz <= 200))
+        values, idx, type_ = compiled.evaluate(ctx)
+    """
+
+    def __init__(self, expr):
+        self.expr = expr
+        self.steps = []
+        self.keys = dict()
+        self.root = self._add(expr)
+
+    def _add(self, expr):
+        if isinstance(expr, ColumnExpression):
+            key = ("column", id(expr.table), expr.colname, id(getattr(expr, "_rows", None)))
+            return self._step(key, lambda: _ColumnStep(expr))
+        if isinstance(expr, Value):
+            return self._step(("value", _value_key(expr.value)), lambda: _ValueStep(expr))
+        if isinstance(expr, CompExpression):
+            left, right = self._add(expr.left), self._add(expr.right)
+            key = (type(expr), left, right)
+            return self._step(key, lambda: _CompareStep(expr, left, right))
+        if type(expr) is BinaryExpression:
+            left, right = self._add(expr.left), self._add(expr.right)
+            # the operators create a new efun for every expression, other efuns may differ:
+            efun = None if expr.symbol in ("+", "-", "*", "/") else id(expr.efun)
+            key = ("binary", expr.symbol, efun, expr.res_type, left, right)
+            return self._step(key, lambda: _BinaryStep(expr, left, right))
+        if isinstance(expr, (AndExpression, OrExpression, XorExpression)):
+            left, right = self._add(expr.left), self._add(expr.right)
+            key = (type(expr), left, right)
+            return self._step(key, lambda: _LogicStep(expr, left, right))
+        if type(expr) is NotExpression:
+            child = self._add(expr.child)
+            return self._step(("not", child), lambda: _NotStep(expr, child))
+        if isinstance(expr, FunctionExpression):
+            child = self._add(expr.child)
+            key = ("function", id(expr.efun), expr.filter_nones, expr.res_type, child)
+            return self._step(key, lambda: _FunctionStep(expr, child))
+        if isinstance(expr, (IsNoneExpression, IsNotNoneExpression)):
+            child = self._add(expr.child)
+            return self._step((type(expr), child), lambda: _IsNoneStep(expr, child))
+        return self._step(("expression", id(expr)), lambda: _FallbackStep(expr))
+
+    def _step(self, key, create):
+        """returns the position of the step for ``key``, so equal subexpressions are
+        evaluated once"""
+        position = self.keys.get(key)
+        if position is None:
+            position = self.keys[key] = len(self.steps)
+            self.steps.append(create())
+        return position
+
+    def _run(self, ctx):
+        results = []
+        for step in self.steps:
+            results.append(step.run(ctx, results))
+        return results[self.root]
+
+    def evaluate(self, ctx=None):
+        values, idx, type_ = self._run(ctx).eval_result()
+        if isinstance(self.steps[self.root], _ColumnStep) and isinstance(values, np.ndarray):
+            # the caller may modify the result, the column must not change:
+            values = values.copy()
+        return values, idx, type_
+
+    def evaluate_flags(self, ctx=None):
+        return self._run(ctx).flags()
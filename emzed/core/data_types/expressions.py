@@ -6,6 +6,7 @@ import warnings
 import numpy as np
 
 import col_types
+from group_by import Groups
 
 __doc__ = """
 
@@ -206,6 +207,13 @@ class Lookup(object):
     def find(self, value):
         pass
 
+    def find_all(self, values):
+        """finds matches for all given ``values`` at once. returns two numpy arrays with
+        indices into ``values`` and the corresponding matching indices. the matches for
+        every value have the same order as the result of :py:meth:`find`.
+        """
+        return MultiDimLookup([self.values], *self._tolerances()).find_all([values])
+
 
 class ExactLookup(Lookup):
 
@@ -220,6 +228,9 @@ class ExactLookup(Lookup):
     def find(self, value):
         return self.index.get(value, [])
 
+    def _tolerances(self):
+        return [None], [None]
+
 
 class _FuzzyLookup(Lookup):
 
@@ -260,6 +271,9 @@ class FuzzyAbsoluteLookup(_FuzzyLookup):
         except TypeError:
             raise TypeError("computing absolute distance of %s and %s failed" % (refernce, other))
 
+    def _tolerances(self):
+        return [self.tol], [None]
+
 
 class FuzzyRelativeLookup(_FuzzyLookup):
 
@@ -281,6 +295,199 @@ class FuzzyRelativeLookup(_FuzzyLookup):
         except TypeError:
             raise TypeError("computing relative distance of %s and %s failed" % (refernce, other))
 
+    def _tolerances(self):
+        return [None], [self.tol]
+
+
+class _LookupDimension(object):
+
+    """one dimension of a MultiDimLookup: we assign every value to a cell and matching values
+    are found in the same or the neighbouring cells. the cells and the checks are the same as
+    in ExactLookup, FuzzyAbsoluteLookup and FuzzyRelativeLookup.
+    """
+
+    def __init__(self, values, abs_tol, rel_tol):
+        assert abs_tol is None or rel_tol is None, ("you are not allowed to provide rel_tol and"
+                                                    " abs_tol for the same column")
+        if abs_tol is not None:
+            assert abs_tol > 0.0
+        if rel_tol is not None:
+            assert rel_tol > 0.0
+        self.abs_tol = abs_tol
+        self.rel_tol = rel_tol
+        if abs_tol is None and rel_tol is None:
+            self.codes = dict()
+            for v in values:
+                if v is not None and v not in self.codes:
+                    self.codes[v] = len(self.codes)
+            self.offsets = (0,)
+            self.width = None
+        else:
+            self.offsets = (-1, 0, 1)
+            if abs_tol is not None:
+                self.width = abs_tol
+            else:
+                present = [v for v in values if v is not None]
+                self.width = max(present) * rel_tol if present else 1.0
+
+    def prepare(self, values):
+        """returns cell numbers, values as needed for _fit and a flag array for valid
+        entries"""
+        n = len(values)
+        if self.width is None:
+            cells = np.fromiter((self.codes.get(v, -1) if v is not None else -1
+                                 for v in values), dtype=np.int64, count=n)
+            return cells, None, cells >= 0
+        values = np.array([np.nan if v is None else v for v in values], dtype=float)
+        valid = ~np.isnan(values)
+        cells = np.zeros((n,), dtype=np.int64)
+        # int() in FuzzyAbsoluteLookup._bin truncates towards zero, we do the same:
+        cells[valid] = np.trunc(values[valid] / self.width)
+        return cells, values, valid
+
+    def fit(self, reference, other):
+        if self.abs_tol is not None:
+            return np.abs(reference - other) <= self.abs_tol
+        if self.rel_tol is not None:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                return np.where(reference == 0.0, other == reference,
+                                np.abs(other - reference) / reference <= self.rel_tol)
+        return np.ones((len(reference),), dtype=bool)
+
+
+class MultiDimLookup(object):
+
+    """finds exact or approximate matches for several columns at once, e.g. m/z and rt values.
+
+    ``columns`` is a list of value sequences with equal length, ``abs_tols`` and ``rel_tols``
+    are lists with a tolerance or None per column. If both are None for a column, values
+    of this column have to match exactly.
+
+    Example::
+
+        lookup = MultiDimLookup([mzs, rts], abs_tols=[None, 30.0], rel_tols=[5e-6, None])
+        indices = lookup.find((mz, rt))
+    """
+
+    def __init__(self, columns, abs_tols=None, rel_tols=None):
+        n_dim = len(columns)
+        assert n_dim > 0
+        if abs_tols is None:
+            abs_tols = [None] * n_dim
+        if rel_tols is None:
+            rel_tols = [None] * n_dim
+        assert len(abs_tols) == n_dim and len(rel_tols) == n_dim
+        columns = [list(c) for c in columns]
+        n = len(columns[0])
+        assert all(len(c) == n for c in columns), "columns have different lengths"
+
+        self.values = zip(*columns) if n_dim > 1 else columns[0]
+        self.dimensions = [_LookupDimension(c, a, r)
+                           for (c, a, r) in zip(columns, abs_tols, rel_tols)]
+
+        prepared = [d.prepare(c) for (d, c) in zip(self.dimensions, columns)]
+        self.cells = [p[0] for p in prepared]
+        self.fit_values = [p[1] for p in prepared]
+        valid = np.ones((n,), dtype=bool)
+        for p in prepared:
+            valid &= p[2]
+        self.indices = np.where(valid)[0]
+
+        # we combine the cell numbers of the dimensions to one integer key:
+        self.cell_min = []
+        self.cell_max = []
+        self.strides = []
+        stride = 1
+        for cells in self.cells:
+            cells = cells[self.indices]
+            c_min = cells.min() if len(cells) else 0
+            c_max = cells.max() if len(cells) else 0
+            self.cell_min.append(c_min)
+            self.cell_max.append(c_max)
+            self.strides.append(stride)
+            stride *= int(c_max - c_min) + 1
+        if stride >= 2 ** 62:
+            raise Exception("cell grid too large, maybe your tolerances are too small")
+
+        keys = self._keys([cells[self.indices] for cells in self.cells], (0,) * n_dim)[0]
+        order = np.argsort(keys, kind="mergesort")
+        self.sorted_keys = keys[order]
+        self.indices = self.indices[order]
+
+    def _keys(self, cells, offsets):
+        n = len(cells[0])
+        keys = np.zeros((n,), dtype=np.int64)
+        valid = np.ones((n,), dtype=bool)
+        for c, offset, c_min, c_max, stride in zip(cells, offsets, self.cell_min, self.cell_max,
+                                                   self.strides):
+            c = c + offset
+            valid &= (c >= c_min) & (c <= c_max)
+            keys += (c - c_min) * stride
+        return keys, valid
+
+    def find(self, value):
+        """returns list of indices of matching entries for one value, which is a tuple
+        if this lookup has more than one column"""
+        if len(self.dimensions) == 1:
+            value = (value,)
+        __, matches = self.find_all([[v] for v in value])
+        return matches.tolist()
+
+    def find_all(self, columns):
+        """finds matches for all rows of the given ``columns`` at once. returns two numpy
+        arrays: the row indices and the corresponding indices of the matching entries in the
+        lookup. matches of a row are ordered first by neighbouring cell, then by index, this
+        is the same as :py:meth:`Lookup.find` does.
+        """
+        assert len(columns) == len(self.dimensions)
+        columns = [list(c) for c in columns]
+        n = len(columns[0])
+        prepared = [d.prepare(c) for (d, c) in zip(self.dimensions, columns)]
+        cells = [p[0] for p in prepared]
+        valid = np.ones((n,), dtype=bool)
+        for p in prepared:
+            valid &= p[2]
+
+        all_offsets = [()]
+        for d in self.dimensions:
+            all_offsets = [o + (oi,) for o in all_offsets for oi in d.offsets]
+
+        rows = []
+        matches = []
+        offset_ranks = []
+        for rank, offsets in enumerate(all_offsets):
+            keys, valid_keys = self._keys(cells, offsets)
+            valid_keys &= valid
+            lo = np.searchsorted(self.sorted_keys, keys, "left")
+            hi = np.searchsorted(self.sorted_keys, keys, "right")
+            counts = np.where(valid_keys, hi - lo, 0)
+            total = counts.sum()
+            if total == 0:
+                continue
+            starts = np.repeat(lo - np.cumsum(counts) + counts, counts)
+            positions = np.arange(total) + starts
+            rows.append(np.repeat(np.arange(n), counts))
+            matches.append(self.indices[positions])
+            offset_ranks.append(np.zeros((total,), dtype=int) + rank)
+
+        if not rows:
+            return np.zeros((0,), dtype=int), np.zeros((0,), dtype=int)
+
+        rows = np.concatenate(rows)
+        matches = np.concatenate(matches)
+        offset_ranks = np.concatenate(offset_ranks)
+
+        fits = np.ones((len(rows),), dtype=bool)
+        for d, p, fit_values in zip(self.dimensions, prepared, self.fit_values):
+            if fit_values is not None:
+                fits &= d.fit(p[1][rows], fit_values[matches])
+
+        rows = rows[fits]
+        matches = matches[fits]
+        offset_ranks = offset_ranks[fits]
+        order = np.lexsort((matches, offset_ranks, rows))
+        return rows[order], matches[order]
+
 
 
 class BaseExpression(object):
@@ -416,7 +623,7 @@ class BaseExpression(object):
         return XorExpression(self, other)
 
     def __invert__(self):
-        return FunctionExpression(lambda a: not a, "not", self, bool)
+        return NotExpression(self)
 
     def _neededColumns(self):
         lc = self.left._neededColumns()
@@ -497,8 +704,7 @@ class BaseExpression(object):
         Example: ``tab.id.isIn([1,2,3])``
 
         """
-        return FunctionExpression(lambda a, b=li: a in b, "%%s.isIn(%s)" % list(li),
-                                  self, bool)
+        return IsInExpression(self, li)
 
     def inRange(self, minv, maxv):
         """
@@ -599,7 +805,7 @@ class BaseExpression(object):
 
         Example: ``tab.rt.min``
         """
-        return AggregateExpression(self, lambda v: min(v), "min(%s)", None)
+        return AggregateExpression(self, lambda v: min(v), "min(%s)", None, reduction="min")
 
     @property
     def allTrue(self):
@@ -695,7 +901,7 @@ class BaseExpression(object):
 
         Example: ``tab.rt.max``
         """
-        return AggregateExpression(self, lambda v: max(v), "max(%s)", None)
+        return AggregateExpression(self, lambda v: max(v), "max(%s)", None, reduction="max")
 
     @property
     def sum(self):
@@ -706,7 +912,7 @@ class BaseExpression(object):
         Example: ``tab.area.sum``
 
         """
-        return AggregateExpression(self, lambda v: sum(v), "sum(%s)", None)
+        return AggregateExpression(self, lambda v: sum(v), "sum(%s)", None, reduction="sum")
 
     @property
     def mean(self):
@@ -716,7 +922,8 @@ class BaseExpression(object):
 
         Example: ``tab.area.mean``
         """
-        return AggregateExpression(self, lambda v: np.mean(v).tolist(), "mean(%s)", float)
+        return AggregateExpression(self, lambda v: np.mean(v).tolist(), "mean(%s)", float,
+                                   reduction="mean")
 
     @property
     def median(self):
@@ -726,7 +933,8 @@ class BaseExpression(object):
 
         Example: ``tab.area.mean``
         """
-        return AggregateExpression(self, lambda v: np.median(v).tolist(), "mean(%s)", float)
+        return AggregateExpression(self, lambda v: np.median(v).tolist(), "mean(%s)", float,
+                                   reduction="median")
 
     @property
     def std(self):
@@ -736,7 +944,8 @@ class BaseExpression(object):
 
         Example: ``tab.area.std``
         """
-        return AggregateExpression(self, lambda v: np.std(v).tolist(), "stddev(%s)", float)
+        return AggregateExpression(self, lambda v: np.std(v).tolist(), "stddev(%s)", float,
+                                   reduction="std")
 
     @property
     def len(self):
@@ -746,7 +955,7 @@ class BaseExpression(object):
         instead.
         """
         return AggregateExpression(self, lambda v: len(v), "len(%s)",
-                                   int, ignore_none=False, default_empty=0)
+                                   int, ignore_none=False, default_empty=0, reduction="count")
 
     @property
     def count(self):
@@ -759,7 +968,7 @@ class BaseExpression(object):
         replaces ``len` expression.
         """
         return AggregateExpression(self, lambda v: len(v), "count(%s)",
-                                   int, ignore_none=False, default_empty=0)
+                                   int, ignore_none=False, default_empty=0, reduction="count")
 
     @property
     def count_different(self):
@@ -912,8 +1121,12 @@ class CompExpression(BaseExpression):
     # very error prone:
 
     def _eval(self, ctx=None):
-        lhs, ixl, tl = saveeval(self.left, ctx)
-        rhs, ixr, tr = saveeval(self.right, ctx)
+        return self._compare(saveeval(self.left, ctx), saveeval(self.right, ctx))
+
+    def _compare(self, left_result, right_result):
+        # works on the evaluated operands, also used by the expression compiler:
+        lhs, ixl, tl = left_result
+        rhs, ixr, tr = right_result
 
         assert len(lhs) <= 1 or len(rhs) <= 1 or len(lhs) == len(rhs),\
             "column lengths do not fit"
@@ -1147,8 +1360,12 @@ class BinaryExpression(BaseExpression):
         self.res_type = res_type
 
     def _eval(self, ctx=None):
-        lvals, idxl, tl = saveeval(self.left, ctx)
-        rvals, idxr, tr = saveeval(self.right, ctx)
+        return self._combine(saveeval(self.left, ctx), saveeval(self.right, ctx))
+
+    def _combine(self, left_result, right_result):
+        # works on the evaluated operands, also used by the expression compiler:
+        lvals, idxl, tl = left_result
+        rvals, idxr, tr = right_result
 
         ll = len(lvals)
         lr = len(rvals)
@@ -1225,12 +1442,15 @@ class BinaryExpression(BaseExpression):
 
 class GroupedAggregateExpression(BaseExpression):
 
-    def __init__(self, left, efun, default_empty, ignore_none, group_by_columns):
+    def __init__(self, left, efun, default_empty, ignore_none, group_by_columns,
+                 reduction=None):
         self.left = left
         self.efun = efun
         self.default_empty = default_empty
         self.ignore_none = ignore_none
         self.group_by_columns = group_by_columns
+        # name of the reduction in group_by.REDUCTIONS which computes efun, if any:
+        self.reduction = reduction
 
     def _evalsize(self, ctx=None):
         return self.left._evalsize(ctx)
@@ -1243,35 +1463,63 @@ class GroupedAggregateExpression(BaseExpression):
             values, __, group_type = saveeval(group_by_column, ctx)
             group_values.append(values)
 
-        group_values = zip(*group_values)
+        groups = Groups.from_columns(group_values, len(child_values))
+        first_rows = groups.first_rows
+        none_in_key = np.zeros((len(groups),), dtype=bool)
+        for values in group_values:
+            if not isinstance(values, np.ndarray) or values.dtype.kind not in "biuf":
+                none_in_key |= np.array([values[i] is None for i in first_rows], dtype=bool)
 
-        grouped_values = collections.defaultdict(list)
-        for (g, v) in zip(group_values, child_values):
-            grouped_values[g].append(v)
+        result = self._reduce(groups, child_values, none_in_key)
+        if result is not None:
+            return result
 
-        aggregated_values = dict()
-        for g, values in grouped_values.items():
+        aggregated_values = []
+        for g, rows in enumerate(groups):
+            values = [child_values[i] for i in rows]
             if self.ignore_none:
                 values = [v for v in values if v is not None]
             if not len(values):
-                aggregated_values[g] = self.default_empty
-            elif any(gi is None for gi in g):
-                aggregated_values[g] = None
+                aggregated_values.append(self.default_empty)
+            elif none_in_key[g]:
+                aggregated_values.append(None)
             else:
-                type_ = common_type_for(values)
                 values = np.array(values)
-                aggregated_values[g] = self.efun(values)
+                aggregated_values.append(self.efun(values))
 
-        result = [aggregated_values[g] for g in group_values]
+        result = [aggregated_values[g] for g in groups.codes]
         type_ = common_type_for(result)
         result = container(type_)(result)
         type_ = cleanup(type_)
         return np.array(result), None, type_
 
+    def _reduce(self, groups, child_values, none_in_key):
+        """vectorized evaluation for the standard aggregations of numerical values, returns
+        None if not applicable"""
+        if self.reduction is None or not len(groups) or none_in_key.all():
+            return None
+        if self.reduction != "count":
+            numerical = isinstance(child_values, np.ndarray) and child_values.dtype.kind in "biuf"
+            if not numerical:
+                return None
+        aggregated = groups.reduce(child_values, self.reduction)
+        if self.reduction in ("min", "max") and aggregated.dtype.kind == "b":
+            type_ = bool
+        elif aggregated.dtype.kind == "f":
+            type_ = float
+        else:
+            type_ = int
+        result = aggregated[groups.codes]
+        if none_in_key.any():
+            result = result.astype(object)
+            result[none_in_key[groups.codes]] = None
+        return result, None, type_
+
 
 class AggregateExpression(BaseExpression):
 
-    def __init__(self, left, efun, funname, res_type=None, ignore_none=True, default_empty=None):
+    def __init__(self, left, efun, funname, res_type=None, ignore_none=True, default_empty=None,
+                 reduction=None):
         if not isinstance(left, BaseExpression):
             left = Value(left)
         self.left = left
@@ -1280,10 +1528,11 @@ class AggregateExpression(BaseExpression):
         self.res_type = res_type
         self.ignore_none = ignore_none
         self.default_empty = default_empty
+        self.reduction = reduction
 
     def group_by(self, *group_by_columns):
         return GroupedAggregateExpression(self.left, self.efun, self.default_empty,
-                                          self.ignore_none, group_by_columns)
+                                          self.ignore_none, group_by_columns, self.reduction)
 
     def __call__(self):
         values, _, type_ = self._eval()
@@ -1332,9 +1581,12 @@ class LogicExpression(BaseExpression):
             print "warning: parenthesis for logic op set ?"
 
     def _eval(self, ctx=None):
+        return self._combine(saveeval(self.left, ctx), saveeval(self.right, ctx))
+
+    def _combine(self, left_result, right_result):
         op = lambda a, b: self.operation_table[a, b]
-        lhs, _, tlhs = saveeval(self.left, ctx)
-        rhs, _, trhs = saveeval(self.right, ctx)
+        lhs, _, tlhs = left_result
+        rhs, _, trhs = right_result
         if len(lhs) == 1:
             return np.array([op(lhs[0], r) for r in rhs], dtype=object), None, bool
         elif len(rhs) == 1:
@@ -1480,7 +1732,11 @@ class FunctionExpression(BaseExpression):
         self.filter_nones = filter_nones
 
     def _eval(self, ctx=None):
-        values, index, type_ = saveeval(self.child, ctx)
+        return self._apply(saveeval(self.child, ctx))
+
+    def _apply(self, child_result):
+        # works on the evaluated child, also used by the expression compiler:
+        values, index, type_ = child_result
         # the second expressions is true if values contains no Nones,
         # so we can apply ufucns/vecorized funs
         if len(values) == 0:
@@ -1526,6 +1782,26 @@ class FunctionExpression(BaseExpression):
         return self.child._neededColumns()
 
 
+class IsInExpression(FunctionExpression):
+
+    """keeps the values of ``isIn`` so that the expression can be translated to other query
+    languages, see :py:mod:`~emzed.core.data_types.hdf5.query`"""
+
+    def __init__(self, child, values):
+        super(IsInExpression, self).__init__(lambda a, b=values: a in b,
+                                             "%%s.isIn(%s)" % list(values), child, bool)
+        self.choices = values
+
+
+class NotExpression(FunctionExpression):
+
+    """logical negation ``~a``, a class of its own so that the expression compiler can
+    recognize it"""
+
+    def __init__(self, child):
+        super(NotExpression, self).__init__(lambda a: not a, "not", child, bool)
+
+
 class IfThenElse(BaseExpression):
 
     def __init__(self, e1, e2, e3):
@@ -1646,15 +1922,39 @@ class ColumnExpression(BaseExpression):
 
     def __init__(self, table, colname, idx, type_, rows=None):
         self.table = table
-        self.rows = rows if rows is not None else table.rows
+        self._rows = rows
         self.colname = colname
         self.idx = idx
         self.type_ = type_
 
+    @property
+    def rows(self):
+        # we do not keep table.rows here, as this would convert a table with columnar storage
+        # to row wise storage:
+        if self._rows is not None:
+            return self._rows
+        try:
+            # does not copy the rows of a table which is a view to another table:
+            return self.table._rowsWithoutConversion()
+        except AttributeError:
+            return self.table.rows
+
+    def _columnValues(self):
+        if self._rows is not None:
+            return None
+        try:
+            return self.table._columnValues(self.idx)
+        except AttributeError:
+            return None
+
     def _setupValues(self):
         # delayed lazy evaluation
         if not hasattr(self, "_values"):
-            self._values = tuple(row[self.idx] for row in self.rows)
+            column_values = self._columnValues()
+            if column_values is not None:
+                self._values = tuple(column_values.tolist())
+            else:
+                self._values = tuple(row[self.idx] for row in self.rows)
 
     @property
     def values(self):
@@ -1668,6 +1968,8 @@ class ColumnExpression(BaseExpression):
         return dd
 
     def __setstate__(self, dd):
+        if "rows" in dd:
+            dd["_rows"] = dd.pop("rows")
         self.__dict__ = dd
 
     def __iter__(self):
@@ -1678,15 +1980,12 @@ class ColumnExpression(BaseExpression):
         # self.values is always a list ! for speeding up things
         # we convert numerical types to np.ndarray during evaluation
         # of expressions
-        if ctx is None:
-            if self.type_ in _basic_num_types:
-                # the dtype of the following array is determined
-                # automatically, even if Nones are in values:
-                return np.array(self.values), None, self.type_
-            return self.values, None, self.type_
-        cx = ctx.get(self.table)
+        cx = ctx.get(self.table) if ctx is not None else None
         if cx is None:
             if self.type_ in _basic_num_types:
+                column_values = self._columnValues()
+                if column_values is not None:
+                    return column_values.copy(), None, self.type_
                 # the dtype of the following array is determined
                 # automatically, even if Nones are in values:
                 return np.array(self.values), None, self.type_
@@ -0,0 +1,68 @@
+# encoding: utf-8
+from __future__ import print_function, division, absolute_import
+
+import cPickle
+import hashlib
+
+import numpy as np
+
+
+# fingerprints are digests of the content of Spectrum, PeakMap and Table objects. other than
+# uniqueId() they are computed in one pass over contiguous buffers with a fast digest, so they
+# are suited for detecting duplicates at runtime. the values are not guaranteed to be stable
+# across emzed versions, so use uniqueId() for anything which is stored in files.
+
+_basic_types = (type(None), bool, int, long, float, str, unicode)
+
+
+def new_digest():
+    return hashlib.md5()
+
+
+def update_with_array(h, array):
+    """updates digest ``h`` with the content of a numerical numpy array"""
+    array = np.ascontiguousarray(array)
+    h.update("%s%r" % (array.dtype.str, array.shape))
+    h.update(buffer(array))
+
+
+def update_with_object(h, obj):
+    """updates digest ``h`` with the fingerprint or uniqueId of ``obj`` if available, else
+    with the pickled object"""
+    h.update(fingerprint(obj))
+
+
+def update_with_values(h, values):
+    """updates digest ``h`` with all values of the sequence ``values``, values of basic types
+    are pickled at once. returns list of the values which provide a fingerprint method."""
+    if all(type(v) in _basic_types for v in values):
+        h.update(cPickle.dumps(list(values), protocol=2))
+        return []
+    # the same object often appears many times, eg peakmaps in a table column:
+    digests = dict()
+    with_fingerprint = []
+    for v in values:
+        if type(v) in _basic_types:
+            h.update(cPickle.dumps(v, protocol=2))
+            continue
+        key = id(v)
+        if key not in digests:
+            digests[key] = fingerprint(v)
+            if hasattr(v, "fingerprint"):
+                with_fingerprint.append(v)
+        h.update(digests[key])
+    return with_fingerprint
+
+
+def fingerprint(obj):
+    """returns fingerprint of ``obj``, falls back to ``obj.uniqueId()`` or a digest of the
+    pickled object"""
+    method = getattr(obj, "fingerprint", None)
+    if method is not None:
+        return method()
+    method = getattr(obj, "uniqueId", None)
+    if method is not None:
+        return method()
+    h = new_digest()
+    h.update(cPickle.dumps(obj, protocol=2))
+    return h.hexdigest()
@@ -0,0 +1,122 @@
+# encoding: utf-8
+from __future__ import print_function, division, absolute_import
+
+import numpy as np
+
+
+# reductions which Groups.reduce computes for numerical values:
+REDUCTIONS = ("sum", "mean", "min", "max", "count", "std", "median")
+
+
+def factorize(values, key=None):
+    """returns tuple ``(codes, n)``, ``codes`` is an array which numbers the ``n`` different
+    values in ``values`` in order of their first appearance. ``key`` is an optional function
+    which maps values to hashable keys, as ``computekey`` does in ``table.py``. it is not
+    applied to numerical arrays.
+    """
+    if isinstance(values, np.ndarray) and values.dtype.kind in "biuf":
+        uniques, inverse = np.unique(values, return_inverse=True)
+        return _by_first_appearance(inverse.astype(np.int64), len(uniques))
+    seen = dict()
+    if key is not None:
+        values = (key(v) for v in values)
+    # len(seen) is evaluated before setdefault adds a new key:
+    codes = np.fromiter((seen.setdefault(v, len(seen)) for v in values), dtype=np.int64)
+    return codes, len(seen)
+
+
+def _by_first_appearance(codes, n):
+    if not n:
+        return codes, n
+    order = np.argsort(codes, kind="mergesort")
+    starts = np.zeros((n,), dtype=np.int64)
+    starts[1:] = np.cumsum(np.bincount(codes, minlength=n))[:-1]
+    first = order[starts]
+    renumbered = np.zeros((n,), dtype=np.int64)
+    renumbered[np.argsort(first)] = np.arange(n)
+    return renumbered[codes], n
+
+
+class Groups(object):
+
+    """groups of rows with equal keys. the key columns are factorized once, afterwards the
+    rows of every group are available as index arrays and numerical values can be reduced
+    per group with sort and segment operations instead of python loops.
+
+    groups are numbered in order of their first appearance, ``codes[i]`` is the group of row
+    ``i``.
+    """
+
+    def __init__(self, codes, n_groups):
+        self.codes = codes
+        self.n_groups = n_groups
+        # stable sort, so the rows in every group keep their order:
+        self.order = np.argsort(codes, kind="mergesort")
+        self.sizes = np.bincount(codes, minlength=n_groups).astype(np.int64)
+        self.offsets = np.zeros((n_groups + 1,), dtype=np.int64)
+        self.offsets[1:] = np.cumsum(self.sizes)
+
+    @classmethod
+    def from_columns(clz, columns, n_rows, key=None):
+        """groups rows by the values in ``columns``, which is a list of sequences with
+        ``n_rows`` values each. see :py:func:`~.factorize` for ``key``"""
+        if not columns:
+            return clz(np.zeros((n_rows,), dtype=np.int64), 1 if n_rows else 0)
+        codes, n = factorize(columns[0], key)
+        for values in columns[1:]:
+            codes_i, n_i = factorize(values, key)
+            codes, n = factorize(codes * n_i + codes_i)
+        return clz(codes, n)
+
+    def __len__(self):
+        return self.n_groups
+
+    def rows(self, group):
+        """sorted indices of the rows of ``group``"""
+        return self.order[self.offsets[group]:self.offsets[group + 1]]
+
+    def __iter__(self):
+        for group in range(self.n_groups):
+            yield self.rows(group)
+
+    @property
+    def first_rows(self):
+        """indices of the first row of every group, they are increasing"""
+        return self.order[self.offsets[:-1]]
+
+    def reduce(self, values, how):
+        """returns array with one result of reduction ``how`` per group, ``values`` is a
+        numerical array with one value per row. see ``REDUCTIONS`` for the available
+        reductions."""
+        if how not in REDUCTIONS:
+            raise Exception("unknown reduction %r" % how)
+        if how == "count":
+            return self.sizes.copy()
+        values = np.asarray(values)
+        if not self.n_groups:
+            return np.zeros((0,), dtype=np.float64 if how in ("mean", "std", "median")
+                            else values.dtype)
+        values = values[self.order]
+        starts = self.offsets[:-1]
+        if how == "sum":
+            if values.dtype.kind == "b":
+                values = values.astype(np.int64)
+            return np.add.reduceat(values, starts)
+        if how == "min":
+            return np.minimum.reduceat(values, starts)
+        if how == "max":
+            return np.maximum.reduceat(values, starts)
+
+        values = values.astype(np.float64)
+        means = np.add.reduceat(values, starts) / self.sizes
+        if how == "mean":
+            return means
+        if how == "std":
+            deviations = values - np.repeat(means, self.sizes)
+            return np.sqrt(np.add.reduceat(deviations * deviations, starts) / self.sizes)
+        # median: sort values within groups and take the middle values:
+        groups = np.repeat(np.arange(self.n_groups), self.sizes)
+        values = values[np.lexsort((values, groups))]
+        lower = starts + (self.sizes - 1) // 2
+        upper = starts + self.sizes // 2
+        return (values[lower] + values[upper]) / 2.0
@@ -2,6 +2,7 @@
 from __future__ import print_function, division
 
 import itertools
+import sys
 
 izip = itertools.izip
 
@@ -12,21 +13,21 @@ import numpy as np
 from tables import open_file, Filters, UInt64Col, UInt32Col
 
 from .store_manager import setup_manager
-from .bit_matrix import BitMatrix
-from .lru import LruDict
+from .column_flags import ColumnFlags, PackedFlags
+from ..memory_cache import Cache, MB, estimate_size
 
 from .install_profile import profile
 
-from .types import basic_type_map, none_replacements
+from .types import basic_type_map, none_replacements, indexed_types
 
 filters = Filters(complib="blosc", complevel=9)
 
 
 class Hdf5Base(object):
 
-    def _initial_setup(self, path, mode):
+    def _initial_setup(self, path, mode, **kw):
         self.file_ = open_file(path, mode)
-        self.manager = setup_manager(self.file_)
+        self.manager = setup_manager(self.file_, **kw)
 
     def close(self):
         self.manager.flush()
@@ -36,16 +37,23 @@ class Hdf5Base(object):
 
 class Hdf5TableWriter(Hdf5Base):
 
-    LATEST_HDF5_TABLE_VERSION = (2, 26, 20)
+    LATEST_HDF5_TABLE_VERSION = (2, 29, 4)
 
-    def __init__(self, path):
-        self._initial_setup(path, "w")
+    # number of rows we append to the hdf5 table at once:
+    BLOCK_SIZE = 100000
+
+    def __init__(self, path, mz_index=False):
+        """mz_index=True writes peakmaps a second time in a layout indexed by m/z, this speeds
+        up chromatogram extraction from Hdf5PeakMapProxy objects, see PeakMapStore.setup_tiles
+        """
+        self._initial_setup(path, "w", mz_index=mz_index)
         self.row_offset = 0
 
     def write_table(self, table):
 
         self._setup_for_table(table)
         self._add_rows(table)
+        self._create_indices(table)
 
     def _setup_for_table(self, table):
 
@@ -69,7 +77,7 @@ class Hdf5TableWriter(Hdf5Base):
         store_meta(col_types)
         store_meta(col_formats)
 
-        self.missing_values_flags = BitMatrix(file_, "flags", len(col_names))
+        self.missing_values_flags = ColumnFlags(file_, "missing_flags", len(col_names))
 
         # this table vesion was last modified in:
         store_meta(dict(hdf5_table_version=self.LATEST_HDF5_TABLE_VERSION))
@@ -86,25 +94,58 @@ class Hdf5TableWriter(Hdf5Base):
         self.row_table = file_.create_table(file_.root, "rows", description=description,
                                             filters=filters)
 
+    def _create_indices(self, table):
+        # indices speed up queries from Hdf5TableProxy.filter and .findMatchingRows, pytables
+        # updates them when we append rows later:
+        for name, type_ in izip(table.getColNames(), table.getColTypes()):
+            if type_ in indexed_types:
+                self.row_table.cols._f_col(name).create_index()
+
     @profile
     def _add_rows(self, table):
 
         col_names = table.getColNames()
         col_types = table.getColTypes()
+        rows = table.rows
+        n = len(rows)
 
         num_rows_exisiting = self.row_table.nrows
-        self.missing_values_flags.resize(num_rows_exisiting + len(table))
+        self.missing_values_flags.resize(num_rows_exisiting + n)
 
-        for row_index, row in enumerate(table.rows):
-            hdf_row = self.row_table.row
-            for col_index, value, name, type_ in izip(itertools.count(), row, col_names, col_types):
-                if value is None:
-                    self.missing_values_flags.set_bit(num_rows_exisiting + row_index, col_index)
+        # objects are written column by column, so every store writes all objects of a column
+        # in one step:
+        global_ids = {}
+        for col_index, type_ in enumerate(col_types):
+            if type_ not in basic_type_map:
+                values = [row[col_index] for row in rows]
+                present = np.fromiter((v is not None for v in values), dtype=bool, count=n)
+                ids = np.zeros((n,), dtype=np.uint64)
+                ids[present] = self.manager.store_objects(col_index,
+                                                          [v for v in values if v is not None],
+                                                          type_)
+                global_ids[col_index] = ids
+
+        missing_rows = [[] for __ in col_names]
+        for start in range(0, n, self.BLOCK_SIZE):
+            block = rows[start:start + self.BLOCK_SIZE]
+            data = np.zeros((len(block),), dtype=self.row_table.dtype)
+            for col_index, values, name, type_ in izip(itertools.count(), izip(*block),
+                                                       col_names, col_types):
+                missing = np.fromiter((v is None for v in values), dtype=bool, count=len(block))
+                if col_index in global_ids:
+                    data[name] = global_ids[col_index][start:start + len(block)]
+                elif missing.any():
+                    data[name][~missing] = [v for v in values if v is not None]
                 else:
-                    if type_ not in basic_type_map:
-                        value = self.manager.store_object(col_index, value, type_)
-                    hdf_row[name] = value
-            hdf_row.append()
+                    data[name] = values
+                if missing.any():
+                    missing_rows[col_index].append(np.where(missing)[0] + num_rows_exisiting
+                                                   + start)
+            self.row_table.append(data)
+
+        for col_index, rows in enumerate(missing_rows):
+            if rows:
+                self.missing_values_flags.set_flags(col_index, np.concatenate(rows))
 
         self.row_offset += len(table)
         self.flush()
@@ -124,9 +165,13 @@ class Hdf5TableReader(Hdf5Base):
     def __init__(self, path):
         self._initial_setup(path, "r+")
         self._load_meta()
-        self.row_cache = LruDict(10000)
-        self.col_cache = LruDict(100)
-        self.col_cache_raw = LruDict(100)
+        # values of other than basic types are held in the caches of the stores and rows only
+        # refer to them, so all rows have the same size:
+        row_size = sys.getsizeof([None] * len(self.col_types)) + sum(
+            estimate_size(0) for type_ in self.col_types if type_ in basic_type_map)
+        self.row_cache = Cache("hdf5 table rows", 64 * MB, sizeof=lambda row: row_size)
+        self.col_cache = Cache("hdf5 table columns", 256 * MB)
+        self.col_cache_raw = Cache("hdf5 table raw columns", 256 * MB)
 
     def _load_meta(self):
 
@@ -151,43 +196,83 @@ class Hdf5TableReader(Hdf5Base):
         self.hdf5_table_version = self.hdf5_meta["hdf5_table_version"]
         expected = Hdf5TableWriter.LATEST_HDF5_TABLE_VERSION
 
+        self.row_table = self.file_.root.rows
+        self.nrows = self.file_.root.rows.nrows
+
+        if ColumnFlags.exists(self.file_, "missing_flags"):
+            self.missing_values_flags = ColumnFlags(self.file_, "missing_flags",
+                                                    len(self.col_names))
+        else:
+            # we do not modify the file when reading, see _migrate_flags:
+            self.missing_values_flags = self._read_old_flags()
+
         if self.hdf5_table_version != expected:
-            if self.hdf5_table_version < (2, 26, 12):
-                if not hasattr(self.file_, "flags"):
-                    self.missing_values_flags = BitMatrix(self.file_, "flags", len(self.col_names))
-                    mv = self.file_.root.missing_values
-                    n = mv.nrows
-                    for s in range(0, n, 10000):
-                        rows = mv.cols.row_index[s: s + 10000]
-                        cols = mv.cols.col_index[s: s + 10000]
-                        self.missing_values_flags.resize(int(max(rows)) + 1)
-                        for row, col in itertools.iizip(rows, cols):
-                            self.missing_values_flags.set_bit(int(row), int(col))
-                    self.missing_values_flags.flush()
             message = ("you read from / append to a hdf5 table which has version %s and older "
                        "as the current version %s, you might have problems...." %
                        (self.hdf5_table_version, expected))
 
             warnings.warn(message, UserWarning, stacklevel=2)
 
-        # read full table -> numpy array -> list -> set
-        self.missing_values_flags = BitMatrix(self.file_, "flags", len(self.col_names))
-
-        self.row_table = self.file_.root.rows
-        self.nrows = self.file_.root.rows.nrows
+    def _read_old_flags(self):
+        root = self.file_.root
+        n_cols = len(self.col_names)
+        masks = [np.zeros((0,), dtype=bool)] * n_cols
+        if hasattr(root, "flags"):
+            # before version 2.29.4 the missing value flags were stored row by row in a
+            # BitMatrix, bit i of byte j is the flag of column 8 * j + i:
+            n_bytes = n_cols // 8 + 1
+            data = root.flags[:].reshape(-1, n_bytes)
+            masks = [(data[:, col >> 3] & (1 << (col & 7))) > 0 for col in range(n_cols)]
+        elif hasattr(root, "missing_values"):
+            # before version 2.26.12 the row and column indices of missing values were stored:
+            rows = root.missing_values.cols.row_index[:].astype(np.int64)
+            cols = root.missing_values.cols.col_index[:].astype(np.int64)
+            masks = []
+            for col in range(n_cols):
+                mask = np.zeros((self.nrows,), dtype=bool)
+                mask[rows[cols == col]] = True
+                masks.append(mask)
+        return PackedFlags.from_masks(masks, self.nrows)
+
+    def _migrate_flags(self):
+        """converts missing value flags in older layouts to ColumnFlags and updates the
+        version of the file. we do this only before modifying the file."""
+        old_flags = self.missing_values_flags
+        if not isinstance(old_flags, PackedFlags):
+            return
+        root = self.file_.root
+        flags = ColumnFlags(self.file_, "missing_flags", len(self.col_names))
+        flags.resize(self.nrows)
+        for col_index in range(len(self.col_names)):
+            mask = old_flags.flags_in_col(col_index)
+            if mask.any():
+                flags.set_flags(col_index, mask)
+        flags.flush()
+        for name in ("flags", "missing_values"):
+            if hasattr(root, name):
+                self.file_.remove_node(root, name)
+        self.missing_values_flags = flags
+
+        self.hdf5_table_version = Hdf5TableWriter.LATEST_HDF5_TABLE_VERSION
+        self.hdf5_meta = dict(self.hdf5_meta, hdf5_table_version=self.hdf5_table_version)
+        # the version is the fifth entry of the meta index, see Hdf5TableWriter:
+        root.meta_index.cols.index[4] = self.manager.store_object("meta", self.hdf5_meta,
+                                                                  object)
+        root.meta_index.flush()
 
     def fetch_row(self, row_index):
         row = self._fetch_row(row_index)
         return row
 
     def _fetch_row(self, row_index):
-        if row_index in self.row_cache:
-            return self.row_cache[row_index]
+        row = self.row_cache.get(row_index)
+        if row is not None:
+            return row
         values = self.row_table[row_index].tolist()
         row = []
-        missing = self.missing_values_flags.positions_in_row(row_index)
+        missing = self.missing_values_flags.flags_in_rows([row_index])[0]
         for (col_idx, value, type_) in izip(itertools.count(), values, self.col_types):
-            if col_idx in missing:
+            if missing[col_idx]:
                 value = None
             elif type_ not in basic_type_map:
                 value = self.manager.fetch(col_idx, value)
@@ -196,16 +281,15 @@ class Hdf5TableReader(Hdf5Base):
         return row
 
     def _replace_column_with_missing_values(self, col_index, row_selection):
-        row_iter = row_selection if row_selection is not None else xrange(self.row_table.nrows)
-        for row_index in row_iter:
-            self.missing_values_flags.set_bit(row_index, col_index)
+        if row_selection is not None:
+            row_selection = np.fromiter(row_selection, dtype=np.int64)
+        self.missing_values_flags.set_flags(col_index, row_selection)
         self.missing_values_flags.flush()
 
     def _remove_missing_value_entries_in_column(self, col_index, row_selection):
-
-        row_iter = row_selection if row_selection is not None else xrange(self.row_table.nrows)
-        for row_index in row_iter:
-            self.missing_values_flags.unset_bit(row_index, col_index)
+        if row_selection is not None:
+            row_selection = np.fromiter(row_selection, dtype=np.int64)
+        self.missing_values_flags.set_flags(col_index, row_selection, False)
         self.missing_values_flags.flush()
 
     def replace_column(self, col_index, value, row_selection=None):
@@ -216,6 +300,7 @@ class Hdf5TableReader(Hdf5Base):
             if len(value) != len(row_selection):
                 raise ValueError("values and row_selection do not fit")
 
+        self._migrate_flags()
         type_ = self.col_types[col_index]
         self.row_cache.clear()
         col_name = self.col_names[col_index]
@@ -236,8 +321,12 @@ class Hdf5TableReader(Hdf5Base):
 
         if value_is_iterable:
             if type_ not in basic_type_map:
-                value = [0 if vi is None else self.manager.store_object(col_index, vi, type_)
-                         for vi in value]
+                present = np.fromiter((vi is not None for vi in value), dtype=bool,
+                                      count=len(value))
+                global_ids = np.zeros((len(value),), dtype=np.uint64)
+                global_ids[present] = self.manager.store_objects(
+                    col_index, [vi for vi in value if vi is not None], type_)
+                value = global_ids.tolist()
             else:
                 sentinel = none_replacements[type_]
                 value = [sentinel if vi is None else vi for vi in value]
@@ -267,6 +356,7 @@ class Hdf5TableReader(Hdf5Base):
         self.flush()
 
     def _replace_cell(self, row_index, col_index, value):
+        self._migrate_flags()
         type_ = self.col_types[col_index]
         if row_index in self.row_cache:
             del self.row_cache[row_index]
@@ -315,8 +405,9 @@ class Hdf5TableReader(Hdf5Base):
     __getitem__ = fetch_row
 
     def get_col_values(self, col_name):
-        if col_name in self.col_cache:
-            return self.col_cache[col_name]
+        col_values = self.col_cache.get(col_name)
+        if col_values is not None:
+            return col_values
         col_index = self.col_names.index(col_name)
         store = self.manager.fetch_store(col_index)
         col_values = getattr(self.row_table.cols, col_name)[:]
@@ -325,7 +416,7 @@ class Hdf5TableReader(Hdf5Base):
             self.col_cache[col_name] = values
             return values
 
-        missing = self.missing_values_flags.positions_in_col(col_index)
+        missing = self.missing_values_flags.flags_in_col(col_index)
 
         type_ = self.col_type_of_name[col_name]
         col_values = col_values.astype(object)
@@ -336,15 +427,54 @@ class Hdf5TableReader(Hdf5Base):
                 else:
                     col_values[i] = self.manager.fetch(col_index, int(v))
         else:
-            col_values[np.fromiter(missing, dtype=int)] = None
+            col_values[missing] = None
         self.col_cache[col_name] = col_values
         return col_values
 
+    def missing_rows(self, col_name):
+        """returns sorted array of indices of rows with missing values in the given column"""
+        col_index = self.col_names.index(col_name)
+        return np.where(self.missing_values_flags.flags_in_col(col_index))[0]
+
+    def where(self, condition, col_vars, value_vars):
+        """evaluates ``condition`` within pytables, ``col_vars`` maps variable names in
+        ``condition`` to column names, ``value_vars`` maps variable names to values. returns
+        sorted array of matching row indices. missing values are not considered here, see
+        :py:meth:`~.missing_rows`.
+        """
+        condvars = dict((var, self.row_table.cols._f_col(col_name))
+                        for (var, col_name) in col_vars.items())
+        condvars.update(value_vars)
+        return self.row_table.get_where_list(condition, condvars=condvars, sort=True)
+
+    def fetch_rows(self, row_indices):
+        """fetches many rows at once, other than :py:meth:`~.fetch_row` this does not use the
+        row cache"""
+        row_indices = np.asarray(row_indices, dtype=np.int64)
+        if not len(row_indices):
+            return []
+        rows = []
+        missing_flags = self.missing_values_flags.flags_in_rows(row_indices).tolist()
+        for missing, values in izip(missing_flags,
+                                    self.row_table.read_coordinates(row_indices).tolist()):
+            row = []
+            for (col_idx, value, type_) in izip(itertools.count(), values, self.col_types):
+                if missing[col_idx]:
+                    value = None
+                elif type_ not in basic_type_map:
+                    value = self.manager.fetch(col_idx, value)
+                row.append(value)
+            rows.append(row)
+        return rows
+
     def get_raw_col_values(self, col_name):
-        if col_name in self.col_cache_raw:
-            return self.col_cache_raw[col_name]
+        """returns values of column as stored in the hdf5 file and boolean array flagging
+        missing values"""
+        cached = self.col_cache_raw.get(col_name)
+        if cached is not None:
+            return cached
         col_index = self.col_names.index(col_name)
-        missing = self.missing_values_flags.positions_in_col(col_index)
+        missing = self.missing_values_flags.flags_in_col(col_index)
         col_values = getattr(self.row_table.cols, col_name)[:]
         self.col_cache_raw[col_name] = (col_values, missing)
         return col_values, missing
@@ -387,6 +517,7 @@ class Hdf5TableAppender(Hdf5TableWriter, Hdf5TableReader):
     def __init__(self, path):
         self._initial_setup(path, "a")
         self._load_meta()
+        self._migrate_flags()
         self.row_offset = self.nrows
 
     def write_table(self, table):
@@ -5,7 +5,7 @@ from tables import Atom
 import numpy as np
 
 from .store_base import filters
-from .lru import LruDict
+from ..memory_cache import Cache, MB
 
 from .install_profile import profile
 
@@ -28,7 +28,8 @@ class BitMatrix(object):
         if cache_block_size is None:
             cache_block_size = 10000
         self.cache_block_size = cache_block_size  # in rows
-        self.cache = LruDict(500)
+        # blocks are modified in place, so evicted blocks must be written back:
+        self.cache = Cache("hdf5 missing value flags", 64 * MB, on_evict=self._write_back)
         self.test_vec = (1 << np.arange(8, dtype="uint8"))[:, None]
 
     def resize(self, n_rows):
@@ -36,18 +37,29 @@ class BitMatrix(object):
         if additional_rows > 0:
             zeros = np.zeros(additional_rows * self._n_cols_flags, dtype="uint8")
             self.data.append(zeros)
+            # cached blocks which grow are reread on next access:
+            for idx in range(self.n_rows // self.cache_block_size,
+                             n_rows // self.cache_block_size + 1):
+                if idx in self.cache:
+                    self._write_back(idx, self.cache[idx])
+                    del self.cache[idx]
             self.n_rows = n_rows
-            idx = n_rows // self.cache_block_size
-            if idx in self.cache:
-                del self.cache[idx]
+
+    def _write_back(self, idx, entry):
+        # the file might be closed already if the block is evicted late:
+        if self.data._v_isopen:
+            block, start, end = entry
+            self.data[start:start + len(block)] = block
 
     def _lookup_cache(self, row):
         idx = row // self.cache_block_size
-        if idx not in self.cache:
+        entry = self.cache.get(idx)
+        if entry is None:
             start = idx * self.cache_block_size * self._n_cols_flags
             end = (idx + 1) * self.cache_block_size * self._n_cols_flags
-            self.cache[idx] = (self.data[start:end], start, end)
-        data_block = self.cache[idx][0]
+            entry = (self.data[start:end], start, end)
+            self.cache[idx] = entry
+        data_block = entry[0]
         effective_row = row - idx * self.cache_block_size
         return effective_row, data_block
 
@@ -78,20 +90,37 @@ class BitMatrix(object):
         bits, bytes_ = np.where(self.test_vec & flags)
         return bytes_ * 8 + bits
 
+    def flags_in_rows(self, rows):
+        """returns boolean matrix with one row for every entry of ``rows`` and one column per
+        column of the bit matrix"""
+        rows = np.asarray(rows, dtype=np.int64)
+        result = np.zeros((len(rows), self._n_cols_flags), dtype="uint8")
+        blocks = rows // self.cache_block_size
+        for block in np.unique(blocks):
+            selected = np.where(blocks == block)[0]
+            __, data_block = self._lookup_cache(block * self.cache_block_size)
+            data_block = data_block.reshape(-1, self._n_cols_flags)
+            result[selected] = data_block[rows[selected] - block * self.cache_block_size]
+        bits = (result[:, :, None] & self.test_vec[:, 0]) > 0
+        return bits.reshape(len(rows), -1)[:, :self.n_cols]
+
     def positions_in_col(self, col):
+        return set(np.where(self.flags_in_col(col))[0])
+
+    def flags_in_col(self, col):
+        """returns boolean array with one entry per row"""
         byte, bit = divmod(col, 8)
-        result = set()
-        for start in range(0, self.data.nrows, self.cache_block_size):
+        result = np.zeros((self.n_rows,), dtype=bool)
+        for start in range(0, self.n_rows, self.cache_block_size):
             effective_row, data_block = self._lookup_cache(start)
             col_values = data_block[byte::self._n_cols_flags]
-            flags = col_values & (1 << bit)
-            found = effective_row + np.where(flags)[0]
-            result.update(found)
+            flags = (col_values & (1 << bit)) > 0
+            result[start:start + len(flags)] = flags
         return result
 
     @profile
     def flush(self):
-        for (block, start, end) in self.cache.values():
-            self.data[start:end] = block
+        for idx in self.cache.keys():
+            self._write_back(idx, self.cache[idx])
         self.cache.clear()
         self.data.flush()
@@ -0,0 +1,237 @@
+# encoding: utf-8, division
+from __future__ import print_function, division
+
+from tables import Atom
+import numpy as np
+
+from .store_base import filters
+from ..memory_cache import Cache, MB
+
+
+def _runs(mask):
+    """returns start and end indices of the runs of True values in ``mask``, ends are
+    exclusive"""
+    changes = np.diff(np.concatenate(([0], mask.view(np.int8), [0])))
+    return np.flatnonzero(changes == 1), np.flatnonzero(changes == -1)
+
+
+def _mask_from_runs(starts, ends, n):
+    delta = np.zeros((n + 1,), dtype=np.int64)
+    np.add.at(delta, starts, 1)
+    np.add.at(delta, ends, -1)
+    return np.cumsum(delta[:-1]) > 0
+
+
+class ColumnFlags(object):
+
+    """missing value flags of a hdf5 table stored column by column, so reading the flags of a
+    column does not touch the flags of other columns.
+
+    every column which has flags set at all is stored in a node ``<name>__<index>``, either as
+    bit array packed with ``np.packbits`` or, for columns with few runs of flags, as run length
+    encoded array of start and end row indices. the number of rows is kept in the attribute
+    ``<name>_n_rows`` of the root node.
+    """
+
+    # we use run length encoding if this reduces the size at least by this factor:
+    RLE_FACTOR = 4
+
+    def __init__(self, file_, name, n_cols):
+        self.file_ = file_
+        self.name = name
+        self.n_cols = n_cols
+        attrs = file_.root._v_attrs
+        if name + "_n_rows" not in attrs:
+            attrs[name + "_n_rows"] = 0
+        self.n_rows = int(attrs[name + "_n_rows"])
+        # maps column index to packed bits, modified columns are written back when evicted:
+        self.cache = Cache("hdf5 missing value columns", 256 * MB, on_evict=self._write_back)
+        self.dirty = set()
+        # n_cols x n_bytes matrix with the packed bits of all columns for reading rows. it is
+        # only kept while all columns are in the cache:
+        self.row_major = None
+
+    def _n_bytes(self):
+        return (self.n_rows + 7) // 8
+
+    @staticmethod
+    def exists(file_, name):
+        return name + "_n_rows" in file_.root._v_attrs
+
+    def _node_name(self, col):
+        return "%s__%d" % (self.name, col)
+
+    def _read(self, col):
+        node = getattr(self.file_.root, self._node_name(col), None)
+        if node is None:
+            return np.zeros((self._n_bytes(),), dtype=np.uint8)
+        if node._v_attrs.encoding == "runs":
+            runs = node[:].reshape(-1, 2)
+            return np.packbits(_mask_from_runs(runs[:, 0], runs[:, 1], self.n_rows))
+        packed = np.zeros((self._n_bytes(),), dtype=np.uint8)
+        # rows appended after the last write of this column have no flags set:
+        data = node[:]
+        packed[:len(data)] = data
+        return packed
+
+    def _write(self, col, packed):
+        name = self._node_name(col)
+        if hasattr(self.file_.root, name):
+            self.file_.remove_node(self.file_.root, name)
+        starts, ends = _runs(np.unpackbits(packed)[:self.n_rows].astype(bool))
+        if not len(starts):
+            # no flags set at all, reading a missing node gives all zeros:
+            return
+        if 2 * len(starts) * 8 * self.RLE_FACTOR <= len(packed):
+            data = np.vstack((starts, ends)).T.flatten().astype(np.int64)
+            encoding = "runs"
+        else:
+            data = packed
+            encoding = "bits"
+        node = self.file_.create_earray(self.file_.root, name, Atom.from_dtype(data.dtype), (0,),
+                                        filters=filters, expectedrows=len(data))
+        node.append(data)
+        node._v_attrs.encoding = encoding
+
+    def _write_back(self, col, packed):
+        self.row_major = None
+        # the file might be closed already if the column is evicted late:
+        if col in self.dirty and self.file_.isopen:
+            self._write(col, packed)
+        self.dirty.discard(col)
+
+    def _packed(self, col):
+        packed = self.cache.get(col)
+        if packed is None:
+            packed = self._read(col)
+            self.cache[col] = packed
+        return packed
+
+    def _modified(self, col, packed):
+        if col in self.cache:
+            self.dirty.add(col)
+        else:
+            # exceeds the cache budget:
+            self.row_major = None
+            self._write(col, packed)
+
+    def resize(self, n_rows):
+        if n_rows <= self.n_rows:
+            return
+        self.row_major = None
+        self.n_rows = n_rows
+        self.file_.root._v_attrs[self.name + "_n_rows"] = n_rows
+        for col in self.cache.keys():
+            packed = self.cache.get(col)
+            if packed is None:
+                # evicted while growing the other columns
+                continue
+            grown = np.zeros((self._n_bytes(),), dtype=np.uint8)
+            grown[:len(packed)] = packed
+            self.cache[col] = grown
+            if col in self.dirty:
+                self._modified(col, grown)
+
+    def set_flags(self, col, rows=None, value=True):
+        """sets (or unsets for ``value=False``) flags of column ``col`` for the given ``rows``,
+        which can be an index array or a boolean mask. ``rows=None`` means all rows"""
+        assert 0 <= col < self.n_cols
+        mask = self.flags_in_col(col)
+        if rows is None:
+            mask[:] = value
+        else:
+            rows = np.asarray(rows)
+            if rows.dtype != bool:
+                rows = rows.astype(np.int64)
+                assert not len(rows) or rows.max() < self.n_rows, "resize first !"
+            mask[rows] = value
+        packed = np.packbits(mask)
+        self.cache[col] = packed
+        if self.row_major is not None:
+            self.row_major[col] = packed
+        self._modified(col, packed)
+
+    def set_bit(self, row, col):
+        assert row < self.n_rows, "resize first !"
+        packed = self._packed(col)
+        packed[row >> 3] |= 128 >> (row & 7)
+        if self.row_major is not None:
+            self.row_major[col, row >> 3] = packed[row >> 3]
+        self._modified(col, packed)
+
+    def unset_bit(self, row, col):
+        assert row < self.n_rows, "resize first !"
+        packed = self._packed(col)
+        packed[row >> 3] &= 255 ^ (128 >> (row & 7))
+        if self.row_major is not None:
+            self.row_major[col, row >> 3] = packed[row >> 3]
+        self._modified(col, packed)
+
+    def flags_in_col(self, col):
+        """returns boolean array with one entry per row"""
+        return np.unpackbits(self._packed(col))[:self.n_rows].astype(bool)
+
+    def _row_major(self):
+        row_major = self.row_major
+        if row_major is None:
+            row_major = np.zeros((self.n_cols, self._n_bytes()), dtype=np.uint8)
+            for col in range(self.n_cols):
+                row_major[col] = self._packed(col)
+            # the cache only holds columns of this object:
+            if len(self.cache) == self.n_cols:
+                self.row_major = row_major
+        return row_major
+
+    def flags_in_rows(self, rows):
+        """returns boolean matrix with one row for every entry of ``rows`` and one column per
+        column"""
+        rows = np.asarray(rows, dtype=np.int64)
+        # one lookup for all columns, this is much faster than reading the columns one by one
+        # when fetching single rows:
+        return (self._row_major()[:, rows >> 3] & (128 >> (rows & 7))).T.astype(bool)
+
+    def positions_in_row(self, row):
+        return np.where(self.flags_in_rows([row])[0])[0]
+
+    def flush(self):
+        for col in self.cache.keys():
+            if col in self.dirty:
+                self._write(col, self.cache[col])
+        self.dirty.clear()
+        self.file_.root._v_attrs[self.name + "_n_rows"] = self.n_rows
+
+
+class PackedFlags(object):
+
+    """read only missing value flags held in memory as n_cols x n_bytes matrix of bits packed
+    with ``np.packbits``. readers use this for files in older layouts, which are only
+    converted to :py:class:`~.ColumnFlags` when the file is modified.
+    """
+
+    def __init__(self, packed, n_rows):
+        self.packed = packed
+        self.n_cols = len(packed)
+        self.n_rows = n_rows
+
+    @classmethod
+    def from_masks(clz, masks, n_rows):
+        """``masks`` are boolean arrays per column, which might be shorter than ``n_rows``"""
+        packed = np.zeros((len(masks), (n_rows + 7) // 8), dtype=np.uint8)
+        for col, mask in enumerate(masks):
+            full = np.zeros((n_rows,), dtype=bool)
+            full[:len(mask)] = mask[:n_rows]
+            packed[col] = np.packbits(full)
+        return clz(packed, n_rows)
+
+    def flags_in_col(self, col):
+        return np.unpackbits(self.packed[col])[:self.n_rows].astype(bool)
+
+    def flags_in_rows(self, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        return (self.packed[:, rows >> 3] & (128 >> (rows & 7))).T.astype(bool)
+
+    def positions_in_row(self, row):
+        return np.where(self.flags_in_rows([row])[0])[0]
+
+    def flush(self):
+        pass
@@ -7,7 +7,7 @@ import numpy as np
 
 from .string_store import StringStoreBase
 from .store_base import Store
-from .lru import LruDict
+from ..memory_cache import Cache, MB
 
 from .install_profile import profile
 
@@ -18,9 +18,9 @@ class ObjectStore(StringStoreBase, Store):
     ID_FLAG = 7
     HANDLES = object
 
-    def __init__(self, file_, node):
+    def __init__(self, file_, node, **kw):
         StringStoreBase.__init__(self, file_, node, "object_blob")
-        self.obj_read_cache = LruDict(10000)
+        self.obj_read_cache = Cache("hdf5 objects", 64 * MB)
 
     @profile
     def _write(self, col_index, obj):
@@ -32,9 +32,18 @@ class ObjectStore(StringStoreBase, Store):
 
         yield int(self._write_str(col_index, code).next())
 
+    def _hash_key(self, obj):
+        return id(obj)
+
+    def _encode(self, obj):
+        return cPickle.dumps(obj, protocol=2)
+
     def _resolve(self, col_index, index):
-        if (col_index, index) in self.obj_read_cache:
+        try:
+            # cached objects might be None, so we can not use .get here:
             return self.obj_read_cache[col_index, index]
+        except KeyError:
+            pass
         code = StringStoreBase._read(self, col_index, index)
         try:
             obj = cPickle.loads(code)
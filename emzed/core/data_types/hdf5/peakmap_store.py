@@ -10,9 +10,11 @@ import numpy as np
 from emzed_optimizations import sample_peaks_from_lists
 
 from .. import PeakMap
+from ..peak_arrays import PeakArrays
+from ..fingerprint import fingerprint
 
-from .store_base import Store, filters
-from .lru import LruDict, lru_cache
+from .store_base import Store, filters, unique_id_index
+from ..memory_cache import Cache, MB, cached
 
 from .install_profile import profile
 
@@ -24,14 +26,25 @@ class PeakMapStore(Store):
 
     MSLEVEL_FIELD_SIZE = 16
 
-    def __init__(self, file_, node, **kw):
+    # size of the tiles of the optional m/z index, see setup_tiles:
+    MZ_TILE_WIDTH = 1.0
+    RT_TILE_SPECTRA = 64
+
+    def __init__(self, file_, node, mz_index=False, **kw):
         self.file_ = file_
         self.node = node
-        self.setup()
-        self.write_cache = LruDict(100)
-        self.read_cache = LruDict(100)
-
-    def setup(self):
+        self.setup(mz_index)
+        # maps unique ids of written peakmaps to their index, loaded on first write:
+        self.unique_ids = None
+        self.write_cache = Cache("hdf5 peakmap ids", 1 * MB)
+        self.read_cache = Cache("hdf5 peakmap proxies", 64 * MB)
+
+    def setup(self, mz_index=False):
+        # the m/z index can only be created for new files, for existing files we keep writing
+        # it if it is already there:
+        if mz_index and not hasattr(self.node, "ms1_mz_blob"):
+            self.setup_tiles()
+        self.has_mz_index = hasattr(self.node, "ms1_tile_table")
         self.setup_blobs()
         self.setup_spec_table()
         self.setup_peakmap_table()
@@ -67,6 +80,39 @@ class PeakMapStore(Store):
                 t.cols.pm_index.create_index()
                 t.cols.rt.create_index()
 
+    def setup_tiles(self):
+        """the m/z index stores the peaks of every peakmap a second time, grouped into tiles of
+        MZ_TILE_WIDTH in m/z times RT_TILE_SPECTRA consecutive spectra. the tiles are ordered
+        by m/z bucket first and rt block second, so the tiles of one m/z bucket over a rt range
+        are stored contiguously. ms%d_tile_table holds the offsets of the non empty tiles and
+        ms%d_tile_spec_blob the spectrum of every peak.
+        """
+        for level in (1, 2):
+            self.file_.create_earray(self.node, "ms%d_tile_mz_blob" % level,
+                                     Atom.from_dtype(np.dtype("float64")), (0,),
+                                     filters=filters,
+                                     )
+            self.file_.create_earray(self.node, "ms%d_tile_ii_blob" % level,
+                                     Atom.from_dtype(np.dtype("float32")), (0,),
+                                     filters=filters,
+                                     )
+            self.file_.create_earray(self.node, "ms%d_tile_spec_blob" % level,
+                                     Atom.from_dtype(np.dtype("uint32")), (0,),
+                                     filters=filters,
+                                     )
+            description = {}
+            description["pm_index"] = UInt32Col(pos=0)
+            description["mz_bucket"] = Int32Col(pos=1)
+            description["rt_block"] = UInt32Col(pos=2)
+            description["start"] = UInt64Col(pos=3)
+            description["end"] = UInt64Col(pos=4)
+            t = self.file_.create_table(self.node, 'ms%d_tile_table' % level, description,
+                                        filters=filters)
+            t.cols.pm_index.create_index()
+            # readers must use the tile sizes the file was written with:
+            t.attrs.mz_tile_width = self.MZ_TILE_WIDTH
+            t.attrs.rt_tile_spectra = self.RT_TILE_SPECTRA
+
     def setup_peakmap_table(self):
         if not hasattr(self.node, "pm_table"):
             description = {}
@@ -89,28 +135,72 @@ class PeakMapStore(Store):
             pm_table.cols.index.create_index()
 
     @profile
-    def add_spectrum(self, pm_index, spec):
+    def add_spectra(self, pm_index, level, spectra):
+        """writes the peaks of the spectra of one ms level of a peakmap with one append per
+        blob"""
+        if not spectra:
+            return
 
-        level = spec.msLevel
         mz_blob = getattr(self.node, "ms%d_mz_blob" % level)
         ii_blob = getattr(self.node, "ms%d_ii_blob" % level)
+        spec_table = getattr(self.node, "ms%d_spec_table" % level)
+
+        peaks = np.vstack([np.asarray(spec.peaks, dtype=np.float64).reshape(-1, 2)
+                           for spec in spectra])
+        sizes = np.array([len(spec.peaks) for spec in spectra], dtype=np.uint64)
+        ends = np.cumsum(sizes) + np.uint64(mz_blob.nrows)
 
-        start = mz_blob.nrows
-        mz_blob.append(spec.peaks[:, 0])
-        ii_blob.append(spec.peaks[:, 1])
+        mz_blob.append(peaks[:, 0])
+        ii_blob.append(peaks[:, 1].astype(np.float32))
 
-        size = spec.peaks.shape[0]
+        rows = np.zeros((len(spectra),), dtype=spec_table.dtype)
+        rows["pm_index"] = pm_index
+        rows["rt"] = [spec.rt for spec in spectra]
+        rows["scan_number"] = [-1 if spec.scan_number is None else spec.scan_number
+                               for spec in spectra]
+        rows["start"] = ends - sizes
+        rows["end"] = ends
+        spec_table.append(rows)
 
-        row = getattr(self.node, "ms%d_spec_table" % level).row
+    @profile
+    def add_tiles(self, pm_index, level, spectra):
+        """writes the peaks of the spectra of one ms level of a peakmap to the m/z index.
+        spectra must be sorted by rt."""
+        if not spectra:
+            return
 
-        row["pm_index"] = pm_index
-        row["rt"] = spec.rt
-        sn = spec.scan_number
-        row["scan_number"] = -1 if sn is None else sn
-        row["start"] = start
-        row["end"] = start + size
+        tile_table = getattr(self.node, "ms%d_tile_table" % level)
+        mz_width = tile_table.attrs.mz_tile_width
+        rt_block_size = tile_table.attrs.rt_tile_spectra
 
-        row.append()
+        sizes = [len(spec.peaks) for spec in spectra]
+        peaks = np.vstack([np.asarray(spec.peaks, dtype=np.float64).reshape(-1, 2)
+                           for spec in spectra])
+        spec_indices = np.repeat(np.arange(len(spectra)), sizes)
+
+        buckets = np.floor(peaks[:, 0] / mz_width).astype(np.int64)
+        blocks = spec_indices // rt_block_size
+
+        # lexsort is stable, so the peaks of a spectrum keep their m/z order within a tile:
+        perm = np.lexsort((spec_indices, buckets))
+        buckets = buckets[perm]
+        blocks = blocks[perm]
+
+        mz_blob = getattr(self.node, "ms%d_tile_mz_blob" % level)
+        offset = mz_blob.nrows
+        mz_blob.append(peaks[perm, 0])
+        getattr(self.node, "ms%d_tile_ii_blob" % level).append(peaks[perm, 1].astype(np.float32))
+        getattr(self.node, "ms%d_tile_spec_blob" % level).append(
+            spec_indices[perm].astype(np.uint32))
+
+        if not len(perm):
+            return
+        tile_starts = np.flatnonzero((np.diff(buckets) != 0) | (np.diff(blocks) != 0)) + 1
+        tile_starts = np.concatenate(([0], tile_starts))
+        tile_ends = np.concatenate((tile_starts[1:], [len(perm)]))
+
+        tile_table.append([(pm_index, int(buckets[s]), int(blocks[s]), offset + s, offset + e)
+                           for (s, e) in itertools.izip(tile_starts, tile_ends)])
 
     @profile
     def _write(self, col_index, pm):
@@ -118,13 +208,15 @@ class PeakMapStore(Store):
         # at the moment we ignore col_index, I guess it would not speed up so
         # much
 
-        unique_id = pm.uniqueId()
-        # hash key
-        yield unique_id
+        # hash key for objects written in this session, the unique id is only computed for
+        # peakmaps not seen before:
+        yield fingerprint(pm)
 
-        result = list(self.node.pm_table.where("""unique_id == %r""" % unique_id))
-        if result:
-            yield int(result[0]["index"])
+        unique_id = pm.uniqueId()
+        if self.unique_ids is None:
+            self.unique_ids = unique_id_index(self.node.pm_table)
+        if unique_id in self.unique_ids:
+            yield int(self.unique_ids[unique_id])
             return
 
         ms_levels = sorted(set(pm.getMsLevels()))
@@ -151,9 +243,14 @@ class PeakMapStore(Store):
         row["mzmin_2"] = mzmin_2
         row["mzmax_2"] = mzmax_2
         row.append()
+        self.unique_ids[unique_id] = index
 
-        for spec in sorted(pm.spectra, key=lambda s: s.rt):
-            self.add_spectrum(index, spec)
+        spectra = sorted(pm.spectra, key=lambda s: s.rt)
+        for level in sorted(set(spec.msLevel for spec in spectra)):
+            spectra_of_level = [spec for spec in spectra if spec.msLevel == level]
+            self.add_spectra(index, level, spectra_of_level)
+            if self.has_mz_index:
+                self.add_tiles(index, level, spectra_of_level)
 
         yield int(index)
 
@@ -192,10 +289,17 @@ class PeakMapStore(Store):
         self.node.pm_table.flush()
         self.node.ms1_spec_table.flush()
         self.node.ms2_spec_table.flush()
+        if self.has_mz_index:
+            self.node.ms1_tile_table.flush()
+            self.node.ms2_tile_table.flush()
 
 
 class Hdf5PeakMapProxy(object):
 
+    # reading more runs of tiles than this we read all tiles between the first and the last
+    # run at once:
+    MAX_TILE_READS = 32
+
     def __init__(self, **kw):
         for name, value in kw.items():
             setattr(self, name, value)
@@ -230,6 +334,8 @@ class Hdf5PeakMapProxy(object):
         self.rts = rts
         self.starts = starts
         self.scan_numbers = scan_numbers
+        # tile offsets of the m/z index are loaded on first use:
+        self.tiles = {}
 
     def uniqueId(self):
         return self.unique_id
@@ -294,12 +400,11 @@ class Hdf5PeakMapProxy(object):
                 mzs = mzs[flags]
                 yield rt, mzs, iis
 
-    @lru_cache(maxsize=1000)
+    @cached("hdf5 peakmap spectra", 256 * MB)
     def _iter_full_spectra(self, rtmin, rtmax, ms_level):
 
         rts = self.rts[ms_level]
-        i0 = np.searchsorted(rts, rtmin, "left")
-        i1 = np.searchsorted(rts, rtmax, "right")
+        i0, i1 = self._spectra_range(rtmin, rtmax, ms_level)
 
         starts = self.starts[ms_level][i0:i1]
         if not len(starts):
@@ -319,8 +424,76 @@ class Hdf5PeakMapProxy(object):
             iis = full_iis[i_start - s0: i_end - s0]
             yield rt, mzs, iis
 
-    @lru_cache(maxsize=1000)
+    def _spectra_range(self, rtmin, rtmax, ms_level):
+        rts = self.rts[ms_level]
+        i0 = np.searchsorted(rts, rtmin, "left")
+        i1 = np.searchsorted(rts, rtmax, "right")
+        return i0, i1
+
+    def _tiles(self, ms_level):
+        """offsets of the tiles of the m/z index sorted by m/z bucket and rt block, None if the
+        file was written without m/z index"""
+        if ms_level not in self.tiles:
+            tile_table = getattr(self.node, "ms%d_tile_table" % ms_level, None)
+            if tile_table is None:
+                self.tiles[ms_level] = None
+            else:
+                rows = tile_table.read_where("pm_index == %d" % self.index)
+                perm = np.lexsort((rows["rt_block"], rows["mz_bucket"]))
+                rows = rows[perm]
+                self.tiles[ms_level] = (tile_table.attrs.mz_tile_width,
+                                        tile_table.attrs.rt_tile_spectra,
+                                        rows["mz_bucket"].astype(np.int64),
+                                        rows["rt_block"].astype(np.int64),
+                                        rows["start"].astype(np.int64),
+                                        rows["end"].astype(np.int64))
+        return self.tiles[ms_level]
+
+    def _read_tiles(self, i0, i1, mzmin, mzmax, ms_level):
+        """reads the peaks of the spectra i0 .. i1 - 1 in the m/z range mzmin .. mzmax from the
+        tiles of the m/z index which intersect this box. returns arrays of m/z values,
+        intensities and spectrum indices of the peaks.
+        """
+        mz_width, rt_block_size, buckets, blocks, starts, ends = self._tiles(ms_level)
+        selected = np.flatnonzero((buckets >= np.floor(mzmin / mz_width))
+                                  & (buckets <= np.floor(mzmax / mz_width))
+                                  & (blocks >= i0 // rt_block_size)
+                                  & (blocks <= (i1 - 1) // rt_block_size))
+        if not len(selected):
+            return np.zeros((0,)), np.zeros((0,), dtype=np.float32), np.zeros((0,), dtype=int)
+
+        # consecutive tiles are stored contiguously, so we read runs of selected tiles at once:
+        breaks = np.flatnonzero(np.diff(selected) != 1) + 1
+        firsts = selected[np.concatenate(([0], breaks))]
+        lasts = selected[np.concatenate((breaks - 1, [len(selected) - 1]))]
+        if len(firsts) > self.MAX_TILE_READS:
+            firsts = firsts[:1]
+            lasts = lasts[-1:]
+
+        chunks = defaultdict(list)
+        for name in ("mz", "ii", "spec"):
+            blob = getattr(self.node, "ms%d_tile_%s_blob" % (ms_level, name))
+            for first, last in itertools.izip(firsts, lasts):
+                chunks[name].append(blob[starts[first]:ends[last]])
+
+        mzs = np.concatenate(chunks["mz"])
+        iis = np.concatenate(chunks["ii"])
+        spec_indices = np.concatenate(chunks["spec"]).astype(int)
+
+        flags = ((mzmin <= mzs) & (mzs <= mzmax)
+                 & (i0 <= spec_indices) & (spec_indices < i1))
+        return mzs[flags], iis[flags], spec_indices[flags]
+
+    @cached("hdf5 peakmap chromatograms", 64 * MB)
     def chromatogram(self, mzmin=None, mzmax=None, rtmin=None, rtmax=None, ms_level=1):
+        if None not in (mzmin, mzmax, rtmin, rtmax) and self._tiles(ms_level) is not None:
+            i0, i1 = self._spectra_range(rtmin, rtmax, ms_level)
+            if i0 >= i1:
+                return np.zeros((0,)), np.zeros((0,))
+            mzs, iis, spec_indices = self._read_tiles(i0, i1, mzmin, mzmax, ms_level)
+            intensities = np.bincount(spec_indices - i0, weights=iis, minlength=i1 - i0)
+            return self.rts[ms_level][i0:i1].copy(), intensities
+
         rts = []
         intensities = []
         for rt, mzs, iis in self._iter_peaks(rtmin, rtmax, mzmin, mzmax, ms_level):
@@ -333,19 +506,61 @@ class Hdf5PeakMapProxy(object):
         intensities = intensities[perm]
         return rts, intensities
 
-    @lru_cache(maxsize=1000)
+    def chromatograms(self, windows, ms_level=1):
+        return [self.chromatogram(mzmin, mzmax, rtmin, rtmax, ms_level)
+                for (mzmin, mzmax, rtmin, rtmax) in windows]
+
+    @cached("hdf5 peakmap sampled peaks", 64 * MB)
     def sample_peaks(self, rtmin, rtmax, mzmin, mzmax, npeaks, ms_level):
 
         if rtmin <= rtmax and mzmin < mzmax:
             all_mzs = []
             all_iis = []
-            for rt, mzs, iis in self._iter_peaks(rtmin, rtmax, None, None, ms_level):
-                all_mzs.append(mzs)
-                all_iis.append(iis)
+            if self._tiles(ms_level) is not None:
+                i0, i1 = self._spectra_range(rtmin, rtmax, ms_level)
+                if i0 < i1:
+                    mzs, iis, spec_indices = self._read_tiles(i0, i1, mzmin, mzmax, ms_level)
+                    # split into spectra, peaks of one spectrum keep their m/z order:
+                    perm = np.argsort(spec_indices, kind="mergesort")
+                    splits = np.cumsum(np.bincount(spec_indices - i0, minlength=i1 - i0))[:-1]
+                    all_mzs = np.split(mzs[perm], splits)
+                    all_iis = np.split(iis[perm], splits)
+            else:
+                for rt, mzs, iis in self._iter_peaks(rtmin, rtmax, None, None, ms_level):
+                    all_mzs.append(mzs)
+                    all_iis.append(iis)
             peaks = sample_peaks_from_lists(all_mzs, all_iis, mzmin, mzmax, npeaks)
         else:
             peaks = np.zeros((0, 2))
         return peaks
 
+    def peakArrays(self):
+        """returns all peaks as :py:class:`~emzed.core.data_types.peak_arrays.PeakArrays`,
+        e.g. to share them with worker processes. polarities and precursors are not stored in
+        hdf5 files, so they are set to "0" and empty lists."""
+        peaks = []
+        offsets = [0]
+        rts = []
+        ms_levels = []
+        scan_numbers = []
+        for level in (1, 2):
+            starts = self.starts[level]
+            if not len(starts):
+                continue
+            s0, e0 = starts[0], starts[-1]
+            mzs = getattr(self.node, "ms%d_mz_blob" % level)[s0:e0]
+            iis = getattr(self.node, "ms%d_ii_blob" % level)[s0:e0]
+            peaks.append(np.column_stack((mzs, iis)))
+            offsets.extend((starts[1:] - s0 + offsets[-1]).tolist())
+            rts.extend(self.rts[level].tolist())
+            ms_levels.extend([level] * len(self.rts[level]))
+            scan_numbers.extend(self.scan_numbers[level].tolist())
+
+        n = len(rts)
+        peaks = np.vstack(peaks) if peaks else np.zeros((0, 2))
+        arrays = PeakArrays(peaks, offsets, rts, ms_levels, ["0"] * n, [[]] * n, scan_numbers)
+        # levels are stored separately, so we have to merge them by rt:
+        return arrays.normalized()
+
     def get_rts(self, msLevel=1):
         return self.rts[msLevel]
@@ -0,0 +1,181 @@
+# encoding: utf-8, division
+from __future__ import print_function, division
+
+import numbers
+
+import numpy as np
+
+from ..expressions import (AndExpression, OrExpression, CompExpression, ColumnExpression,
+                           Value, IsInExpression, IsNoneExpression, IsNotNoneExpression)
+
+from .types import indexed_types
+
+
+# for longer lists the condition string gets too long, we evaluate those in memory:
+MAX_IS_IN_VALUES = 32
+
+
+def matching_rows(reader, table, expr):
+    """returns sorted array of indices of rows of the table read by ``reader`` for which
+    ``expr`` evaluates to True. ``table`` is the table the column expressions in ``expr``
+    refer to.
+
+    comparisons of numerical columns with numbers as well as ``isIn`` are evaluated by
+    pytables, which uses the column indices if present. all other parts of ``expr`` are
+    evaluated in memory, only the needed columns are loaded in this case.
+    """
+    return _Query(reader, table).rows(expr)
+
+
+def split_query(reader, table, expr):
+    """splits the conjunction ``expr`` into terms which can be evaluated by pytables and the
+    remaining terms. returns both lists."""
+    query = _Query(reader, table)
+    queryable = []
+    others = []
+    for term in _and_terms(expr):
+        if query._condition(term) is not None:
+            queryable.append(term)
+        else:
+            others.append(term)
+    return queryable, others
+
+
+class _Query(object):
+
+    def __init__(self, reader, table):
+        self.reader = reader
+        self.table = table
+        self.n = len(reader)
+        self.var_count = 0
+
+    def rows(self, expr):
+        if isinstance(expr, AndExpression):
+            terms = _and_terms(expr)
+        else:
+            terms = [expr]
+
+        conditions = []
+        others = []
+        for term in terms:
+            condition = self._condition(term)
+            if condition is not None:
+                conditions.append(condition)
+            else:
+                others.append(term)
+
+        if conditions:
+            result = self._where(conditions)
+        else:
+            result = None
+
+        for term in others:
+            rows = self._rows_of_term(term)
+            result = rows if result is None else np.intersect1d(result, rows,
+                                                               assume_unique=True)
+        return result
+
+    def _rows_of_term(self, expr):
+        if isinstance(expr, AndExpression):
+            return self.rows(expr)
+        if isinstance(expr, OrExpression):
+            return np.union1d(self.rows(expr.left), self.rows(expr.right))
+        if isinstance(expr, (IsNoneExpression, IsNotNoneExpression)):
+            if self._is_own_column(expr.child):
+                missing = self.reader.missing_rows(expr.child.colname)
+                if isinstance(expr, IsNoneExpression):
+                    return missing
+                return np.setdiff1d(np.arange(self.n), missing, assume_unique=True)
+        return self._evaluate(expr)
+
+    def _is_own_column(self, expr):
+        return isinstance(expr, ColumnExpression) and expr.table is self.table
+
+    def _is_queryable_column(self, expr):
+        return self._is_own_column(expr) and expr.type_ in indexed_types
+
+    def _new_var(self):
+        self.var_count += 1
+        return "v%d" % self.var_count
+
+    def _operand(self, expr, col_vars, value_vars):
+        if self._is_queryable_column(expr):
+            # pytables caches compiled conditions including the used column indices, so
+            # the same variable name must not refer to different columns:
+            var = "c%d" % self.reader.col_names.index(expr.colname)
+            col_vars[var] = expr.colname
+            return var
+        if isinstance(expr, Value):
+            value = expr.value
+            # bool is a subclass of int but can not be compared to numbers by pytables:
+            if isinstance(value, numbers.Real) and not isinstance(value, bool):
+                var = self._new_var()
+                value_vars[var] = value
+                return var
+        return None
+
+    def _condition(self, expr):
+        """returns tuple (condition, col_vars, value_vars) or None if ``expr`` can not be
+        translated"""
+        col_vars = dict()
+        value_vars = dict()
+        if isinstance(expr, CompExpression):
+            left = self._operand(expr.left, col_vars, value_vars)
+            right = self._operand(expr.right, col_vars, value_vars)
+            # pytables can not compare two indexed columns:
+            if left is None or right is None or len(col_vars) != 1:
+                return None
+            return "(%s %s %s)" % (left, expr.symbol, right), col_vars, value_vars
+
+        if isinstance(expr, IsInExpression):
+            values = [v for v in expr.choices if v is not None]
+            if not values or len(values) > MAX_IS_IN_VALUES:
+                return None
+            column = self._operand(expr.child, col_vars, value_vars)
+            if column is None or not col_vars:
+                return None
+            terms = []
+            for value in values:
+                var = self._operand(Value(value), col_vars, value_vars)
+                if var is None:
+                    return None
+                terms.append("(%s == %s)" % (column, var))
+            return "(%s)" % " | ".join(terms), col_vars, value_vars
+        return None
+
+    def _where(self, conditions):
+        col_vars = dict()
+        value_vars = dict()
+        for __, cv, vv in conditions:
+            col_vars.update(cv)
+            value_vars.update(vv)
+        condition = " & ".join(c for (c, __, __) in conditions)
+        rows = self.reader.where(condition, col_vars, value_vars)
+        # comparisons with missing values are never true, the cells of missing values
+        # contain replacement values:
+        for col_name in set(col_vars.values()):
+            missing = self.reader.missing_rows(col_name)
+            if len(missing):
+                rows = np.setdiff1d(rows, missing, assume_unique=True)
+        return rows.astype(np.int64)
+
+    def _evaluate(self, expr):
+        needed = expr._neededColumns()
+        for table, __ in needed:
+            if table is not self.table:
+                raise Exception("expression %s refers to other tables" % expr)
+        ctx = {self.table: dict((name, (self.reader.get_col_values(name), None,
+                                        self.reader.col_type_of_name[name]))
+                                for (__, name) in needed)}
+        flags, __, __ = expr._eval(ctx)
+        flags = np.array([bool(f) for f in flags], dtype=bool)
+        if len(flags) == 1:
+            return np.arange(self.n) if flags[0] else np.zeros((0,), dtype=np.int64)
+        assert len(flags) == self.n, "result of filter expression does not match table size"
+        return np.where(flags)[0]
+
+
+def _and_terms(expr):
+    if isinstance(expr, AndExpression):
+        return _and_terms(expr.left) + _and_terms(expr.right)
+    return [expr]
@@ -31,8 +31,6 @@ from ..col_types import TimeSeries
 
 filters = Filters(complib="blosc", complevel=9)
 
-from .lru import LruDict, lru_cache
-
 from .types import basic_type_map
 
 from .install_profile import profile
@@ -83,8 +81,7 @@ class Store(object):
             for column in store.available_columns():
                 self._store_for_column[column] = store
 
-    @profile
-    def store_object(self, col_index, obj, type_):
+    def _store_for_type(self, type_, obj):
         if type_ in basic_type_map:
             raise ValueError("something went wrong, you try to store a basic type in an object store")
         if object in self._handlers:
@@ -92,10 +89,23 @@ class Store(object):
         else:
             fallback = None
         store = self._handlers.get(type_, fallback)
-        if store is not None:
-            global_id = store.write(col_index, obj)
-            return global_id
-        raise TypeError("no store manager for %r found" % obj)
+        if store is None:
+            raise TypeError("no store manager for %r found" % obj)
+        return store
+
+    @profile
+    def store_object(self, col_index, obj, type_):
+        store = self._store_for_type(type_, obj)
+        return store.write(col_index, obj)
+
+    @profile
+    def store_objects(self, col_index, objects, type_):
+        """stores list of objects of type ``type_`` at once and returns numpy array with the
+        global ids, this is much faster than calling :py:meth:`~.store_object` per object"""
+        if not len(objects):
+            return np.zeros((0,), dtype=np.uint64)
+        store = self._store_for_type(type_, objects[0])
+        return store.write_many(col_index, objects)
 
     def fetch(self, col_index, global_id):
         if global_id == 0:
@@ -114,14 +124,32 @@ class Store(object):
     def write(self, col_index, obj):
         writer = self._write(col_index, obj)
         hash_key = writer.next()
-        if (col_index, hash_key) in self.write_cache:
-            return self.write_cache[col_index, hash_key]
+        global_id = self.write_cache.get((col_index, hash_key))
+        if global_id is not None:
+            return global_id
 
         local_id = writer.next()
-        global_id = (local_id << 3 | self.ID_FLAG) + 1
+        global_id = self._global_id(local_id)
         self.write_cache[col_index, hash_key] = global_id
         return global_id
 
+    @profile
+    def write_many(self, col_index, objects):
+        """writes list of objects and returns numpy array of global ids. stores which can write
+        many objects in one step override this method."""
+        global_ids = np.zeros((len(objects),), dtype=np.uint64)
+        # tables often contain the same object in many rows:
+        seen = {}
+        for i, obj in enumerate(objects):
+            global_id = seen.get(id(obj))
+            if global_id is None:
+                global_id = seen[id(obj)] = self.write(col_index, obj)
+            global_ids[i] = global_id
+        return global_ids
+
+    def _global_id(self, local_id):
+        return (local_id << 3 | self.ID_FLAG) + 1
+
     def _write(self, col_index, obj):
         raise NotImplementedError()
 
@@ -156,3 +184,12 @@ class Store(object):
         return (global_id - 1) & 7
 
 
+def unique_id_index(table):
+    """returns dict mapping the unique ids in column ``unique_id`` of the pytables ``table`` to
+    the values of column ``index``. we use this instead of querying the table for every object
+    we write."""
+    if not table.nrows:
+        return {}
+    return dict(itertools.izip(table.col("unique_id").tolist(), table.col("index").tolist()))
+
+
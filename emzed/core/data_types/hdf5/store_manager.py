@@ -7,10 +7,10 @@ from string_store import StringStore
 from object_store import ObjectStore
 
 
-def setup_manager(file_, node=None):
+def setup_manager(file_, node=None, **kw):
 
     if node is None:
         node = file_.root
 
-    manager = Store(file_, node)
+    manager = Store(file_, node, **kw)
     return manager
@@ -9,7 +9,7 @@ from tables import Atom
 import numpy as np
 
 from .store_base import Store, filters
-from .lru import LruDict
+from ..memory_cache import Cache, MB, ENTRY_OVERHEAD
 
 from .install_profile import profile
 
@@ -24,10 +24,9 @@ class StringStoreBase(object):
         if "__" in blob_name_stem:
             raise ValueError("'__' not allowed in blob_name_stem")
 
-        self.write_cache = LruDict(10000)
-        self.read_cache = LruDict(10000)
-        self.col_cache = LruDict(100)
-        self.fetched = {}
+        self.write_cache = Cache("hdf5 %s ids" % blob_name_stem, 16 * MB)
+        self.read_cache = Cache("hdf5 %s values" % blob_name_stem, 64 * MB)
+        self.fetched = Cache("hdf5 %s columns" % blob_name_stem, 256 * MB)
 
         self.blob_name_stem = blob_name_stem
         self.setup(node)
@@ -74,6 +73,59 @@ class StringStoreBase(object):
         # store and yield index
         yield int(self._write_str(col_index, s).next())
 
+    def _hash_key(self, obj):
+        return obj
+
+    def _encode(self, obj):
+        return obj
+
+    @profile
+    def write_many(self, col_index, objects):
+        """writes all new objects with one append to the blob"""
+        if col_index not in self.blobs:
+            blob, starts = self.create_store(col_index)
+            self.blobs[col_index] = blob
+            self.starts[col_index] = starts
+        else:
+            blob = self.blobs[col_index]
+            starts = self.starts[col_index]
+
+        # first object for every hash key, in order of appearance:
+        unique = {}
+        unique_keys = []
+        keys = []
+        for obj in objects:
+            key = self._hash_key(obj)
+            keys.append(key)
+            if key not in unique:
+                unique[key] = obj
+                unique_keys.append(key)
+
+        cached = self.write_cache.get_many((col_index, key) for key in unique_keys)
+        known = dict((key, global_id) for ((__, key), global_id) in cached.items())
+        new_keys = [key for key in unique_keys if key not in known]
+        new_data = [self._encode(unique[key]) for key in new_keys]
+        local_ids = np.arange(starts.nrows, starts.nrows + len(new_keys), dtype=np.uint64)
+        known.update(itertools.izip(new_keys, self._global_id(local_ids).tolist()))
+
+        global_ids = np.fromiter((known[key] for key in keys), dtype=np.uint64,
+                                 count=len(keys))
+
+        if new_data:
+            sizes = np.fromiter((len(data) for data in new_data), dtype=np.uint64,
+                                count=len(new_data))
+            offsets = np.cumsum(sizes) - sizes
+            starts.append(offsets + np.uint64(blob.nrows))
+            blob.append(np.fromstring("".join(new_data), dtype=np.uint8))
+            # strings fetched before are incomplete now:
+            if col_index in self.fetched:
+                del self.fetched[col_index]
+
+        # keys of large batches would only evict each other:
+        if len(new_keys) * ENTRY_OVERHEAD < self.write_cache.max_bytes:
+            self.write_cache.update(((col_index, key), known[key]) for key in new_keys)
+        return global_ids
+
     @profile
     def _write_str(self, col_index, s, index=None):
 
@@ -189,6 +241,9 @@ class UnicodeStore(StringStoreBase, Store):
         self.blobs[0].flush()
         self.starts[0].flash()
 
+    def _encode(self, obj):
+        return obj.encode("utf-8")
+
     def _fetch_full_string_blob(self, col_index):
         return unicode(self.blobs[col_index][:].tostring(), "utf-8")
 
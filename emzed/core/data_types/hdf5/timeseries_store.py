@@ -9,8 +9,8 @@ import numpy as np
 
 from ..col_types import TimeSeries
 
-from .store_base import Store, filters
-from .lru import LruDict
+from .store_base import Store, filters, unique_id_index
+from ..memory_cache import Cache, MB
 
 from .install_profile import profile
 
@@ -32,9 +32,11 @@ class TimeSeriesStore(Store):
         self.ts_index = self.node.ts_index
 
         self.next_index = self.ts_index.nrows
+        # maps unique ids of written time series to their index, loaded on first write:
+        self.unique_ids = None
 
-        self.write_cache = LruDict(100)
-        self.read_cache = LruDict(100)
+        self.write_cache = Cache("hdf5 time series ids", 1 * MB)
+        self.read_cache = Cache("hdf5 time series", 64 * MB)
 
     def setup(self):
 
@@ -76,42 +78,85 @@ class TimeSeriesStore(Store):
         unique_id = obj.uniqueId()
         yield unique_id
 
-        result = list(self.ts_index.where("""unique_id == %r""" % unique_id))
-        if result:
-            yield result[0]["index"]
+        if self.unique_ids is None:
+            self.unique_ids = unique_id_index(self.ts_index)
+        index = self.unique_ids.get(unique_id)
+        if index is not None:
+            yield index
+            return
 
-        start = self.x_blob.nrows
-        size = len(obj.x)
-
-        # transform missing values to -1 which is not possible for int representation of
-        # dates:
-        xvals = [xi.toordinal() if xi is not None else -1 for xi in obj.x]
-
-        self.x_blob.append(xvals)
-        self.y_blob.append(obj.y)
+        yield self._append([(unique_id, obj)])
 
+    @profile
+    def write_many(self, col_index, objects):
+        """writes all new time series with one append per blob"""
+        if self.unique_ids is None:
+            self.unique_ids = unique_id_index(self.ts_index)
+        global_ids = np.zeros((len(objects),), dtype=np.uint64)
+        seen = {}
+        new = []
+        for i, obj in enumerate(objects):
+            global_id = seen.get(id(obj))
+            if global_id is None:
+                unique_id = obj.uniqueId()
+                index = self.unique_ids.get(unique_id)
+                if index is None:
+                    index = self.next_index + len(new)
+                    self.unique_ids[unique_id] = index
+                    new.append((unique_id, obj))
+                global_id = seen[id(obj)] = self._global_id(index)
+            global_ids[i] = global_id
+        self._append(new)
+        return global_ids
+
+    def _append(self, items):
+        """appends list of (unique_id, time series) pairs, returns index of the first one"""
+        first_index = self.next_index
+        if not items:
+            return first_index
+
+        columns = dict((name, []) for name in self.ts_index.colnames)
+        xvals = []
+        yvals = []
+        blank_positions = []
+        start = self.x_blob.nrows
         bp_start = self.bp.nrows
-        if obj.is_blank is None:
-            bp_size = 0
-        else:
-            blank_positions = [i for (i, f) in enumerate(obj.is_blank) if f]
-            self.bp.append(blank_positions)
-            bp_size = len(blank_positions)
-
-        row = self.ts_index.row
-        row["unique_id"] = unique_id
-        row["label"] = obj.label or ""
-        row["blank_flags_is_none"] = obj.is_blank is None
-        row["index"] = self.next_index
-        row["start"] = start
-        row["size"] = size
-        row["bp_start"] = bp_start
-        row["bp_size"] = bp_size
-        row.append()
-
-        next_index = self.next_index
-        self.next_index += 1
-        yield next_index
+        for unique_id, obj in items:
+            # transform missing values to -1 which is not possible for int representation of
+            # dates:
+            xvals.extend(xi.toordinal() if xi is not None else -1 for xi in obj.x)
+            yvals.append(obj.y)
+            if obj.is_blank is None:
+                bp_size = 0
+            else:
+                positions = [i for (i, f) in enumerate(obj.is_blank) if f]
+                blank_positions.extend(positions)
+                bp_size = len(positions)
+
+            columns["unique_id"].append(unique_id)
+            columns["label"].append(obj.label or "")
+            columns["blank_flags_is_none"].append(obj.is_blank is None)
+            columns["index"].append(self.next_index)
+            columns["start"].append(start)
+            columns["size"].append(len(obj.x))
+            columns["bp_start"].append(bp_start)
+            columns["bp_size"].append(bp_size)
+
+            self.unique_ids[unique_id] = self.next_index
+            self.next_index += 1
+            start += len(obj.x)
+            bp_start += bp_size
+
+        rows = np.zeros((len(items),), dtype=self.ts_index.dtype)
+        for name, values in columns.items():
+            rows[name] = values
+
+        self.x_blob.append(np.array(xvals, dtype=np.int64))
+        self.y_blob.append(np.concatenate(yvals))
+        if blank_positions:
+            self.bp.append(np.array(blank_positions, dtype=np.int32))
+        self.ts_index.append(rows)
+        return first_index
 
     def _read(self, col_index, index):
         result = list(self.node.ts_index.where("""index == %r""" % index))
@@ -9,5 +9,8 @@ basic_type_map = {int: Int64Col, long: Int64Col, float: Float64Col, bool: BoolCo
 
 none_replacements = {int: 0, long: 0, float: 0.0, bool: False, CheckState: False}
 
+# columns of these types get an index when written and can be queried with pytables conditions:
+indexed_types = (int, long, float)
+
 
 assert set(basic_type_map.keys()) == set(none_replacements.keys()), "broken setup in types.py"
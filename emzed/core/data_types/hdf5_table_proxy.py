@@ -1,12 +1,12 @@
 # encoding: utf-8, division
 from __future__ import print_function, division
 
+import operator
 import re
 import time
 import types
 
 import numpy as np
-import pandas as pd
 
 from .table import Table
 
@@ -15,12 +15,18 @@ from .hdf5.object_store import ObjectProxy
 from .hdf5.peakmap_store import Hdf5PeakMapProxy  # analysis:ignore
 
 from .hdf5.accessors import Hdf5TableReader
+from .hdf5.query import matching_rows
+from .hdf5.types import indexed_types
+
+from .lazy_table import LazyTable
+
+from .expressions import BaseExpression, ColumnExpression, Value
 
 from base_classes import ImmutableTable
 
 from hdf5.install_profile import profile
 
-from .range_set import RangeSet
+from .sorting import sort_permutation
 
 
 class UfuncWrapper(object):
@@ -32,6 +38,32 @@ class UfuncWrapper(object):
         return self.f(*a, **kw)
 
 
+class RangeFilter(UfuncWrapper):
+
+    """filter for ``min_ <= value <= max_``, ``min_`` or ``max_`` may be None.
+    :py:meth:`Hdf5TableProxy.findMatchingRows` evaluates this filter within pytables.
+    """
+
+    def __init__(self, min_, max_):
+        self.min_ = min_
+        self.max_ = max_
+
+    def __call__(self, values):
+        result = True
+        if self.min_ is not None:
+            result = np.logical_and(result, np.greater_equal(values, self.min_))
+        if self.max_ is not None:
+            result = np.logical_and(result, np.less_equal(values, self.max_))
+        return result
+
+    def expression(self, column):
+        if self.min_ is None:
+            return column <= self.max_
+        if self.max_ is None:
+            return column >= self.min_
+        return column.inRange(self.min_, self.max_)
+
+
 class LogAll(object):
 
     """this can be used as __metaclass__ of Hdf5TableProxy to see how long
@@ -80,7 +112,9 @@ class Hdf5TableProxy(ImmutableTable):
         self.perm = None
 
         r = self.reader
-        self._ghost_table = Table(r.col_names, r.col_types, r.col_formats, meta=r.meta, rows=[])
+        # tables with joined columns have names with double underscores:
+        self._ghost_table = Table._create(r.col_names, r.col_types, r.col_formats, meta=r.meta,
+                                          rows=[])
 
         # we add rows later, because the Table constructor tries to setup column expressions
         # which is expensive for large hdf5 tables:
@@ -137,7 +171,7 @@ class Hdf5TableProxy(ImmutableTable):
 
     def findMatchingRows(self, filters):
         """accepts list of column names and functions operating on those columns,
-        returns the indices of the remaining columns
+        returns the indices of the remaining columns as sorted numpy array.
 
         Example::
 
@@ -146,20 +180,37 @@ class Hdf5TableProxy(ImmutableTable):
 
             computes the row indices of all rows where mz and rt are in the given
             ranges.
-        """
 
-        indices_of_fitting_rows = RangeSet(0, len(self))
+        :py:class:`RangeFilter` filters on numerical columns are evaluated within pytables.
+        """
 
+        expressions = []
+        others = []
         for col_name, filter_function in filters:
 
             if filter_function is None:
                 continue
 
+            if isinstance(filter_function, RangeFilter) and \
+                    self.getColType(col_name) in indexed_types:
+                column = ColumnExpression(self._ghost_table, col_name, self.getIndex(col_name),
+                                          self.getColType(col_name))
+                expressions.append(filter_function.expression(column))
+            else:
+                others.append((col_name, filter_function))
+
+        if expressions:
+            indices_of_fitting_rows = matching_rows(self.reader, self._ghost_table,
+                                                    reduce(operator.and_, expressions))
+        else:
+            indices_of_fitting_rows = np.arange(len(self))
+
+        for col_name, filter_function in others:
+
             if isinstance(filter_function, UfuncWrapper):
 
-                values, missing_values = self.reader.get_raw_col_values(col_name)
-                keep = set(np.where(filter_function(values))[0])
-                keep -= set(missing_values)
+                values, missing = self.reader.get_raw_col_values(col_name)
+                keep = np.where(filter_function(values) & ~missing)[0]
 
             else:
                 values = self.reader.get_col_values(col_name)
@@ -175,14 +226,44 @@ class Hdf5TableProxy(ImmutableTable):
                 subset = values[iflags]
                 subflags = np.vectorize(filter_function)(subset)
                 iflags[iflags] = subflags
-                keep = set(np.where(iflags)[0])
+                keep = np.where(iflags)[0]
 
-            indices_of_fitting_rows = indices_of_fitting_rows.intersection(keep)
+            indices_of_fitting_rows = np.intersect1d(indices_of_fitting_rows, keep,
+                                                     assume_unique=True)
 
-        # prevent speed deterioration:
-        assert isinstance(indices_of_fitting_rows, (set, RangeSet))
         return indices_of_fitting_rows
 
+    def filter(self, expr, debug=False):
+        """builds a new in memory :py:class:`Table` with the rows of this table selected
+        according to ``expr``, eg ::
+
+               proxy.filter(proxy.mz >= 100.0)
+               proxy.filter(proxy.mz.inRange(100.0, 200.0) & (proxy.rt <= 20))
+
+        comparisons of numerical columns and ``isIn`` are evaluated within pytables, other
+        parts of ``expr`` only load the needed columns. only the matching rows are loaded.
+        """
+        if not isinstance(expr, BaseExpression):
+            expr = Value(expr)
+        if debug:
+            print("#", expr)
+        indices = matching_rows(self.reader, self._ghost_table, expr)
+        rows = [self._resolve(row) for row in self.reader.fetch_rows(indices)]
+        return Table._create(self._colNames, self._colTypes, self._colFormats, rows=rows,
+                             meta=self.meta)
+
+    def lazy(self, chunk_size=10000):
+        """returns a :py:class:`~emzed.core.data_types.lazy_table.LazyTable` which records
+        operations and executes them chunk by chunk later, eg ::
+
+               lazy = proxy.lazy().filter(proxy.mz >= 100.0)
+               lazy = lazy.addColumn("rtmin_minutes", lazy.rtmin / 60.0, type_=float)
+               lazy.store("filtered.hdf5")
+
+        at most ``chunk_size`` rows of this table are loaded at once.
+        """
+        return LazyTable(self, chunk_size)
+
     def __len__(self):
         return len(self.reader)
 
@@ -223,38 +304,15 @@ class Hdf5TableProxy(ImmutableTable):
         for order in ascending:
             assert isinstance(order, bool)
 
-        def fill_in(values, ascending):
-            if isinstance(values.dtype.type(0), np.integer):
-                info = np.iinfo(values.dtype)
-                return info.min if ascending else info.max
-            elif isinstance(values.dtype.type(0), np.floating):
-                info = np.finfo(values.dtype)
-                return info.min if ascending else info.max
-            return None
-
-        perm = range(len(self))
-        all_values = dict()
-        for col_name, asc in reversed(zip(colNames, ascending)):
+        columns = []
+        for col_name in colNames:
             t = self.getColType(col_name)
             if t in (int, float, long):
-                values, missing_values = self.reader.get_raw_col_values(col_name)
-                missing_values = np.fromiter(missing_values, dtype=int)
-                values[missing_values] = fill_in(values, ascending)
-                all_values[col_name] = values
+                columns.append(self.reader.get_raw_col_values(col_name))
             else:
-                values = self.reader.get_col_values(col_name)
-                all_values[col_name] = values
-        if len(all_values) == 1:
-            # mergesort turned out to work best:
-            perm = np.argsort(values, kind="mergesort")
-            if not asc:
-                perm = perm[::-1]
-            return map(int, perm)    # might contain values of numpy int types
-        all_values["_i"] = perm
-        df = pd.DataFrame(all_values, columns=colNames + ("_i",))
-        df = df.sort_values(list(colNames), ascending=list(ascending))
-        perm = map(int, df["_i"].values)    # might contain values of numpy int types
-        return perm
+                columns.append((self.reader.get_col_values(col_name), None))
+        perm = sort_permutation(columns, ascending)
+        return map(int, perm)    # might contain values of numpy int types
 
     def setCellValue(self, row_indices, col_indices, values):
         for ri, ci, v in self._ghost_table._resolve_write_operations(row_indices, col_indices,
@@ -280,17 +338,20 @@ class Hdf5TableProxy(ImmutableTable):
         return self.reader.get_col_values(name)
 
     def toTable(self):
-        rows = []
-        for row in self.reader:
-            resolved_row = []
-            for cell in row:
-                if isinstance(cell, ObjectProxy):
-                    cell = cell.load()
-                resolved_row.append(cell)
-            rows.append(resolved_row)
-        rv = Table(self._colNames, self._colTypes, self._colFormats, rows=rows, meta=self.meta)
+        rows = [self._resolve(row) for row in self.reader]
+        rv = Table._create(self._colNames, self._colTypes, self._colFormats, rows=rows,
+                           meta=self.meta)
         return rv
 
+    @staticmethod
+    def _resolve(row):
+        resolved_row = []
+        for cell in row:
+            if isinstance(cell, ObjectProxy):
+                cell = cell.load()
+            resolved_row.append(cell)
+        return resolved_row
+
     @property
     def rows(self):
         # to allow iterating as we know from Table class:
@@ -10,35 +10,40 @@ from hdf5.accessors import Hdf5TableWriter, Hdf5TableAppender
 from .table import try_to_move
 
 
-def to_hdf5(table, path, atomic=True):
+def to_hdf5(table, path, atomic=True, mz_index=False):
     """writes single table
     atomic mode assures that only a complete file will show up when the functions returns.
     On some Windows systems this causes trouble (other procecess as virus scanner may disallow
     renaming, on other systems creation of symlinks are not allowed for the current user),
     then the setting "atomic=False" will work at the risk of incomplete files in rare cases.
+
+    "mz_index=True" additionally stores the peaks of peakmaps in tiles by m/z and rt, which
+    makes extracting chromatograms from the stored peakmaps much faster at the cost of a
+    larger file.
     """
 
     if atomic:
-        writer = Hdf5TableWriter(path + ".incomplete")
+        writer = Hdf5TableWriter(path + ".incomplete", mz_index)
         writer.write_table(table)
         writer.close()
         try_to_move(path + ".incomplete", path)
     else:
-        writer = Hdf5TableWriter(path)
+        writer = Hdf5TableWriter(path, mz_index)
         writer.write_table(table)
         writer.close()
 
 
 class _Adder(object):
 
-    def __init__(self, path):
+    def __init__(self, path, mz_index=False):
         self.appender = None
         self.writer = None
         self.path = path
+        self.mz_index = mz_index
 
     def __call__(self, table):
         if self.writer is None:
-            self.writer = Hdf5TableWriter(self.path)
+            self.writer = Hdf5TableWriter(self.path, self.mz_index)
             self.writer.write_table(table)
             self.writer.close()
         else:
@@ -52,13 +57,13 @@ class _Adder(object):
 
 
 @contextlib.contextmanager
-def atomic_hdf5_writer(path, atomic=True):
+def atomic_hdf5_writer(path, atomic=True, mz_index=False):
 
     if atomic:
         temp_path = path + ".incomplete"
     else:
         temp_path = path
-    adder = _Adder(temp_path)
+    adder = _Adder(temp_path, mz_index)
     try:
         yield adder
     except Exception, e:
@@ -0,0 +1,227 @@
+# encoding: utf-8
+from __future__ import print_function, division, absolute_import
+
+import os
+
+import numpy as np
+
+
+def _reduce_axis(data, positions, n, ufunc, axis):
+    """combines the slices of ``data`` along ``axis`` which have the same pixel position using
+    ``ufunc``, ``positions`` must be sorted. returns array with ``n`` pixels along ``axis``,
+    pixels without data are zero."""
+    keep = (positions >= 0) & (positions < n)
+    data = np.compress(keep, data, axis)
+    positions = positions[keep]
+    shape = list(data.shape)
+    shape[axis] = n
+    result = np.zeros(shape, dtype=data.dtype)
+    if not len(positions):
+        return result
+    starts = np.flatnonzero(np.concatenate(([True], np.diff(positions) != 0)))
+    index = [slice(None)] * data.ndim
+    index[axis] = positions[starts]
+    result[tuple(index)] = ufunc.reduceat(data, starts, axis=axis)
+    return result
+
+
+def _pixel_overlaps(lower, width, first, last, vmin, vmax, n):
+    """for the bins first .. last, which are not wider than the n pixels from vmin to vmax,
+    returns the positions of the pixels containing the lower bin edges and the fractions of
+    the bins within these pixels. the rest of a bin is in the next pixel."""
+    scale = n / (vmax - vmin)
+    starts = (lower + np.arange(first, last + 1) * width - vmin) * scale
+    # bins aligned to pixels shall not leave slivers in the next pixel due to rounding:
+    rounded = np.round(starts)
+    starts = np.where(np.abs(starts - rounded) < 1e-6, rounded, starts)
+    positions = np.floor(starts)
+    fractions = np.clip((positions + 1 - starts) / (width * scale), 0.0, 1.0)
+    return positions.astype(np.int64), fractions
+
+
+def _resample_axis(data, positions, fractions, n, how, axis):
+    """distributes the slices of ``data`` along ``axis`` to the pixels they overlap, see
+    _pixel_overlaps. sums are split according to the overlaps, so pixels covering a
+    different number of bins get no bands in the image. maxima count for every pixel they
+    overlap."""
+    shape = [1] * data.ndim
+    shape[axis] = len(fractions)
+    fractions = fractions.reshape(shape)
+    if how == "sum":
+        return (_reduce_axis(data * fractions, positions, n, np.add, axis)
+                + _reduce_axis(data * (1.0 - fractions), positions + 1, n, np.add, axis))
+    first = _reduce_axis(data, positions, n, np.maximum, axis)
+    second = _reduce_axis(np.where(fractions < 1.0, data, 0.0), positions + 1, n, np.maximum,
+                          axis)
+    return np.maximum(first, second)
+
+
+class ImagePyramid(object):
+
+    """precomputed rt x m/z images of a peakmap at several resolutions for fast drawing.
+
+    level 0 has ``RT_BINS`` x ``MZ_BINS`` bins over the rt and m/z range of the peakmap, every
+    further level halves the number of bins along both axes. for every level we keep the sum
+    and the maximum of the intensities in each bin, the images have m/z along the first axis.
+
+    :py:meth:`~.sample` combines the bins of the coarsest level which is still fine enough
+    for the requested image size, so the costs do not depend on the number of peaks.
+    """
+
+    RT_BINS = 1024
+    MZ_BINS = 2048
+
+    def __init__(self, rtmin, rtmax, mzmin, mzmax, sums, maxs):
+        self.rtmin = rtmin
+        self.rtmax = rtmax
+        self.mzmin = mzmin
+        self.mzmax = mzmax
+        self.sums = sums
+        self.maxs = maxs
+
+    @classmethod
+    def from_peak_arrays(clz, arrays, ms_level, rt_bins=None, mz_bins=None):
+        """builds pyramid from the spectra of ``ms_level`` in the
+        :py:class:`~emzed.core.data_types.peak_arrays.PeakArrays` ``arrays``"""
+        if rt_bins is None:
+            rt_bins = clz.RT_BINS
+        if mz_bins is None:
+            mz_bins = clz.MZ_BINS
+
+        spectra_indices = arrays.select(ms_level)
+        peak_indices = arrays.peak_indices(spectra_indices)
+        sizes = arrays.offsets[spectra_indices + 1] - arrays.offsets[spectra_indices]
+        rts = np.repeat(arrays.rts[spectra_indices], sizes)
+        mzs = arrays.mzs[peak_indices]
+        iis = arrays.intensities[peak_indices]
+
+        if len(mzs):
+            rtmin, rtmax = arrays.rts[spectra_indices].min(), arrays.rts[spectra_indices].max()
+            mzmin, mzmax = mzs.min(), mzs.max()
+        else:
+            rtmin = rtmax = mzmin = mzmax = 0.0
+        # avoid zero widths for peakmaps with one spectrum or one peak:
+        if rtmax == rtmin:
+            rtmax = rtmin + 1.0
+        if mzmax == mzmin:
+            mzmax = mzmin + 1.0
+
+        rt_pos = np.minimum(((rts - rtmin) / (rtmax - rtmin) * rt_bins).astype(np.int64),
+                            rt_bins - 1)
+        mz_pos = np.minimum(((mzs - mzmin) / (mzmax - mzmin) * mz_bins).astype(np.int64),
+                            mz_bins - 1)
+        bins = mz_pos * rt_bins + rt_pos
+
+        sums = np.bincount(bins, weights=iis, minlength=mz_bins * rt_bins)
+        maxs = np.zeros((mz_bins * rt_bins,), dtype=np.float64)
+        if len(bins):
+            order = np.argsort(bins, kind="mergesort")
+            bins = bins[order]
+            starts = np.flatnonzero(np.concatenate(([True], np.diff(bins) != 0)))
+            maxs[bins[starts]] = np.maximum.reduceat(iis[order], starts)
+
+        sums = [sums.reshape(mz_bins, rt_bins).astype(np.float32)]
+        maxs = [maxs.reshape(mz_bins, rt_bins).astype(np.float32)]
+        while sums[-1].shape != (1, 1):
+            n_mz, n_rt = sums[-1].shape
+            f_mz = 2 if n_mz > 1 else 1
+            f_rt = 2 if n_rt > 1 else 1
+            shape = (n_mz // f_mz, f_mz, n_rt // f_rt, f_rt)
+            sums.append(sums[-1][:shape[0] * f_mz, :shape[2] * f_rt].reshape(shape)
+                        .sum(axis=3).sum(axis=1))
+            maxs.append(maxs[-1][:shape[0] * f_mz, :shape[2] * f_rt].reshape(shape)
+                        .max(axis=3).max(axis=1))
+
+        return clz(rtmin, rtmax, mzmin, mzmax, sums, maxs)
+
+    def sample(self, rtmin, rtmax, mzmin, mzmax, nx, ny, how="sum"):
+        """returns ``ny`` x ``nx`` image of the given rt and m/z range with summed up or maximal
+        (``how="max"``) intensities per pixel. returns None if the pixels are smaller than the
+        bins of the finest level, then one has to sample from the peaks.
+        """
+        assert how in ("sum", "max")
+        if rtmin >= rtmax or mzmin >= mzmax or nx <= 0 or ny <= 0:
+            return np.zeros((max(ny, 0), max(nx, 0)))
+
+        levels = self.sums if how == "sum" else self.maxs
+        pixel_rt = (rtmax - rtmin) / nx
+        pixel_mz = (mzmax - mzmin) / ny
+
+        # coarsest level with bins not larger than the pixels:
+        for level in reversed(levels):
+            n_mz, n_rt = level.shape
+            width_rt = (self.rtmax - self.rtmin) / n_rt
+            width_mz = (self.mzmax - self.mzmin) / n_mz
+            if width_rt <= pixel_rt and width_mz <= pixel_mz:
+                break
+        else:
+            return None
+
+        i0 = max(0, int(np.floor((rtmin - self.rtmin) / width_rt)))
+        i1 = min(n_rt - 1, int(np.floor((rtmax - self.rtmin) / width_rt)))
+        j0 = max(0, int(np.floor((mzmin - self.mzmin) / width_mz)))
+        j1 = min(n_mz - 1, int(np.floor((mzmax - self.mzmin) / width_mz)))
+        if i0 > i1 or j0 > j1:
+            return np.zeros((ny, nx))
+
+        data = level[j0:j1 + 1, i0:i1 + 1].astype(np.float64)
+        x_pos, x_fractions = _pixel_overlaps(self.rtmin, width_rt, i0, i1, rtmin, rtmax, nx)
+        y_pos, y_fractions = _pixel_overlaps(self.mzmin, width_mz, j0, j1, mzmin, mzmax, ny)
+        data = _resample_axis(data, x_pos, x_fractions, nx, how, 1)
+        return _resample_axis(data, y_pos, y_fractions, ny, how, 0)
+
+    def save(self, path):
+        """saves pyramid as .npz file, see :py:meth:`~.load`"""
+        arrays = dict(bounds=np.array([self.rtmin, self.rtmax, self.mzmin, self.mzmax]))
+        for i, (sums, maxs) in enumerate(zip(self.sums, self.maxs)):
+            arrays["sums_%d" % i] = sums
+            arrays["maxs_%d" % i] = maxs
+        # np.savez appends .npz to file names without this extension, so we pass a file:
+        with open(path, "wb") as fp:
+            np.savez(fp, **arrays)
+
+    @classmethod
+    def load(clz, path):
+        data = np.load(path)
+        try:
+            rtmin, rtmax, mzmin, mzmax = data["bounds"]
+            n = sum(1 for name in data.files if name.startswith("sums_"))
+            sums = [data["sums_%d" % i] for i in range(n)]
+            maxs = [data["maxs_%d" % i] for i in range(n)]
+        finally:
+            data.close()
+        return clz(rtmin, rtmax, mzmin, mzmax, sums, maxs)
+
+
+def pyramid_path(peakmap, ms_level):
+    """path for persisting the pyramid of ``peakmap`` next to its peakmap cache file, None if
+    the peakmap is not backed by a cache file, see :py:class:`~.ms_types.PeakMapProxy`"""
+    partial_cache = getattr(peakmap, "_partial_cache", None)
+    if partial_cache is None or partial_cache() is None:
+        return None
+    return "%s.pyramid_ms%d.npz" % (peakmap._path, ms_level)
+
+
+def image_pyramid(peakmap, ms_level):
+    """returns :py:class:`~.ImagePyramid` for the spectra of ``ms_level`` of ``peakmap``. For
+    peakmaps loaded from a peakmap cache file the pyramid is stored next to this file and
+    reused later."""
+    path = pyramid_path(peakmap, ms_level)
+    if path is not None and os.path.exists(path):
+        if os.path.getmtime(path) >= os.path.getmtime(peakmap._path):
+            try:
+                return ImagePyramid.load(path)
+            except Exception:
+                # corrupted or incompatible file, we compute the pyramid again:
+                pass
+    pyramid = ImagePyramid.from_peak_arrays(peakmap.peakArrays(), ms_level)
+    if path is not None:
+        try:
+            pyramid.save(path + ".incomplete")
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(path + ".incomplete", path)
+        except EnvironmentError:
+            # eg read only folder, the pyramid is just not persisted then.
+            pass
+    return pyramid
@@ -0,0 +1,421 @@
+# encoding: utf-8
+"""
+``Table.join`` and ``Table.leftJoin`` evaluate the join expression for every row of the left
+table against all rows of the right table. For conjunctions containing range conditions like
+``inRange``, ``approxEqual``, ``<=`` / ``>=`` or ``equals`` this is wasteful: here we extract
+bounds for columns of the right table from these conditions, determine candidate rows using
+sorted column values or the lookups of ``equals`` and evaluate the expression on the candidate
+rows only. The result is the same as evaluating the full expression.
+"""
+
+import numbers
+
+import numpy as np
+
+from .expressions import (AggregateExpression, AndExpression, BaseExpression, BinaryExpression,
+                          ColumnByValuesExpression, ColumnExpression, CompExpression,
+                          FastAndExpression, FastEqualExpression, FastOrExpression,
+                          GroupedAggregateExpression, Lookup, MultiDimLookup, Value,
+                          _basic_num_types)
+from .expression_compiler import compile_expression
+
+
+_flipped = {"<": ">", "<=": ">=", ">": "<", ">=": "<=", "==": "=="}
+
+
+def _conjuncts(expr):
+    if isinstance(expr, (AndExpression, FastAndExpression)):
+        return _conjuncts(expr.left) + _conjuncts(expr.right)
+    return [expr]
+
+
+def _sub_expressions(expr):
+    for value in vars(expr).values():
+        if isinstance(value, BaseExpression):
+            yield value
+
+
+def _contains_fast_expression(expr):
+    if isinstance(expr, (FastEqualExpression, FastAndExpression, FastOrExpression)):
+        return True
+    return any(_contains_fast_expression(e) for e in _sub_expressions(expr))
+
+
+def _is_row_wise_for_tables(expr, tables):
+    """checks if evaluating expr for a subset of the rows of the given tables gives the
+    same result as evaluating for all rows and taking the subset afterwards"""
+    if isinstance(expr, (AggregateExpression, GroupedAggregateExpression,
+                         ColumnByValuesExpression)):
+        return False
+    if isinstance(expr, ColumnExpression):
+        return any(expr.table is t for t in tables)
+    return all(_is_row_wise_for_tables(e, tables) for e in _sub_expressions(expr))
+
+
+def _is_number(value):
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+
+def _is_row_wise(expr, table):
+    """checks if expr is computed row by row from columns of ``table`` and constants. so
+    evaluating expr for all rows at once gives the same values as evaluating row by row"""
+    if isinstance(expr, Value):
+        return True
+    if isinstance(expr, ColumnExpression):
+        return expr.table is table
+    if type(expr) is BinaryExpression and expr.symbol in ("+", "-", "*", "/"):
+        return _is_row_wise(expr.left, table) and _is_row_wise(expr.right, table)
+    return False
+
+
+def _affine(expr, table):
+    """checks if expr is ``a * column + b`` with ``a > 0`` for a numerical column of ``table``.
+    returns ``(column_name, a, b, is_float)`` in this case, else None.
+    """
+    if isinstance(expr, ColumnExpression):
+        if expr.table is table and expr.type_ in (int, long, float):
+            return expr.colname, 1.0, 0.0, expr.type_ is float
+        return None
+    if type(expr) is not BinaryExpression:
+        return None
+
+    symbol = expr.symbol
+    if isinstance(expr.right, Value) and _is_number(expr.right.value):
+        inner, c = _affine(expr.left, table), float(expr.right.value)
+        if inner is None:
+            return None
+        name, a, b, is_float = inner
+        if symbol == "+":
+            return name, a, b + c, is_float
+        if symbol == "-":
+            return name, a, b - c, is_float
+        if symbol == "*" and c > 0:
+            return name, a * c, b * c, is_float
+        # integer division is not affine:
+        if symbol == "/" and c > 0 and (is_float or isinstance(expr.right.value, float)):
+            return name, a / c, b / c, True
+        return None
+
+    if isinstance(expr.left, Value) and _is_number(expr.left.value):
+        inner, c = _affine(expr.right, table), float(expr.left.value)
+        if inner is None:
+            return None
+        name, a, b, is_float = inner
+        if symbol == "+":
+            return name, a, b + c, is_float
+        if symbol == "*" and c > 0:
+            return name, a * c, b * c, is_float
+    return None
+
+
+def _as_float_array(values, n):
+    if len(values) == 1 and n != 1:
+        values = [values[0]] * n
+    values = [np.nan if v is None else v for v in values]
+    return np.array(values, dtype=float)
+
+
+def _as_array(values):
+    if isinstance(values, np.ndarray):
+        return values
+    # assigning a list to an object array slice would unpack nested sequences, so:
+    result = np.empty((len(values),), dtype=object)
+    for i, v in enumerate(values):
+        result[i] = v
+    return result
+
+
+class _ColumnBounds(object):
+
+    def __init__(self, name, values):
+        self.name = name
+        self.values = values
+        self.lower = None
+        self.upper = None
+        valid = ~np.isnan(values)
+        self.order = np.where(valid)[0][np.argsort(values[valid], kind="mergesort")]
+        self.sorted_values = values[self.order]
+
+    def add_lower(self, bound):
+        self.lower = bound if self.lower is None else np.maximum(self.lower, bound)
+
+    def add_upper(self, bound):
+        self.upper = bound if self.upper is None else np.minimum(self.upper, bound)
+
+    def ranges(self):
+        """computes ranges in self.order for all left rows"""
+        if self.lower is not None:
+            lo = np.searchsorted(self.sorted_values, self.lower, "left")
+        else:
+            lo = np.zeros((len(self.upper),), dtype=int)
+        if self.upper is not None:
+            hi = np.searchsorted(self.sorted_values, self.upper, "right")
+        else:
+            hi = np.zeros((len(self.lower),), dtype=int) + len(self.sorted_values)
+        # nan bounds come from None values in the left table, no match possible:
+        invalid = np.zeros((len(lo),), dtype=bool)
+        if self.lower is not None:
+            invalid |= np.isnan(self.lower)
+        if self.upper is not None:
+            invalid |= np.isnan(self.upper)
+        hi[invalid] = lo[invalid]
+        return lo, np.maximum(hi, lo)
+
+    def check(self, candidates, i):
+        values = self.values[candidates]
+        ok = ~np.isnan(values)
+        if self.lower is not None:
+            ok &= values >= self.lower[i]
+        if self.upper is not None:
+            ok &= values <= self.upper[i]
+        return candidates[ok]
+
+    def __str__(self):
+        if self.lower is not None and self.upper is not None:
+            return "%s (band)" % self.name
+        if self.lower is not None:
+            return "%s (lower bound)" % self.name
+        return "%s (upper bound)" % self.name
+
+
+class JoinPlanner(object):
+
+    """determines strategy for ``Table.join`` and ``Table.leftJoin``. ``iter_matches`` yields
+    the matching row indices of the right table for every row of the left table.
+    """
+
+    def __init__(self, left, right, expr):
+        self.left = left
+        self.right = right
+        self.expr = expr
+        self.compiled = compile_expression(expr)
+        self.n_left = len(left)
+        self.n_right = len(right)
+        self.bounds = []
+        self.lookups = []
+        self.primary = None
+        self.batch_candidates = None
+        self.strategy = "nested loop"
+        self.needed = expr._neededColumns()
+        self.right_ctx = right._getColumnCtx(self.needed)
+        # self joins are evaluated in a nested loop, here we can not distinguish the tables:
+        if self.n_left and self.n_right and left is not right:
+            self._setup()
+
+    def describe(self):
+        if self.strategy == "nested loop":
+            return "nested loop over %d x %d rows" % (self.n_left, self.n_right)
+        if self.strategy == "lookup":
+            if self.batch_candidates is not None:
+                primary = "lookup %s (batched)" % ", ".join(str(l.left) for l in self.lookups)
+            else:
+                primary = "lookup %s" % self.primary.left
+        else:
+            primary = "%s on %s" % (self.strategy, self.primary)
+        others = [str(b) for b in self.bounds if b is not self.primary]
+        if others:
+            primary += ", range checks on " + ", ".join(others)
+        return primary
+
+    def _setup(self):
+        conjuncts = _conjuncts(self.expr)
+        if not _is_row_wise_for_tables(self.expr, (self.left, self.right)):
+            return
+        if any(_contains_fast_expression(c) for c in conjuncts
+               if not isinstance(c, FastEqualExpression)):
+            return
+
+        bounds = dict()
+        for conjunct in conjuncts:
+            if isinstance(conjunct, FastEqualExpression):
+                if len(conjunct.lookup.values) == self.n_right:
+                    self.lookups.append(conjunct)
+                else:
+                    return
+                continue
+            self._add_bounds(conjunct, bounds)
+
+        self.bounds = bounds.values()
+        self.fast_conjuncts = [c for c in conjuncts if isinstance(c, FastEqualExpression)]
+        self.other_conjuncts = [c for c in conjuncts if not isinstance(c, FastEqualExpression)]
+
+        if self.lookups:
+            self.strategy = "lookup"
+            self.primary = self.lookups[0]
+            self.batch_candidates = self._batch_lookup_candidates()
+            return
+
+        best = None
+        for bound in self.bounds:
+            lo, hi = bound.ranges()
+            count = np.sum(hi - lo)
+            if best is None or count < best[0]:
+                best = (count, bound, lo, hi)
+        if best is None:
+            return
+
+        __, self.primary, self.lo, self.hi = best
+        if self.primary.lower is not None and self.primary.upper is not None:
+            self.strategy = "sort-merge"
+        elif any((self.primary.upper is None) != (b.upper is None) for b in self.bounds):
+            self.strategy = "interval"
+        else:
+            self.strategy = "range scan"
+
+    def _batch_lookup_candidates(self):
+        """combines the lookups of all ``equals`` conditions to one MultiDimLookup and
+        determines the candidates for all rows of the left table at once. returns None if the
+        left sides of the conditions can not be evaluated for all rows at once."""
+        columns = []
+        abs_tols = []
+        rel_tols = []
+        for fast_expression in self.lookups:
+            lookup = fast_expression.lookup
+            if not isinstance(lookup, Lookup) or not _is_row_wise(fast_expression.left,
+                                                                   self.left):
+                return None
+            try:
+                ctx = {self.left: self.left._getColumnCtx(fast_expression.left._neededColumns())}
+                values, __, __ = fast_expression.left._eval(ctx)
+            except Exception:
+                return None
+            values = values.tolist() if isinstance(values, np.ndarray) else list(values)
+            if len(values) == 1:
+                values = values * self.n_left
+            columns.append(values)
+            (abs_tol,), (rel_tol,) = lookup._tolerances()
+            abs_tols.append(abs_tol)
+            rel_tols.append(rel_tol)
+
+        right_columns = [fast_expression.lookup.values for fast_expression in self.lookups]
+        try:
+            lookup = MultiDimLookup(right_columns, abs_tols, rel_tols)
+        except Exception:
+            # eg cell grid too large
+            return None
+        rows, matches = lookup.find_all(columns)
+        limits = np.searchsorted(rows, np.arange(self.n_left + 1))
+        return [np.sort(matches[limits[i]:limits[i + 1]]) for i in range(self.n_left)]
+
+    def _add_bounds(self, conjunct, bounds):
+        if not isinstance(conjunct, CompExpression) or conjunct.symbol not in _flipped:
+            return
+        symbol = conjunct.symbol
+        affine = _affine(conjunct.right, self.right)
+        row_wise = conjunct.left
+        if affine is None:
+            affine = _affine(conjunct.left, self.right)
+            row_wise = conjunct.right
+            symbol = _flipped[symbol]
+        if affine is None or not _is_row_wise(row_wise, self.left):
+            return
+
+        name, a, b, __ = affine
+        try:
+            ctx = {self.left: self.left._getColumnCtx(row_wise._neededColumns())}
+            values, __, type_ = row_wise._eval(ctx)
+            if type_ not in _basic_num_types:
+                return
+            values = _as_float_array(values, self.n_left)
+        except Exception:
+            return
+
+        if name not in bounds:
+            right_values, __, __ = self.right_ctx.get(name) or (None, None, None)
+            if right_values is None:
+                return
+            try:
+                right_values = _as_float_array(right_values, self.n_right)
+            except (TypeError, ValueError):
+                return
+            bounds[name] = _ColumnBounds(name, right_values)
+
+        # we solve "values symbol a * y + b" for y. the slack compensates rounding errors, the
+        # final result is computed by evaluating the expression for the candidates anyway:
+        limit = (values - b) / a
+        slack = 1e-7 * (np.abs(values) + abs(b) + 1.0) / a
+        if symbol in (">", ">=", "=="):
+            bounds[name].add_upper(limit + slack)
+        if symbol in ("<", "<=", "=="):
+            bounds[name].add_lower(limit - slack)
+
+    def _row_ctx(self, row):
+        return dict((n, ([v], None, t)) for (n, v, t) in
+                    zip(self.left._colNames, row, self.left._colTypes))
+
+    def iter_matches(self):
+        if self.strategy == "nested loop":
+            return self._iter_nested_loop()
+        return self._iter_candidates()
+
+    def _iter_nested_loop(self):
+        all_right = range(self.n_right)
+        for row in self.left._iterRowValues():
+            ctx = {self.left: self._row_ctx(row), self.right: self.right_ctx}
+            # the compiled expression converts the columns of right_ctx only once:
+            flags = self.compiled.evaluate_flags(ctx)
+            if len(flags) == 1:
+                yield all_right if flags[0] else []
+            else:
+                yield np.where(flags)[0].tolist()
+
+    def _lookup_candidates(self, fast_expression, row_ctx):
+        lvals, __, __ = fast_expression.left._eval(row_ctx)
+        if len(lvals) > 1:
+            # raises the exception with the explanation:
+            fast_expression._eval(row_ctx)
+        if lvals[0] is None:
+            return np.zeros((0,), dtype=int)
+        return np.array(sorted(fast_expression.lookup.find(lvals[0])), dtype=int)
+
+    def _iter_candidates(self):
+        right_values = dict((n, (_as_array(v), t)) for (n, (v, __, t))
+                            in self.right_ctx.items())
+        if self.fast_conjuncts:
+            to_evaluate = [compile_expression(c) for c in self.other_conjuncts]
+        else:
+            to_evaluate = [self.compiled]
+
+        for i, row in enumerate(self.left._iterRowValues()):
+            row_ctx = {self.left: self._row_ctx(row)}
+            if self.batch_candidates is not None:
+                candidates = self.batch_candidates[i]
+            elif self.strategy == "lookup":
+                candidates = self._lookup_candidates(self.primary, row_ctx)
+            else:
+                candidates = np.sort(self.primary.order[self.lo[i]:self.hi[i]])
+
+            for bound in self.bounds:
+                if len(candidates) == 0:
+                    break
+                if bound is not self.primary:
+                    candidates = bound.check(candidates, i)
+
+            for fast_expression in self.fast_conjuncts:
+                if len(candidates) == 0 or self.batch_candidates is not None:
+                    break
+                if fast_expression is not self.primary:
+                    found = self._lookup_candidates(fast_expression, row_ctx)
+                    candidates = np.intersect1d(candidates, found)
+
+            if len(candidates) == 0:
+                yield []
+                continue
+
+            sub_ctx = dict()
+            for name, (values, type_) in right_values.items():
+                values = values[candidates]
+                if type_ not in _basic_num_types:
+                    values = values.tolist()
+                sub_ctx[name] = (values, None, type_)
+
+            ctx = {self.left: row_ctx[self.left], self.right: sub_ctx}
+            ok = np.ones((len(candidates),), dtype=bool)
+            for compiled in to_evaluate:
+                flags = compiled.evaluate_flags(ctx)
+                if len(flags) == 1:
+                    if not flags[0]:
+                        ok[:] = False
+                else:
+                    ok &= flags
+            yield candidates[ok].tolist()
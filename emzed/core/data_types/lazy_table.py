@@ -0,0 +1,209 @@
+# encoding: utf-8, division
+from __future__ import print_function, division
+
+import copy
+import operator
+import types
+
+import numpy as np
+
+from .expressions import BaseExpression, ColumnExpression
+from .hdf5.query import matching_rows, split_query
+from .hdf5_table_writer import atomic_hdf5_writer
+from .join_planner import _is_row_wise_for_tables
+
+
+class LazyTable(object):
+
+    """query plan over a :py:class:`~emzed.core.data_types.hdf5_table_proxy.Hdf5TableProxy`.
+    Operations are recorded and only executed when the result is requested, then the rows of
+    the hdf5 table are processed in chunks of ``chunk_size`` rows, so memory consumption does
+    not depend on the size of the hdf5 table.
+
+    Use :py:meth:`Hdf5TableProxy.lazy` to create a ``LazyTable``. Example::
+
+        proxy = emzed.io.Hdf5TableProxy("peaks.hdf5")
+        lazy = proxy.lazy().filter(proxy.mz.inRange(100.0, 200.0))
+        lazy = lazy.addColumn("mzdiff", lazy.mzmax - lazy.mzmin, type_=float)
+        lazy = lazy.join(targets, lazy.mz.equals(targets.mz, abs_tol=0.001))
+        lazy.store("result.hdf5")
+
+    Leading filters on numerical columns are evaluated within pytables, see
+    :py:meth:`Hdf5TableProxy.filter`.
+    """
+
+    def __init__(self, proxy, chunk_size, operations=(), ghost=None, ghosts=None):
+        assert chunk_size > 0, "chunk_size must be positive"
+        self.proxy = proxy
+        self.chunk_size = chunk_size
+        self.operations = tuple(operations)
+        if ghost is None:
+            ghost = proxy._ghost_table
+        # empty table with the columns of the result of the recorded operations:
+        self._ghost = ghost
+        # empty tables from all operations of the plan, column expressions in recorded
+        # operations refer to these:
+        self._ghosts = ghosts if ghosts is not None else (proxy._ghost_table,)
+
+    def _add(self, name, *args, **kw):
+        operation = (name, args, kw)
+        ghost = _apply(self._ghost.buildEmptyClone(), operation, self._ghosts)
+        return LazyTable(self.proxy, self.chunk_size, self.operations + (operation,), ghost,
+                         self._ghosts + (ghost,))
+
+    def filter(self, expr):
+        """records :py:meth:`Table.filter`"""
+        _check_row_wise(expr, self._ghosts)
+        return self._add("filter", expr)
+
+    def addColumn(self, name, what, type_, format_="", insertBefore=None, insertAfter=None):
+        """records :py:meth:`Table.addColumn`, other than there ``type_`` is needed as we
+        do not know the values when the operation is recorded."""
+        if type_ is None:
+            raise Exception("lazy tables need type_ for new columns")
+        _check_row_wise(what, self._ghosts)
+        return self._add("addColumn", name, what, type_, format_, insertBefore, insertAfter)
+
+    def replaceColumn(self, name, what, type_, format_=""):
+        """records :py:meth:`Table.replaceColumn`, ``type_`` is needed as for
+        :py:meth:`~.addColumn`"""
+        if type_ is None:
+            raise Exception("lazy tables need type_ for new columns")
+        _check_row_wise(what, self._ghosts)
+        return self._add("replaceColumn", name, what, type_, format_)
+
+    def dropColumns(self, *patterns):
+        """records :py:meth:`Table.dropColumns`"""
+        return self._add("dropColumns", *patterns)
+
+    def join(self, t, expr=True):
+        """records :py:meth:`Table.join`, ``t`` must be an in memory table"""
+        _check_row_wise(expr, self._ghosts + (t,))
+        return self._add("join", t, expr)
+
+    def leftJoin(self, t, expr=True):
+        """records :py:meth:`Table.leftJoin`, ``t`` must be an in memory table"""
+        _check_row_wise(expr, self._ghosts + (t,))
+        return self._add("leftJoin", t, expr)
+
+    def getColNames(self):
+        return self._ghost.getColNames()
+
+    def getColTypes(self):
+        return self._ghost.getColTypes()
+
+    def getColFormats(self):
+        return self._ghost.getColFormats()
+
+    def __getattr__(self, name):
+        # we use __dict__ to avoid infinite recursion when unpickling:
+        ghost = self.__dict__.get("_ghost")
+        if ghost is not None and name in ghost._colNames:
+            return getattr(ghost, name)
+        raise AttributeError("%s has no attribute %r" % (self, name))
+
+    def chunks(self):
+        """executes the plan and yields the result as tables with at most ``chunk_size``
+        rows each, joins might produce larger chunks. empty chunks are skipped."""
+        query_terms, operations = self._split_leading_filters()
+        for chunk in self._source_chunks(query_terms):
+            for operation in operations:
+                chunk = _apply(chunk, operation, self._ghosts)
+            if len(chunk):
+                yield chunk
+
+    def toTable(self):
+        """executes the plan and returns the result as an in memory table"""
+        result = self._ghost.buildEmptyClone()
+        for chunk in self.chunks():
+            result.rows.extend(chunk.rows)
+        result.resetInternals()
+        return result
+
+    def store(self, path, atomic=True):
+        """executes the plan and writes the result chunk by chunk to a hdf5 file, see
+        :py:func:`~emzed.io.atomic_hdf5_writer` for ``atomic``"""
+        with atomic_hdf5_writer(path, atomic) as add:
+            written = False
+            for chunk in self.chunks():
+                add(chunk)
+                written = True
+            if not written:
+                add(self._ghost.buildEmptyClone())
+
+    def _split_leading_filters(self):
+        """filters before all other operations are evaluated within pytables if possible.
+        returns the terms for pytables and the remaining operations"""
+        source = self.proxy._ghost_table
+        query_terms = []
+        operations = list(self.operations)
+        while operations and operations[0][0] == "filter":
+            __, (expr,), __ = operations[0]
+            # filters do not change the columns, so we can refer to the source table:
+            expr = _rebind(expr, self._ghosts, source)
+            if not isinstance(expr, BaseExpression):
+                break
+            terms, rest = split_query(self.proxy.reader, source, expr)
+            query_terms.extend(terms)
+            if rest:
+                operations[0] = ("filter", (reduce(operator.and_, rest),), {})
+                break
+            operations.pop(0)
+        return query_terms, operations
+
+    def _source_chunks(self, query_terms):
+        proxy = self.proxy
+        reader = proxy.reader
+        if query_terms:
+            indices = matching_rows(reader, proxy._ghost_table,
+                                    reduce(operator.and_, query_terms))
+            n = len(indices)
+        else:
+            indices = None
+            n = len(reader)
+        for start in range(0, n, self.chunk_size):
+            if indices is None:
+                row_indices = np.arange(start, min(n, start + self.chunk_size))
+            else:
+                row_indices = indices[start:start + self.chunk_size]
+            chunk = proxy._ghost_table.buildEmptyClone()
+            chunk.rows = [proxy._resolve(row) for row in reader.fetch_rows(row_indices)]
+            chunk.resetInternals()
+            yield chunk
+
+    def __str__(self):
+        return "<LazyTable over %s with %d operations>" % (self.proxy, len(self.operations))
+
+
+def _check_row_wise(what, tables):
+    """operations are applied to chunks of rows, so values must not depend on other rows as
+    aggregates like ``t.a.max`` do"""
+    if isinstance(what, BaseExpression):
+        if not _is_row_wise_for_tables(what, tables):
+            raise Exception("lazy tables only support expressions evaluated row by row, "
+                            "%s is not" % what)
+    elif isinstance(what, (list, tuple, types.GeneratorType, np.ndarray)):
+        raise Exception("lazy tables do not support lists of values, use an expression")
+
+
+def _rebind(what, ghosts, table):
+    """replaces column expressions referring to one of the tables in ``ghosts`` by the
+    corresponding column expressions of ``table``"""
+    if isinstance(what, ColumnExpression):
+        if any(what.table is ghost for ghost in ghosts):
+            return getattr(table, what.colname)
+        return what
+    if not isinstance(what, BaseExpression):
+        return what
+    rebound = copy.copy(what)
+    for name, value in vars(what).items():
+        if isinstance(value, BaseExpression):
+            setattr(rebound, name, _rebind(value, ghosts, table))
+    return rebound
+
+
+def _apply(table, (name, args, kw), ghosts):
+    args = [_rebind(arg, ghosts, table) for arg in args]
+    result = getattr(table, name)(*args, **kw)
+    # some operations work in place and return None:
+    return table if result is None else result
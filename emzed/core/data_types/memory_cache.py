@@ -0,0 +1,350 @@
+# encoding: utf-8
+from __future__ import print_function, division, absolute_import
+
+# in memory caches with budgets in bytes:
+#
+# every Cache evicts its least recently used entries when the estimated size of its values
+# exceeds its own budget. all caches together must not exceed a global limit, see
+# set_memory_limit, else the least recently used entries over all caches are evicted.
+# cache_stats reports the sizes and the hit, miss and eviction counts of all caches.
+
+from collections import OrderedDict
+import functools
+import inspect
+import itertools
+import sys
+import threading
+import weakref
+
+import numpy as np
+
+
+MB = 1 << 20
+
+_lock = threading.RLock()
+_caches = weakref.WeakSet()
+_ticks = itertools.count()
+_memory_limit = 2048 * MB
+# sum of the sizes of all caches, updated on every insertion and removal:
+_total_bytes = 0
+# weak references to the caches which release their bytes when a cache is garbage collected:
+_releasers = set()
+
+# bytes we account for every cache entry in addition to the size of the value:
+ENTRY_OVERHEAD = 100
+
+# object arrays and long lists are estimated from a sample of this size:
+SAMPLE_SIZE = 100
+
+
+def set_memory_limit(n_bytes):
+    """sets the upper limit for the sum of the sizes of all caches"""
+    global _memory_limit
+    with _lock:
+        _memory_limit = n_bytes
+        _enforce_memory_limit()
+
+
+def get_memory_limit():
+    return _memory_limit
+
+
+def total_bytes():
+    """estimated size of all cached values in bytes"""
+    return _total_bytes
+
+
+def _account(n_bytes):
+    global _total_bytes
+    _total_bytes += n_bytes
+
+
+def _release(ref, cache_bytes):
+    with _lock:
+        _releasers.discard(ref)
+        _account(-cache_bytes[0])
+
+
+def cache_stats():
+    """returns list of dicts with name, number of entries, size and counters of all caches"""
+    with _lock:
+        return sorted((cache.stats() for cache in _caches), key=lambda s: s["name"])
+
+
+def clear_all():
+    """evicts all entries of all caches, other than Cache.clear this calls the on_evict
+    callbacks"""
+    with _lock:
+        for cache in list(_caches):
+            while len(cache):
+                cache._evict_oldest()
+
+
+def estimate_size(obj, _depth=0):
+    """estimates memory consumption of ``obj`` in bytes. numpy arrays account with
+    ``nbytes``, containers with the sum of their items. for object arrays and long containers
+    we extrapolate from a sample of their items."""
+    if obj is None or isinstance(obj, (bool, int, long, float)):
+        return 24
+    if isinstance(obj, np.ndarray):
+        size = obj.nbytes
+        if obj.dtype == object and obj.size:
+            flat = obj.ravel()
+            size += _estimate_items(flat, len(flat), _depth)
+        return size
+    if isinstance(obj, (str, unicode, bytearray)):
+        return sys.getsizeof(obj)
+    if _depth > 3:
+        return sys.getsizeof(obj)
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return sys.getsizeof(obj) + _estimate_items(obj, len(obj), _depth)
+    if isinstance(obj, dict):
+        return (sys.getsizeof(obj) + _estimate_items(obj.keys(), len(obj), _depth)
+                + _estimate_items(obj.values(), len(obj), _depth))
+    # other objects, eg peakmaps or proxies: we only consider arrays and containers in their
+    # attributes, and do not follow references to other objects:
+    attributes = getattr(obj, "__dict__", None)
+    size = sys.getsizeof(obj)
+    if attributes:
+        for value in attributes.values():
+            if isinstance(value, (np.ndarray, list, tuple, dict, str, unicode)):
+                size += estimate_size(value, _depth + 1)
+    return size
+
+
+def _estimate_items(items, n, depth):
+    if n <= SAMPLE_SIZE:
+        return sum(estimate_size(item, depth + 1) for item in items)
+    if isinstance(items, (list, tuple, np.ndarray)):
+        sample = items[::n // SAMPLE_SIZE][:SAMPLE_SIZE]
+    else:
+        sample = list(itertools.islice(items, SAMPLE_SIZE))
+    return int(sum(estimate_size(item, depth + 1) for item in sample) * n / len(sample))
+
+
+def _enforce_memory_limit():
+    # we evict the least recently used entry over all caches:
+    while _total_bytes > _memory_limit:
+        oldest = None
+        for cache in _caches:
+            tick = cache._oldest_tick()
+            if tick is not None and (oldest is None or tick < oldest[0]):
+                oldest = (tick, cache)
+        if oldest is None:
+            break
+        oldest[1]._evict_oldest()
+
+
+class Cache(object):
+
+    """thread safe LRU mapping which keeps the estimated size of its values below
+    ``max_bytes``. ``max_entries`` optionally limits the number of entries too.
+
+    ``on_evict(key, value)`` is called for entries which are evicted due to the limits, but
+    not for entries which are removed with ``del`` or :py:meth:`~.clear`.
+
+    ``sizeof(value)`` replaces :py:func:`~.estimate_size` if the size of the values can be
+    determined faster.
+    """
+
+    def __init__(self, name, max_bytes, max_entries=None, on_evict=None, sizeof=estimate_size):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.on_evict = on_evict
+        self.sizeof = sizeof
+        # maps key to (value, size, tick), order is from least to most recently used:
+        self._data = OrderedDict()
+        # a list, so the bytes of the cache are known after it is garbage collected:
+        self._bytes = [0]
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        with _lock:
+            _caches.add(self)
+            _releasers.add(weakref.ref(self, functools.partial(_release,
+                                                                cache_bytes=self._bytes)))
+
+    @property
+    def bytes(self):
+        return self._bytes[0]
+
+    def _add_bytes(self, n_bytes):
+        self._bytes[0] += n_bytes
+        _account(n_bytes)
+
+    def __getitem__(self, key):
+        with _lock:
+            try:
+                value, size, __ = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                raise
+            self._data[key] = (value, size, next(_ticks))
+            self.hits += 1
+            return value
+
+    def get(self, key, default=None):
+        # as __getitem__, but misses are frequent here, so we avoid raising KeyError:
+        with _lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._data[key] = (entry[0], entry[1], next(_ticks))
+            self.hits += 1
+            return entry[0]
+
+    def get_many(self, keys):
+        """returns dict with the entries for those of ``keys`` which are in the cache"""
+        result = {}
+        with _lock:
+            for key in keys:
+                entry = self._data.pop(key, None)
+                if entry is None:
+                    self.misses += 1
+                    continue
+                self._data[key] = (entry[0], entry[1], next(_ticks))
+                self.hits += 1
+                result[key] = entry[0]
+        return result
+
+    def __setitem__(self, key, value):
+        with _lock:
+            self._insert(key, value)
+            _enforce_memory_limit()
+
+    def update(self, items):
+        """inserts iterable of ``(key, value)`` pairs, faster than inserting them one by one"""
+        with _lock:
+            for key, value in items:
+                self._insert(key, value)
+            _enforce_memory_limit()
+
+    def _insert(self, key, value):
+        size = self.sizeof(value) + ENTRY_OVERHEAD
+        self._remove(key)
+        if size > self.max_bytes:
+            # would evict everything else and itself:
+            return
+        self._data[key] = (value, size, next(_ticks))
+        self._add_bytes(size)
+        while self.bytes > self.max_bytes or (self.max_entries is not None
+                                              and len(self._data) > self.max_entries):
+            self._evict_oldest()
+
+    def __contains__(self, key):
+        """does not count as hit or miss and does not change the order of the entries"""
+        return key in self._data
+
+    def __delitem__(self, key):
+        with _lock:
+            if key not in self._data:
+                raise KeyError(key)
+            self._remove(key)
+
+    def __len__(self):
+        return len(self._data)
+
+    def keys(self):
+        with _lock:
+            return self._data.keys()
+
+    def values(self):
+        with _lock:
+            return [value for (value, size, tick) in self._data.values()]
+
+    def clear(self):
+        with _lock:
+            self._add_bytes(-self.bytes)
+            self._data.clear()
+
+    def stats(self):
+        return dict(name=self.name, entries=len(self._data), bytes=self.bytes,
+                    max_bytes=self.max_bytes, hits=self.hits, misses=self.misses,
+                    evictions=self.evictions)
+
+    def _remove(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self._add_bytes(-entry[1])
+        return entry
+
+    def _oldest_tick(self):
+        if not self._data:
+            return None
+        return next(self._data.itervalues())[2]
+
+    def _evict_oldest(self):
+        key, (value, size, __) = self._data.popitem(last=False)
+        self._add_bytes(-size)
+        self.evictions += 1
+        if self.on_evict is not None:
+            self.on_evict(key, value)
+        return size
+
+
+def _weak(value):
+    try:
+        return weakref.ref(value)
+    except TypeError:
+        # eg numbers, strings or tuples
+        return value
+
+
+def cached(name, max_bytes, max_entries=None):
+    """decorator for caching the results of a function or method in a :py:class:`~.Cache`,
+    the arguments must be hashable. results of generator functions are cached as lists.
+    the cache is available as ``.cache`` attribute of the decorated function.
+
+    positional arguments which support weak references, as the instances of methods, are
+    not kept alive by the cache. entries of garbage collected arguments are removed with the
+    next call of the function."""
+
+    def decorator(function):
+        cache = Cache(name, max_bytes, max_entries)
+        is_generator = inspect.isgeneratorfunction(function)
+        # maps id of weak reference in keys to (reference, reference with callback):
+        watched = {}
+        # weak references in keys whose referents were garbage collected. callbacks might run
+        # while the cache is modified, so we remove the entries later:
+        dead_refs = []
+
+        def watch(ref):
+            def report(__):
+                dead_refs.append(ref)
+            watched[id(ref)] = (ref, weakref.ref(ref(), report))
+
+        def remove_dead_entries():
+            while dead_refs:
+                ref = dead_refs.pop()
+                watched.pop(id(ref), None)
+                for key in cache.keys():
+                    if any(item is ref for item in key):
+                        del cache[key]
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if dead_refs:
+                remove_dead_entries()
+            key = tuple(_weak(arg) for arg in args)
+            if kwargs:
+                key += tuple(sorted(kwargs.items()))
+            try:
+                result = cache[key]
+            except KeyError:
+                result = function(*args, **kwargs)
+                if is_generator:
+                    result = list(result)
+                for item in key:
+                    if isinstance(item, weakref.ref) and id(item) not in watched:
+                        watch(item)
+                cache[key] = result
+            if is_generator:
+                return iter(result)
+            return result
+
+        wrapper.cache = cache
+        return wrapper
+
+    return decorator
@@ -1,12 +1,12 @@
 
 from collections import defaultdict
-import copy
 import hashlib
 import os.path
 import re
 import sys
 import time
 import warnings
+import cPickle
 import weakref
 import zlib
 
@@ -16,13 +16,9 @@ import numpy as np
 from emzed_optimizations.sample import sample_peaks
 
 from .col_types import SpecialColType
-
-OPTIMIZATIONS_INSTALLED = False
-try:
-    import emzed_optimizations
-    OPTIMIZATIONS_INSTALLED = True
-except ImportError:
-    pass
+from .peak_arrays import PeakArrays, segment_searchsorted
+from .peakmap_cache import PeakMapCache, is_peakmap_cache
+from .fingerprint import new_digest, update_with_array
 
 IS_PYOPENMS_2 = pyopenms.__version__.startswith("2.")
 
@@ -31,6 +27,121 @@ def deprecation(message):
     warnings.warn(message, UserWarning, stacklevel=2)
 
 
+def _peaks_of(mspec):
+    """peaks of pyopenms.MSSpectrum as n x 2 matrix"""
+    peaks = mspec.get_peaks()
+    if IS_PYOPENMS_2:
+        # signature changed in pyopenms
+        mzs, iis = peaks
+        peaks = np.vstack((mzs.flatten(), iis.flatten())).T.astype(np.float64)
+    return peaks
+
+
+def _polarity_of(mspec):
+    return {pyopenms.IonSource.Polarity.POLNULL: '0',
+            pyopenms.IonSource.Polarity.POSITIVE: '+',
+            pyopenms.IonSource.Polarity.NEGATIVE: '-'
+            }.get(mspec.getInstrumentSettings().getPolarity())
+
+
+def _precursors_of(mspec):
+    return [(p.getMZ(), p.getIntensity(), p.getCharge()) for p in mspec.getPrecursors()]
+
+
+def _scan_number_of(mspec):
+    native_id = mspec.getNativeID()
+    for pattern in ("scan=(\d+)", "spectrum=(\d+)"):
+        match = re.search(pattern, native_id)
+        if match:
+            match = match.groups()[0]
+            try:
+                return int(match)
+            except ValueError:
+                return "failed to parse %r" % native_id
+    return None
+
+
+class _FilteringConsumer(object):
+
+    """consumer for the transform method of pyopenms file readers. collects the peaks of the
+    spectra passing the given filters, so the full experiment is never held in memory.
+    Parameters with *None* value are not considered."""
+
+    def __init__(self, rtmin=None, rtmax=None, mzmin=None, mzmax=None, imin=None,
+                 mslevelmin=None, mslevelmax=None):
+        self.rtmin = rtmin
+        self.rtmax = rtmax
+        self.mzmin = mzmin
+        self.mzmax = mzmax
+        self.imin = imin
+        self.mslevelmin = mslevelmin
+        self.mslevelmax = mslevelmax
+
+        self.peaks = []
+        self.rts = []
+        self.ms_levels = []
+        self.polarities = []
+        self.precursors = []
+        self.scan_numbers = []
+
+    def setExpectedSize(self, num_spectra, num_chromatograms):
+        pass
+
+    def setExperimentalSettings(self, settings):
+        pass
+
+    def consumeChromatogram(self, chromatogram):
+        pass
+
+    def consumeSpectrum(self, mspec):
+        # check cheap filters first, so we do not convert peaks of spectra we skip:
+        rt = mspec.getRT()
+        if self.rtmin is not None and rt < self.rtmin:
+            return
+        if self.rtmax is not None and rt > self.rtmax:
+            return
+        ms_level = mspec.getMSLevel()
+        if self.mslevelmin is not None and ms_level < self.mslevelmin:
+            return
+        if self.mslevelmax is not None and ms_level > self.mslevelmax:
+            return
+
+        peaks = _peaks_of(mspec)
+        mzs = peaks[:, 0]
+        iis = peaks[:, 1]
+        flags = iis > 0
+        if self.imin is not None:
+            flags &= iis >= self.imin
+        if self.mzmin is not None:
+            flags &= mzs >= self.mzmin
+        if self.mzmax is not None:
+            flags &= mzs <= self.mzmax
+        peaks = peaks[flags]
+        if not len(peaks):
+            return
+        # same conventions as Spectrum, but most files are sorted already:
+        if np.any(np.diff(peaks[:, 0]) < 0):
+            peaks = peaks[np.argsort(peaks[:, 0])]
+
+        self.peaks.append(peaks)
+        self.rts.append(rt)
+        self.ms_levels.append(ms_level)
+        self.polarities.append(_polarity_of(mspec))
+        self.precursors.append(_precursors_of(mspec))
+        self.scan_numbers.append(_scan_number_of(mspec))
+
+    def peakArrays(self):
+        """returns the collected spectra as normalized PeakArrays"""
+        offsets = np.zeros((len(self.peaks) + 1,), dtype=np.int64)
+        offsets[1:] = np.cumsum([len(p) for p in self.peaks])
+        peaks = np.vstack(self.peaks) if self.peaks else np.zeros((0, 2), dtype=np.float64)
+        arrays = PeakArrays(peaks, offsets, self.rts, self.ms_levels, self.polarities,
+                            self.precursors, self.scan_numbers)
+        if np.any(np.diff(arrays.rts) < 0):
+            arrays = arrays.take(np.argsort(arrays.rts, kind="mergesort"))
+        return arrays
+
+
 class NDArrayProxy(np.ndarray):
 
     """works like a regular array but calls a call back function (if provided) in case of
@@ -82,6 +193,10 @@ class Spectrum(SpecialColType):
     MS Spectrum Type
     """
 
+    _fingerprint = None
+    # weak references to the peakmaps holding this spectrum:
+    _owners = ()
+
     def __init__(self, peaks, rt, msLevel, polarity, precursors=None, meta=None, scan_number=None):
         """Initialize instance
 
@@ -137,11 +252,37 @@ class Spectrum(SpecialColType):
         self.meta = meta
         self._parent = None
 
+    @classmethod
+    def _from_view(clz, peaks, rt, msLevel, polarity, precursors, scan_number, meta):
+        """creates spectrum without checking and copying peaks, which already must be sorted
+        by m/z and must not contain zero intensities."""
+        spec = clz.__new__(clz)
+        spec._setup_peaks(peaks)
+        spec._rt = rt
+        spec._msLevel = msLevel
+        spec._polarity = polarity
+        spec._precursors = precursors
+        spec._scan_number = scan_number
+        spec.meta = meta
+        spec._parent = None
+        return spec
+
     def _setup_peaks(self, peaks):
-        self.peaks = NDArrayProxy(peaks)
-        self.peaks.patch_modification_callback(self._invalidate_unique_id)
+        self._peaks = NDArrayProxy(peaks)
+        self._peaks.patch_modification_callback(self._invalidate_unique_id)
+
+    @property
+    def peaks(self):
+        return self._peaks
+
+    @peaks.setter
+    def peaks(self, peaks):
+        self._notify_owners()
+        self._setup_peaks(peaks)
 
     def _invalidate_unique_id(self):
+        self._fingerprint = None
+        self._notify_owners()
         if "unique_id" in self.meta:
             del self.meta["unique_id"]
             if self._parent is not None:
@@ -149,8 +290,21 @@ class Spectrum(SpecialColType):
                 if parent is not None and "unique_id" in parent.meta:
                     del parent.meta["unique_id"]
 
+    def _notify_owners(self):
+        # peakmaps use their modification count to detect if their PeakArrays are out of
+        # date:
+        for ref in self._owners:
+            owner = ref()
+            if owner is not None:
+                owner._modifications += 1
+
     def register_parent(self, parent):
         self._parent = weakref.ref(parent)
+        # a spectrum might be shared by several peakmaps, eg PeakMap(pm.spectra), all of
+        # them must see modifications:
+        owners = [ref for ref in self._owners if ref() is not None and ref() is not parent]
+        owners.append(self._parent)
+        self._owners = owners
 
     def _create_prop(name):
         lname = "_" + name
@@ -159,12 +313,7 @@ class Spectrum(SpecialColType):
             return getattr(self, lname)
 
         def setter(self, value):
-            if "unique_id" in self.meta:
-                del self.meta["unique_id"]
-                if self._parent is not None:
-                    parent = self._parent()
-                    if parent is not None and "unique_id" in parent.meta:
-                        del parent.meta["unique_id"]
+            self._invalidate_unique_id()
             setattr(self, lname, value)
         return property(getter, setter)
 
@@ -202,37 +351,24 @@ class Spectrum(SpecialColType):
             self.meta["unique_id"] = h.hexdigest()
         return self.meta["unique_id"]
 
+    def fingerprint(self):
+        """returns digest of the content of the spectrum. this is faster to compute than
+        :py:meth:`~.uniqueId` but might change for future emzed versions, so do not store it.
+        """
+        if self._fingerprint is None:
+            h = new_digest()
+            update_with_array(h, self.peaks)
+            h.update(cPickle.dumps((self.rt, self.msLevel, self.polarity, self.scan_number,
+                                    self.precursors), protocol=2))
+            self._fingerprint = h.hexdigest()
+        return self._fingerprint
+
     @classmethod
     def fromMSSpectrum(clz, mspec):
         """creates Spectrum from pyopenms.MSSpectrum"""
         assert type(mspec) == pyopenms.MSSpectrum, type(mspec)
-        pcs = [(p.getMZ(), p.getIntensity(), p.getCharge()) for p in mspec.getPrecursors()]
-        pol = {pyopenms.IonSource.Polarity.POLNULL: '0',
-               pyopenms.IonSource.Polarity.POSITIVE: '+',
-               pyopenms.IonSource.Polarity.NEGATIVE: '-'
-               }.get(mspec.getInstrumentSettings().getPolarity())
-        peaks = mspec.get_peaks()
-
-        native_id = mspec.getNativeID()
-
-        for pattern in ("scan=(\d+)", "spectrum=(\d+)"):
-            match = re.search(pattern, native_id)
-            if match:
-                match = match.groups()[0]
-                try:
-                    scan_number = int(match)
-                except ValueError:
-                    scan_number = "failed to parse %r" % native_id
-                break
-        else:
-            scan_number = None
-
-        if IS_PYOPENMS_2:
-            # signature changed in pyopenms
-            mzs, iis = peaks
-            peaks = np.vstack((mzs.flatten(), iis.flatten())).T.astype(np.float64)
-        res = clz(peaks, mspec.getRT(), mspec.getMSLevel(), pol, pcs, scan_number=scan_number)
-        return res
+        return clz(_peaks_of(mspec), mspec.getRT(), mspec.getMSLevel(), _polarity_of(mspec),
+                   _precursors_of(mspec), scan_number=_scan_number_of(mspec))
 
     def __str__(self):
         """Return description of object as a string"""
@@ -467,8 +603,9 @@ class Spectrum(SpecialColType):
     def __setstate__(self, state):
         if isinstance(state, dict):
             state = self._fix_for_unpickling_older_files(state)
+            peaks = state.pop("peaks")
             self.__dict__.update(state)
-            self._setup_peaks(self.peaks)
+            self._setup_peaks(peaks)
             if "_parent" not in self.__dict__:
                 self._parent = None
             if "scan_number" not in self.__dict__:
@@ -497,8 +634,19 @@ class PeakMap(SpecialColType):
 
         A PeakMap is a list of :py:class:`~.Spectrum` objects attached with
         meta data about its source.
+
+        Internally the peaks of all spectra can be held in contiguous arrays, see
+        :py:meth:`~.peakArrays`. Peakmaps loaded from files only keep these arrays and create
+        the :py:class:`~.Spectrum` objects on demand as views to the arrays.
     """
 
+    _peak_arrays = None
+    # counts modifications of the spectra, see Spectrum._notify_owners:
+    _modifications = 0
+    _arrays_modification_count = -1
+    # tuple (fingerprint, value of _modifications when it was computed):
+    _fingerprint = None
+
     def __init__(self, spectra, meta=None):
         """
             spectra : iterable (list, tuple, ...)  of objects of type
@@ -515,8 +663,10 @@ class PeakMap(SpecialColType):
         # accepting the unique id from another peakmap is dangerous, eg if we uwe
         # the extract method, so we delete the cached value:
         self.meta.pop("unique_id", None)
+        self._set_polarity(spec.polarity for spec in self.spectra)
 
-        polarities = set(spec.polarity for spec in self.spectra)
+    def _set_polarity(self, polarities):
+        polarities = set(polarities)
         if len(polarities) > 1:
             self.polarity = list(polarities)
         elif len(polarities) == 1:
@@ -524,9 +674,28 @@ class PeakMap(SpecialColType):
         else:
             self.polarity = None
 
+    @classmethod
+    def fromPeakArrays(clz, arrays, meta=None):
+        """creates peakmap from :py:class:`~emzed.core.data_types.peak_arrays.PeakArrays`.
+        peaks with zero intensity and empty spectra are removed, spectra are sorted by
+        retention time."""
+        return clz._fromNormalizedArrays(arrays.normalized(), meta)
+
+    @classmethod
+    def _fromNormalizedArrays(clz, arrays, meta=None):
+        pm = clz([], meta)
+        arrays = arrays.sorted_by_rt()
+        pm._spectra = None
+        pm._peak_arrays = arrays
+        pm._set_polarity(arrays.polarities.tolist())
+        return pm
+
     @property
     def spectra(self):
-        return self._spectra
+        spectra = self._spectra
+        if spectra is None:
+            spectra = self._create_spectra_from_arrays()
+        return spectra
 
     @spectra.setter
     def spectra(self, spectra):
@@ -534,15 +703,68 @@ class PeakMap(SpecialColType):
         """
         spectra = (s for s in spectra if len(s))
         self._spectra = tuple(sorted(spectra, key=lambda spec: spec.rt))
+        self._peak_arrays = None
+        self._fingerprint = None
         for s in self._spectra:
             s.register_parent(self)
 
+    def _create_spectra_from_arrays(self):
+        arrays = self._peak_arrays
+        spectra = []
+        for i, (rt, ms_level, polarity) in enumerate(zip(arrays.rts.tolist(),
+                                                         arrays.ms_levels.tolist(),
+                                                         arrays.polarities.tolist())):
+            meta = arrays.metas[i]
+            spec = Spectrum._from_view(arrays.spectrum_peaks(i), rt, ms_level, polarity,
+                                       list(arrays.precursors[i]), arrays.scan_numbers[i],
+                                       dict(meta) if meta is not None else dict())
+            spec.register_parent(self)
+            spectra.append(spec)
+        self._spectra = tuple(spectra)
+        self._arrays_modification_count = self._modifications
+        return self._spectra
+
+    def peakArrays(self):
+        """returns the peaks of all spectra as contiguous arrays, see
+        :py:class:`~emzed.core.data_types.peak_arrays.PeakArrays`. The arrays are created on
+        demand and reused as long as the spectra are not modified, afterwards the spectra hold
+        views to these arrays.
+        """
+        spectra = self._spectra
+        if spectra is None:
+            return self._peak_arrays
+        arrays = self._peak_arrays
+        if arrays is None or self._arrays_modification_count != self._modifications:
+            arrays = PeakArrays.from_spectra(spectra)
+            # the spectra share the memory of the arrays now:
+            for i, spec in enumerate(spectra):
+                spec._setup_peaks(arrays.spectrum_peaks(i))
+            self._peak_arrays = arrays
+            self._arrays_modification_count = self._modifications
+        return arrays
+
+    def _compact(self):
+        """keeps the peaks as arrays only, spectra are created again on demand"""
+        self.peakArrays()
+        self._spectra = None
+
     @staticmethod
     def _fix_for_unpickling_older_files(state):
         if "spectra" in state:
             state["_spectra"] = tuple(state.pop("spectra"))
         return state
 
+    def __getstate__(self):
+        # we pickle the spectra as before, so that older emzed versions can read pickled
+        # peakmaps:
+        state = self.__dict__.copy()
+        state["_spectra"] = self.spectra
+        state.pop("_peak_arrays", None)
+        state.pop("_modifications", None)
+        state.pop("_arrays_modification_count", None)
+        state.pop("_fingerprint", None)
+        return state
+
     def __setstate__(self, state):
         state = self._fix_for_unpickling_older_files(state)
         self.__dict__.update(state)
@@ -557,7 +779,12 @@ class PeakMap(SpecialColType):
         return self.spectra[idx]
 
     def all_peaks(self, msLevel=1):
-        return np.vstack((s.peaks for s in self.spectra if s.msLevel == msLevel))
+        arrays = self.peakArrays()
+        indices = arrays.select(msLevel)
+        if not len(indices):
+            # same exception as np.vstack raised for empty input:
+            raise ValueError("need at least one array to concatenate")
+        return arrays.peaks[arrays.peak_indices(indices)]
 
     def filterIntensity(self, msLevel=None, minInt=None, maxInt=None):
         """creates new peakmap matching the given conditions. Using a single requirement
@@ -565,20 +792,16 @@ class PeakMap(SpecialColType):
 
             pm.filterIntensity(
         """
-        spectra = []
-        for spec in self.spectra:
-            if msLevel is not None and spec.msLevel != msLevel:
-                continue
-            peaks = spec.peaks
-            if minInt is not None:
-                peaks = peaks[peaks[:, 1] >= minInt]
-            if maxInt is not None:
-                peaks = peaks[peaks[:, 1] <= maxInt]
-            spec = copy.deepcopy(spec)
-            spec.peaks = peaks
-            spectra.append(spec)
-
-        return PeakMap(spectra, self.meta.copy())
+        arrays = self.peakArrays()
+        arrays = arrays.take(arrays.select(msLevel))
+        flags = np.ones((len(arrays.peaks),), dtype=bool)
+        if minInt is not None:
+            flags &= arrays.intensities >= minInt
+        if maxInt is not None:
+            flags &= arrays.intensities <= maxInt
+        if not flags.all():
+            arrays = arrays.filter_peaks(flags)
+        return PeakMap._fromNormalizedArrays(arrays, self.meta.copy())
 
     def extract(self, rtmin=None, rtmax=None, mzmin=None, mzmax=None, imin=None, imax=None,
                 mslevelmin=None, mslevelmax=None):
@@ -596,31 +819,27 @@ class PeakMap(SpecialColType):
         \
         """
 
-        spectra = copy.deepcopy(self.spectra)
+        # we first select the spectra and then only copy the remaining peaks:
+        arrays = self.peakArrays()
+        indices = _extract_indices(arrays, rtmin, rtmax, mslevelmin, mslevelmax)
 
-        if mslevelmin is not None:
-            spectra = (s for s in spectra if s.msLevel >= mslevelmin)
-        if mslevelmax is not None:
-            spectra = (s for s in spectra if s.msLevel <= mslevelmax)
-
-        if rtmin:
-            spectra = (s for s in spectra if rtmin <= s.rt)
-        if rtmax:
-            spectra = (s for s in spectra if rtmax >= s.rt)
-
-        spectra = list(spectra)
-        if mzmin is not None or mzmax is not None:
-            for s in spectra:
-                s.peaks = s.peaksInRange(mzmin, mzmax)
+        starts = arrays.offsets[indices]
+        ends = arrays.offsets[indices + 1]
+        if mzmin is not None:
+            starts = segment_searchsorted(arrays.mzs, starts, ends, mzmin, "left")
+        if mzmax is not None:
+            ends = segment_searchsorted(arrays.mzs, starts, ends, mzmax, "right")
+        arrays = arrays.take(indices, starts, ends)
 
         if imin is not None or imax is not None:
-            for s in spectra:
-                if imin is not None:
-                    s.peaks = s.peaks[s.peaks[:, 1] >= imin]
-                if imax is not None:
-                    s.peaks = s.peaks[s.peaks[:, 1] <= imax]
+            flags = np.ones((len(arrays.peaks),), dtype=bool)
+            if imin is not None:
+                flags &= arrays.intensities >= imin
+            if imax is not None:
+                flags &= arrays.intensities <= imax
+            arrays = arrays.filter_peaks(flags)
 
-        return PeakMap(spectra, self.meta.copy())
+        return PeakMap._fromNormalizedArrays(arrays, self.meta.copy())
 
     def representingMzPeak(self, mzmin, mzmax, rtmin, rtmax):
         """returns a weighted mean m/z value in given range.
@@ -643,23 +862,24 @@ class PeakMap(SpecialColType):
         if levels == [1]:
             return self
         ms_level = min(levels)
-        spectra = [copy.deepcopy(s) for s in self.spectra if s.msLevel == ms_level]
-        for spec in spectra:
-            spec.msLevel = 1
-        return PeakMap(spectra, meta=self.meta.copy())
+        arrays = self.peakArrays()
+        arrays = arrays.take(arrays.select(ms_level)).with_ms_level(1)
+        return PeakMap._fromNormalizedArrays(arrays, meta=self.meta.copy())
 
     def filter(self, condition):
         """ builds new peakmap where ``condition(s)`` is ``True`` for
             spectra ``s``
         """
-        spectra = copy.deepcopy(self.spectra)
-        return PeakMap((s for s in spectra if condition(s)), self.meta.copy())
+        indices = [i for (i, s) in enumerate(self.spectra) if condition(s)]
+        arrays = self.peakArrays().take(indices)
+        return PeakMap._fromNormalizedArrays(arrays, self.meta.copy())
 
     def specsInRange(self, rtmin, rtmax):
         """
         returns list of spectra with rt values in range ``rtmin...rtmax``
         """
-        return [spec for spec in self.spectra if rtmin <= spec.rt <= rtmax]
+        spectra = self.spectra
+        return [spectra[i] for i in self.peakArrays().select(None, rtmin, rtmax)]
 
     def levelNSpecsInRange(self, n, rtmin, rtmax):
         """
@@ -668,9 +888,11 @@ class PeakMap(SpecialColType):
         # rt values can be truncated/rounded from gui or other sources,
         # so wie dither the limits a bit, spaces in realistic rt values
         # are much higher thae 1e-2 seconds
-        return [spec for spec in self.spectra if rtmin - 1e-2 <= spec.rt
-                <= rtmax + 1e-2
-                and spec.msLevel == n]
+        spectra = self.spectra
+        return [spectra[i] for i in self._levelNIndicesInRange(n, rtmin, rtmax)]
+
+    def _levelNIndicesInRange(self, n, rtmin, rtmax):
+        return self.peakArrays().select(n, rtmin - 1e-2, rtmax + 1e-2)
 
     def remove(self, mzmin, mzmax, rtmin=None, rtmax=None, msLevel=None):
         if not self.spectra:
@@ -703,61 +925,75 @@ class PeakMap(SpecialColType):
         list of same length containing the summed up peaks for each
         rt value.
         """
-        if not self.spectra:
+        if not len(self):
             return [], []
+        arrays = self.peakArrays()
         if rtmin is None:
-            rtmin = self.spectra[0].rt
+            rtmin = arrays.rts[0]
         if rtmax is None:
-            rtmax = self.spectra[-1].rt
+            rtmax = arrays.rts[-1]
 
         if msLevel is None:
             msLevel = min(self.getMsLevels())
 
-        if OPTIMIZATIONS_INSTALLED:
-            rts, iis = emzed_optimizations.chromatogram(self, mzmin, mzmax, rtmin, rtmax, msLevel)
-            # fix bug in old version of emzed_optimizations:
-            # fails if rtmin and rtmax are beyond max rt in peakmap !
-            f = (rts >= rtmin) * (rts <= rtmax)
-            return rts[f], iis[f]
+        return arrays.chromatogram(mzmin, mzmax, rtmin, rtmax, msLevel)
 
-        specs = self.levelNSpecsInRange(msLevel, rtmin, rtmax)
+    def chromatograms(self, windows, msLevel=None):
+        """
+        extracts chromatograms for many windows at once. ``windows`` is a n x 4 array (or a
+        list of tuples) with rows ``(mzmin, mzmax, rtmin, rtmax)``, rt limits may be None.
+        returns a list of tuples ``(rts, intensities)``, one for every window, which are the
+        same as :py:meth:`~.chromatogram` returns.
 
-        rts = [s.rt for s in specs]
-        intensities = [s.intensityInRange(mzmin, mzmax) for s in specs]
-        return rts, intensities
+        this is much faster than calling :py:meth:`~.chromatogram` for every window.
+        """
+        if not len(self):
+            return [([], []) for __ in windows]
+        arrays = self.peakArrays()
+        windows = np.array(windows, dtype=np.float64).reshape(-1, 4)
+        rtmins = windows[:, 2]
+        rtmaxs = windows[:, 3]
+        rtmins[np.isnan(rtmins)] = arrays.rts[0]
+        rtmaxs[np.isnan(rtmaxs)] = arrays.rts[-1]
+
+        if msLevel is None:
+            msLevel = min(self.getMsLevels())
+
+        return arrays.chromatograms(windows, msLevel)
 
     def getMsLevels(self):
         """returns list of ms levels in current peak map"""
-        return sorted(set(spec.msLevel for spec in self.spectra))
+        return np.unique(self.peakArrays().ms_levels).tolist()
 
     def msNPeaks(self, n, rtmin=None, rtmax=None):
         """return ms level n peaks in given range"""
+        arrays = self.peakArrays()
         if rtmin is None:
-            rtmin = self.spectra[0].rt
+            rtmin = arrays.rts[0]
         if rtmax is None:
-            rtmax = self.spectra[-1].rt
-        specs = self.levelNSpecsInRange(n, rtmin, rtmax)
-        # following vstack does not like empty sequence, so:
-        if len(specs):
-            peaks = np.vstack([s.peaks for s in specs])
-            perm = np.argsort(peaks[:, 0])
-            return peaks[perm, :]
-        return np.zeros((0, 2), dtype=np.float64)
+            rtmax = arrays.rts[-1]
+        indices = self._levelNIndicesInRange(n, rtmin, rtmax)
+        peaks = arrays.peaks[arrays.peak_indices(indices)]
+        perm = np.argsort(peaks[:, 0])
+        return peaks[perm, :]
 
     def allRts(self):
         """returns all rt values in peakmap"""
-        return [spec.rt for spec in self.spectra]
+        return self.peakArrays().rts.tolist()
 
     def levelOneRts(self):
         """returns rt values of all level one spectra in peakmap"""
-        return [spec.rt for spec in self.spectra if spec.msLevel == 1]
+        return self.get_rts(1)
 
     def levelNSpecs(self, minN, maxN=None):
         """returns list of spectra in given msLevel range"""
 
         if maxN is None:
             maxN = minN
-        return [spec for spec in self.spectra if minN <= spec.msLevel <= maxN]
+        spectra = self.spectra
+        ms_levels = self.peakArrays().ms_levels
+        indices = np.where((minN <= ms_levels) & (ms_levels <= maxN))[0]
+        return [spectra[i] for i in indices]
 
     def shiftRt(self, delta):
         """shifts all rt values by delta"""
@@ -785,29 +1021,25 @@ class PeakMap(SpecialColType):
         msLevel = self._try_to_fix_for_unique_ms_level(msLevel)
 
         # msLevel None: autodetect dominant msLevel
-        if msLevel is not None:
-            mzranges = [s.mzRange() for s in self.spectra if s.msLevel == msLevel]
-        else:
-            mzranges = [s.mzRange() for s in self.spectra]
-
-        mzranges = [r for r in mzranges if r[0] is not None and r[1] is not None]
-        if not mzranges:
+        arrays = self.peakArrays()
+        indices = arrays.select(msLevel)
+        # spectra might be emptied after creating the peakmap:
+        indices = indices[arrays.offsets[indices + 1] > arrays.offsets[indices]]
+        if not len(indices):
             return None, None
 
-        mzmins, mzmaxs = zip(*mzranges)
-        return float(min(mzmins)), float(max(mzmaxs))
+        mzmins, mzmaxs = arrays.mz_ranges(indices)
+        return float(mzmins.min()), float(mzmaxs.max())
 
     def rtRange(self, msLevel=1):
         """ returns rt-range *(rtmin, tax)* of current peakmap """
         msLevel = self._try_to_fix_for_unique_ms_level(msLevel)
 
-        if msLevel is not None:
-            rts = [s.rt for s in self.spectra if s.msLevel == msLevel]
-        else:
-            rts = [s.rt for s in self.spectra]
-        if not rts:
+        arrays = self.peakArrays()
+        rts = arrays.rts[arrays.select(msLevel)]
+        if not len(rts):
             return None, None
-        return min(rts), max(rts)
+        return float(rts.min()), float(rts.max())
 
     @classmethod
     def fromMSExperiment(clz, mse):
@@ -817,7 +1049,9 @@ class PeakMap(SpecialColType):
         meta = dict()
         meta["full_source"] = mse.getLoadedFilePath()
         meta["source"] = os.path.basename(meta.get("full_source"))
-        return clz(specs, meta)
+        pm = clz(specs, meta)
+        pm._compact()
+        return pm
 
     def uniqueId(self):
         if "unique_id" not in self.meta:
@@ -827,9 +1061,30 @@ class PeakMap(SpecialColType):
             self.meta["unique_id"] = h.hexdigest()
         return self.meta["unique_id"]
 
+    def fingerprint(self):
+        """returns digest of the content of the peakmap, computed in one pass over
+        :py:meth:`~.peakArrays`. this is much faster than :py:meth:`~.uniqueId` but might change
+        for future emzed versions, so do not store it.
+        """
+        if self._fingerprint is not None:
+            fingerprint, modifications = self._fingerprint
+            # as for the peak arrays modified spectra invalidate the fingerprint:
+            if modifications == self._modifications:
+                return fingerprint
+        arrays = self.peakArrays()
+        h = new_digest()
+        for name in PeakArrays._array_names:
+            update_with_array(h, getattr(arrays, name))
+        h.update(cPickle.dumps((arrays.precursors, arrays.scan_numbers), protocol=2))
+        self._fingerprint = (h.hexdigest(), self._modifications)
+        return self._fingerprint[0]
+
     def __len__(self):
         """returns number of all spectra (all ms levels) in peakmap"""
-        return len(self.spectra)
+        spectra = self._spectra
+        if spectra is None:
+            return len(self._peak_arrays)
+        return len(spectra)
 
     def __str__(self):
         """Returns description of  PeakMap object as a string."""
@@ -856,23 +1111,30 @@ class PeakMap(SpecialColType):
     def splitLevelN(self, msLevel, significant_digits_precursor=2):
         """splits peakmap to list of tuples. the first entry of a tuple is the precursor mass, the
         second one the corresponding peak map of spectra of level *msLevel*"""
-        msn_spectra = defaultdict(list)
-        for spectrum in self.spectra:
-            if spectrum.msLevel == msLevel:
-                spectrum = copy.deepcopy(spectrum)
-                key = spectrum.precursors[0][0]
-                if significant_digits_precursor is not None:
-                    key = round(key, significant_digits_precursor)
-                msn_spectra[key].append(spectrum)
+        arrays = self.peakArrays()
+        msn_indices = defaultdict(list)
+        for i in arrays.select(msLevel):
+            key = arrays.precursors[i][0][0]
+            if significant_digits_precursor is not None:
+                key = round(key, significant_digits_precursor)
+            msn_indices[key].append(i)
 
         m = self.meta.copy()
         if "unique_id" in m:
             del m["unique_id"]
 
-        return sorted([(k, PeakMap(v, meta=m.copy())) for (k, v) in msn_spectra.items()])
+        return sorted([(k, PeakMap._fromNormalizedArrays(arrays.take(v), meta=m.copy()))
+                       for (k, v) in msn_indices.items()])
 
     @staticmethod
-    def load(path):
+    def load(path, rtmin=None, rtmax=None, mzmin=None, mzmax=None, imin=None,
+             mslevelmin=None, mslevelmax=None):
+        """loads mzML, mzXML or mzData file. only spectra and peaks within the given limits
+        are kept, parameters with *None* value are not considered.
+
+        mzML and mzXML files are streamed and the filters are applied during parsing, so
+        memory consumption only depends on the size of the result.
+        """
         # open-ms returns empty peakmap if file not exists, so we
         # check ourselves:
         if not os.path.exists(path):
@@ -880,12 +1142,54 @@ class PeakMap(SpecialColType):
         if not os.path.isfile(path):
             raise Exception("path %s is not a file" % path)
 
-        experiment = pyopenms.MSExperiment()
-        fh = pyopenms.FileHandler()
         if sys.platform == "win32":
             path = path.replace("/", "\\")  # needed for network shares
+
+        filters = dict(rtmin=rtmin, rtmax=rtmax, mzmin=mzmin, mzmax=mzmax, imin=imin,
+                       mslevelmin=mslevelmin, mslevelmax=mslevelmax)
+
+        reader_class = {".MZML": "MzMLFile",
+                        ".MZXML": "MzXMLFile"}.get(os.path.splitext(path)[1].upper())
+        reader = getattr(pyopenms, reader_class, None) if reader_class is not None else None
+        if reader is not None and hasattr(reader, "transform"):
+            consumer = _FilteringConsumer(**filters)
+            reader().transform(path, consumer)
+            meta = dict(full_source=os.path.abspath(path), source=os.path.basename(path))
+            return PeakMap._fromNormalizedArrays(consumer.peakArrays(), meta)
+
+        # mzData or older pyopenms versions:
+        experiment = pyopenms.MSExperiment()
+        fh = pyopenms.FileHandler()
         fh.loadExperiment(path, experiment)
-        return PeakMap.fromMSExperiment(experiment)
+        pm = PeakMap.fromMSExperiment(experiment)
+        if any(value is not None for value in filters.values()):
+            pm = pm._filtered(**filters)
+        return pm
+
+    def _filtered(self, rtmin=None, rtmax=None, mzmin=None, mzmax=None, imin=None,
+                  mslevelmin=None, mslevelmax=None):
+        """peakmap restricted to the limits of :py:meth:`~.load`"""
+        arrays = self.peakArrays()
+        indices = _extract_indices(arrays, rtmin, rtmax, mslevelmin, mslevelmax)
+        arrays = arrays.take(indices)
+        peaks = arrays.peaks
+        flags = np.ones((len(peaks),), dtype=bool)
+        if imin is not None:
+            flags &= peaks[:, 1] >= imin
+        if mzmin is not None:
+            flags &= peaks[:, 0] >= mzmin
+        if mzmax is not None:
+            flags &= peaks[:, 0] <= mzmax
+        spectrum_index = np.repeat(np.arange(len(arrays)), np.diff(arrays.offsets))
+        sizes = np.bincount(spectrum_index[flags], minlength=len(arrays))
+        offsets = np.zeros((len(arrays) + 1,), dtype=np.int64)
+        offsets[1:] = np.cumsum(sizes)
+        arrays = PeakArrays(peaks[flags], offsets, arrays.rts, arrays.ms_levels,
+                            arrays.polarities, arrays.precursors, arrays.scan_numbers,
+                            arrays.metas)
+        meta = self.meta.copy()
+        meta.pop("unique_id", None)
+        return PeakMap._fromNormalizedArrays(arrays.take(np.where(sizes > 0)[0]), meta)
 
     def store(self, path):
         if sys.platform == "win32":
@@ -971,11 +1275,34 @@ class PeakMap(SpecialColType):
         return peaks
 
     def get_rts(self, msLevel=1):
-        return [s.rt for s in self.spectra if s.msLevel == msLevel]
+        arrays = self.peakArrays()
+        return arrays.rts[arrays.select(msLevel)].tolist()
+
+
+def _extract_indices(arrays, rtmin, rtmax, mslevelmin, mslevelmax):
+    """indices of the spectra PeakMap.extract keeps, ``arrays`` is a PeakArrays or
+    PeakMapCache object"""
+    flags = np.ones((len(arrays),), dtype=bool)
+    if mslevelmin is not None:
+        flags &= arrays.ms_levels >= mslevelmin
+    if mslevelmax is not None:
+        flags &= arrays.ms_levels <= mslevelmax
+    if rtmin:
+        flags &= arrays.rts >= rtmin
+    if rtmax:
+        flags &= arrays.rts <= rtmax
+    return np.where(flags)[0]
 
 
 class PeakMapProxy(PeakMap):
 
+    """peakmap which is loaded from ``path`` on first access of the spectra.
+
+    if ``path`` is a cache file as written by :py:meth:`Table.store` with a
+    ``peakmap_cache_folder``, :py:meth:`~.chromatogram`, :py:meth:`~.extract` and
+    :py:meth:`~.specsInRange` only read the needed spectra without loading the full peakmap.
+    """
+
     def __init__(self, path, meta=None):
         self._path = path
         self._loaded = False
@@ -986,11 +1313,24 @@ class PeakMapProxy(PeakMap):
             return self.meta["unique_id"]
         return super(PeakMapProxy, self).uniqueId()
 
+    def fingerprint(self):
+        if not self._loaded and "unique_id" in self.meta:
+            # avoids loading the peakmap:
+            h = new_digest()
+            h.update("PeakMapProxy %s" % self.meta["unique_id"])
+            return h.hexdigest()
+        return super(PeakMapProxy, self).fingerprint()
+
     def __getattr__(self, name):
         if name == "_spectra" and not self._loaded:
             ext = os.path.splitext(self._path)[1].upper()
             if ext in (".MZML", ".MZXML", ".MZDATA"):
                 pm = PeakMap.load(self._path)
+            elif self._cache() is not None:
+                cache = self._cache()
+                pm = PeakMap._fromNormalizedArrays(cache.read_all())
+                # the constructor removes the unique id from meta, but the peaks are the same:
+                pm.meta = cache.meta.copy()
             else:
                 pm = PeakMap.load_as_pickle(self._path)
             self.__dict__.update(vars(pm))
@@ -1011,10 +1351,79 @@ class PeakMapProxy(PeakMap):
     def __str__(self):
         return "<PeakMapProxy %#x to %r>" % (id(self), os.path.basename(self._path))
 
+    def _cache(self):
+        """returns PeakMapCache for cache files, else None. use of 'hasattr' would trigger
+        'getattr', so we look into __dict__"""
+        if "_peakmap_cache" not in self.__dict__:
+            path = self._path
+            if sys.platform == "win32":
+                path = path.replace("/", "\\")  # needed for network shares
+            ext = os.path.splitext(path)[1].upper()
+            if ext not in (".MZML", ".MZXML", ".MZDATA") and is_peakmap_cache(path):
+                self._peakmap_cache = PeakMapCache(path)
+            else:
+                self._peakmap_cache = None
+        return self._peakmap_cache
+
+    def _partial_cache(self):
+        """returns PeakMapCache if we can read parts of the peakmap"""
+        if self._loaded:
+            # spectra might have been modified after loading:
+            return None
+        return self._cache()
+
+    def _partial_peakmap(self, cache, indices):
+        return PeakMap._fromNormalizedArrays(cache.read(indices), self.meta.copy())
+
+    def chromatogram(self, mzmin, mzmax, rtmin=None, rtmax=None, msLevel=None):
+        cache = self._partial_cache()
+        if cache is None:
+            return super(PeakMapProxy, self).chromatogram(mzmin, mzmax, rtmin, rtmax, msLevel)
+        if not len(cache):
+            return [], []
+        if rtmin is None:
+            rtmin = cache.rts[0]
+        if rtmax is None:
+            rtmax = cache.rts[-1]
+        if msLevel is None:
+            msLevel = cache.ms_levels.min()
+        indices = cache.select(msLevel, rtmin, rtmax)
+        if not len(indices):
+            return cache.rts[indices], np.zeros((0,), dtype=np.float64)
+        pm = self._partial_peakmap(cache, indices)
+        return pm.chromatogram(mzmin, mzmax, rtmin, rtmax, msLevel)
+
+    chromatogram.__doc__ = PeakMap.chromatogram.__doc__
+
+    def extract(self, rtmin=None, rtmax=None, mzmin=None, mzmax=None, imin=None, imax=None,
+                mslevelmin=None, mslevelmax=None):
+        cache = self._partial_cache()
+        if cache is None:
+            return super(PeakMapProxy, self).extract(rtmin, rtmax, mzmin, mzmax, imin, imax,
+                                                     mslevelmin, mslevelmax)
+        indices = _extract_indices(cache, rtmin, rtmax, mslevelmin, mslevelmax)
+        pm = self._partial_peakmap(cache, indices)
+        return pm.extract(rtmin, rtmax, mzmin, mzmax, imin, imax, mslevelmin, mslevelmax)
+
+    extract.__doc__ = PeakMap.extract.__doc__
+
+    def specsInRange(self, rtmin, rtmax):
+        cache = self._partial_cache()
+        if cache is None:
+            return super(PeakMapProxy, self).specsInRange(rtmin, rtmax)
+        indices = cache.select(None, rtmin, rtmax)
+        return list(self._partial_peakmap(cache, indices).spectra)
+
+    specsInRange.__doc__ = PeakMap.specsInRange.__doc__
+
     def squeeze(self):
+        """releases the loaded peaks, they are loaded again when needed"""
+        # __dict__ also holds all attributes of the loaded peakmap:
+        path, meta = self._path, self.meta
+        self.__dict__.clear()
+        self._path = path
+        self.meta = meta
         self._loaded = False
-        if "_spectra" in self.__dict__:  # use of 'hasattr' would trigger 'getattr' and load data !
-            del self._spectra
 
     def store(self, path):
         """overrides path from PeakMap class because this method would trigger loading the
@@ -0,0 +1,343 @@
+# encoding: utf-8
+from __future__ import print_function, division, absolute_import
+
+import copy
+import cPickle
+import os
+
+import numpy as np
+
+
+def segment_searchsorted(values, starts, ends, x, side="left"):
+    """binary search in many sorted segments ``values[starts[i]:ends[i]]`` at once.
+
+    ``x`` is a scalar or an array with one value per segment. returns the insertion
+    positions as absolute indices into ``values``, like ``np.searchsorted`` per segment plus
+    ``starts[i]`` would do.
+    """
+    lo = np.array(starts, dtype=np.int64)
+    hi = np.array(ends, dtype=np.int64)
+    x = np.zeros(lo.shape) + x
+    if not len(values):
+        return lo
+    last = len(values) - 1
+    while True:
+        active = lo < hi
+        if not active.any():
+            return lo
+        mid = (lo + hi) // 2
+        v = values[np.minimum(mid, last)]
+        if side == "left":
+            go_right = active & (v < x)
+        else:
+            go_right = active & (v <= x)
+        lo = np.where(go_right, mid + 1, lo)
+        hi = np.where(active & ~go_right, mid, hi)
+
+
+def segment_sums(values, starts, ends):
+    """sums of ``values[starts[i]:ends[i]]`` for all i"""
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    sums = np.zeros((len(starts),), dtype=values.dtype)
+    nonempty = starts < ends
+    if not nonempty.any():
+        return sums
+    starts = starts[nonempty]
+    ends = ends[nonempty]
+    # reduceat needs valid indices, so segments reaching the end of values miss the last
+    # value, except they only consist of this value:
+    last = len(values) - 1
+    indices = np.empty((2 * len(starts),), dtype=np.int64)
+    indices[0::2] = starts
+    indices[1::2] = np.minimum(ends, last)
+    partial = np.add.reduceat(values, indices)[0::2]
+    partial[(ends > last) & (starts < last)] += values[last]
+    sums[nonempty] = partial
+    return sums
+
+
+class PeakArrays(object):
+
+    """contiguous storage of the peaks of all spectra of a peakmap.
+
+    ``peaks`` is a n x 2 matrix with m/z values and intensities of all spectra, the peaks of
+    spectrum ``i`` are ``peaks[offsets[i]:offsets[i + 1]]``. ``rts``, ``ms_levels`` and
+    ``polarities`` are arrays with one entry per spectrum, ``precursors``, ``scan_numbers``
+    and ``metas`` are lists with one entry per spectrum.
+
+    this is the same layout as :py:class:`~emzed.core.data_types.hdf5.peakmap_store.PeakMapStore`
+    uses in hdf5 files.
+    """
+
+    def __init__(self, peaks, offsets, rts, ms_levels, polarities, precursors=None,
+                 scan_numbers=None, metas=None):
+        peaks = np.asarray(peaks, dtype=np.float64)
+        if not len(peaks):
+            peaks = np.zeros((0, 2), dtype=np.float64)
+        assert peaks.ndim == 2 and peaks.shape[1] == 2, "peaks needs 2 columns"
+        n = len(rts)
+        assert len(offsets) == n + 1, "need n + 1 offsets for n spectra"
+        assert offsets[-1] == len(peaks), "last offset must be number of peaks"
+        self.peaks = peaks
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.rts = np.asarray(rts, dtype=np.float64)
+        self.ms_levels = np.asarray(ms_levels, dtype=np.int64)
+        self.polarities = np.asarray(polarities, dtype="S1")
+        assert len(self.ms_levels) == n and len(self.polarities) == n
+        self.precursors = list(precursors) if precursors is not None else [[]] * n
+        self.scan_numbers = list(scan_numbers) if scan_numbers is not None else [None] * n
+        self.metas = list(metas) if metas is not None else [None] * n
+
+    @classmethod
+    def from_spectra(clz, spectra):
+        spectra = list(spectra)
+        sizes = [len(s.peaks) for s in spectra]
+        offsets = np.zeros((len(spectra) + 1,), dtype=np.int64)
+        offsets[1:] = np.cumsum(sizes)
+        if spectra:
+            peaks = np.vstack([np.asarray(s.peaks) for s in spectra])
+        else:
+            peaks = np.zeros((0, 2), dtype=np.float64)
+        return clz(peaks, offsets,
+                   [s.rt for s in spectra],
+                   [s.msLevel for s in spectra],
+                   [s.polarity for s in spectra],
+                   [s.precursors for s in spectra],
+                   [s.scan_number for s in spectra],
+                   [s.meta for s in spectra])
+
+    _array_names = ("peaks", "offsets", "rts", "ms_levels", "polarities")
+
+    def save(self, folder):
+        """saves arrays as .npy files in ``folder``, which is created if needed. see
+        :py:meth:`~.load`."""
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        for name in self._array_names:
+            np.save(os.path.join(folder, name + ".npy"), getattr(self, name))
+        with open(os.path.join(folder, "lists.pickle"), "wb") as fp:
+            cPickle.dump((self.precursors, self.scan_numbers, self.metas), fp, protocol=2)
+
+    @classmethod
+    def load(clz, folder, mmap_mode=None):
+        """loads PeakArrays stored with :py:meth:`~.save`. if ``mmap_mode`` is ``"r"`` the
+        arrays are memory mapped read only, so that several processes can share them without
+        copying."""
+        arrays = [np.load(os.path.join(folder, name + ".npy"), mmap_mode=mmap_mode)
+                  for name in clz._array_names]
+        with open(os.path.join(folder, "lists.pickle"), "rb") as fp:
+            precursors, scan_numbers, metas = cPickle.load(fp)
+        return clz(*(arrays + [precursors, scan_numbers, metas]))
+
+    def normalized(self):
+        """returns PeakArrays with the same conventions as :py:class:`~.Spectrum` and
+        :py:class:`~.PeakMap`: peaks with zero intensity are removed, peaks are sorted by m/z,
+        empty spectra are removed and spectra are sorted by retention time."""
+        n = len(self)
+        spectrum_index = np.repeat(np.arange(n), np.diff(self.offsets))
+        keep = self.peaks[:, 1] > 0
+        spectrum_index = spectrum_index[keep]
+        peaks = self.peaks[keep]
+        sizes = np.bincount(spectrum_index, minlength=n)
+        order = np.lexsort((peaks[:, 0], spectrum_index))
+        peaks = peaks[order]
+        offsets = np.zeros((n + 1,), dtype=np.int64)
+        offsets[1:] = np.cumsum(sizes)
+
+        spectra_order = np.argsort(self.rts, kind="mergesort")
+        spectra_order = spectra_order[sizes[spectra_order] > 0]
+        if len(spectra_order) == n and np.all(spectra_order == np.arange(n)):
+            return PeakArrays(peaks, offsets, self.rts, self.ms_levels, self.polarities,
+                              self.precursors, self.scan_numbers, self.metas)
+        starts = offsets[:-1][spectra_order]
+        ends = offsets[1:][spectra_order]
+        sizes = ends - starts
+        new_offsets = np.zeros((len(spectra_order) + 1,), dtype=np.int64)
+        new_offsets[1:] = np.cumsum(sizes)
+        peak_indices = np.repeat(starts - new_offsets[:-1], sizes) + np.arange(new_offsets[-1])
+        return PeakArrays(peaks[peak_indices], new_offsets,
+                          self.rts[spectra_order],
+                          self.ms_levels[spectra_order],
+                          self.polarities[spectra_order],
+                          [self.precursors[i] for i in spectra_order],
+                          [self.scan_numbers[i] for i in spectra_order],
+                          [self.metas[i] for i in spectra_order])
+
+    def __len__(self):
+        return len(self.rts)
+
+    def _subset(self, spectra_indices, peak_indices, sizes):
+        """new PeakArrays with copies of the given peaks, empty spectra are removed"""
+        nonempty = sizes > 0
+        spectra_indices = spectra_indices[nonempty]
+        offsets = np.zeros((len(spectra_indices) + 1,), dtype=np.int64)
+        offsets[1:] = np.cumsum(sizes[nonempty])
+        # peaks might have changed, so we do not copy cached unique ids:
+        metas = []
+        for i in spectra_indices:
+            meta = self.metas[i]
+            if meta is not None:
+                meta = copy.deepcopy(meta)
+                meta.pop("unique_id", None)
+            metas.append(meta)
+        return PeakArrays(self.peaks[peak_indices], offsets,
+                          self.rts[spectra_indices],
+                          self.ms_levels[spectra_indices],
+                          self.polarities[spectra_indices],
+                          [self.precursors[i] for i in spectra_indices],
+                          [self.scan_numbers[i] for i in spectra_indices],
+                          metas)
+
+    def sorted_by_rt(self):
+        """returns self if the spectra are sorted by retention time, else a sorted copy"""
+        rts = self.rts
+        if np.all(rts[:-1] <= rts[1:]):
+            return self
+        return self.take(np.argsort(rts, kind="mergesort"))
+
+    def take(self, spectra_indices, starts=None, ends=None):
+        """copies the given spectra. ``starts`` and ``ends`` are optional arrays of absolute
+        peak indices to restrict the peaks of every spectrum, spectra without peaks are
+        removed."""
+        spectra_indices = np.asarray(spectra_indices, dtype=np.int64)
+        if starts is None:
+            starts = self.offsets[spectra_indices]
+        if ends is None:
+            ends = self.offsets[spectra_indices + 1]
+        sizes = np.maximum(ends - starts, 0)
+        total = int(sizes.sum())
+        peak_indices = np.repeat(starts - (np.cumsum(sizes) - sizes), sizes) + np.arange(total)
+        return self._subset(spectra_indices, peak_indices, sizes)
+
+    def filter_peaks(self, flags):
+        """copies all peaks where the boolean array ``flags`` is True, spectra without peaks
+        are removed."""
+        n = len(self)
+        spectrum_index = np.repeat(np.arange(n), np.diff(self.offsets))
+        sizes = np.bincount(spectrum_index[flags], minlength=n)
+        return self._subset(np.arange(n), np.where(flags)[0], sizes)
+
+    def with_ms_level(self, ms_level):
+        """returns PeakArrays sharing the peaks but with all ms levels set to ``ms_level``"""
+        return PeakArrays(self.peaks, self.offsets, self.rts,
+                          np.zeros_like(self.ms_levels) + ms_level, self.polarities,
+                          self.precursors, self.scan_numbers, self.metas)
+
+    @property
+    def mzs(self):
+        return self.peaks[:, 0]
+
+    @property
+    def intensities(self):
+        return self.peaks[:, 1]
+
+    def spectrum_peaks(self, i):
+        """peaks of spectrum ``i``, this is a view and no copy"""
+        return self.peaks[self.offsets[i]:self.offsets[i + 1]]
+
+    def select(self, ms_level=None, rtmin=None, rtmax=None):
+        """returns indices of spectra with given ms level and rtmin <= rt <= rtmax. Parameters
+        with *None* value are not considered."""
+        flags = np.ones((len(self),), dtype=bool)
+        if ms_level is not None:
+            flags &= self.ms_levels == ms_level
+        if rtmin is not None:
+            flags &= self.rts >= rtmin
+        if rtmax is not None:
+            flags &= self.rts <= rtmax
+        return np.where(flags)[0]
+
+    def peak_indices(self, spectra_indices):
+        """indices of all peaks of the given spectra"""
+        spectra_indices = np.asarray(spectra_indices, dtype=np.int64)
+        starts = self.offsets[spectra_indices]
+        sizes = self.offsets[spectra_indices + 1] - starts
+        total = int(sizes.sum())
+        cum_sizes = np.cumsum(sizes) - sizes
+        return np.repeat(starts - cum_sizes, sizes) + np.arange(total)
+
+    def mz_ranges(self, spectra_indices):
+        """returns arrays with minimal and maximal m/z value of the given spectra, spectra
+        must not be empty"""
+        spectra_indices = np.asarray(spectra_indices, dtype=np.int64)
+        mzs = self.mzs
+        return mzs[self.offsets[spectra_indices]], mzs[self.offsets[spectra_indices + 1] - 1]
+
+    def intensities_in_range(self, spectra_indices, mzmin, mzmax):
+        """summed up intensities of peaks with mzmin <= mz <= mzmax for every given spectrum.
+        ``mzmin`` and ``mzmax`` can be arrays with one value per spectrum."""
+        spectra_indices = np.asarray(spectra_indices, dtype=np.int64)
+        starts = self.offsets[spectra_indices]
+        ends = self.offsets[spectra_indices + 1]
+        lo = segment_searchsorted(self.mzs, starts, ends, mzmin, "left")
+        hi = segment_searchsorted(self.mzs, starts, ends, mzmax, "right")
+        return segment_sums(self.intensities, lo, hi)
+
+    def chromatogram(self, mzmin, mzmax, rtmin, rtmax, ms_level):
+        indices = self.select(ms_level, rtmin, rtmax)
+        return self.rts[indices], self.intensities_in_range(indices, mzmin, mzmax)
+
+    def sample_image(self, ms_level, rtmin, rtmax, mzmin, mzmax, nx, ny):
+        """returns ``ny`` x ``nx`` image with summed up intensities of the peaks of the given
+        ms level in the given rt and m/z range, m/z is along the first axis. only the peaks
+        within the m/z range are touched."""
+        if rtmin >= rtmax or mzmin >= mzmax or nx <= 0 or ny <= 0:
+            return np.zeros((max(ny, 0), max(nx, 0)))
+        spectra_indices = self.select(ms_level, rtmin, rtmax)
+        starts = self.offsets[spectra_indices]
+        ends = self.offsets[spectra_indices + 1]
+        lo = segment_searchsorted(self.mzs, starts, ends, mzmin, "left")
+        hi = segment_searchsorted(self.mzs, starts, ends, mzmax, "right")
+        sizes = hi - lo
+        total = int(sizes.sum())
+        peak_indices = np.repeat(lo - (np.cumsum(sizes) - sizes), sizes) + np.arange(total)
+
+        x = ((np.repeat(self.rts[spectra_indices], sizes) - rtmin) / (rtmax - rtmin) * nx)
+        y = (self.mzs[peak_indices] - mzmin) / (mzmax - mzmin) * ny
+        x = np.minimum(x.astype(np.int64), nx - 1)
+        y = np.minimum(y.astype(np.int64), ny - 1)
+        image = np.bincount(y * nx + x, weights=self.intensities[peak_indices],
+                            minlength=nx * ny)
+        return image.reshape(ny, nx)
+
+    def chromatograms(self, windows, ms_level, max_pairs=2 ** 22):
+        """computes chromatograms for all rows ``(mzmin, mzmax, rtmin, rtmax)`` of the n x 4
+        array ``windows`` at once. returns a list of ``(rts, intensities)`` tuples.
+
+        we determine all pairs of windows and spectra in the rt range of the windows and sum
+        up the intensities of all pairs with one vectorized binary search. ``max_pairs`` limits
+        the number of pairs handled at once.
+        """
+        windows = np.asarray(windows, dtype=np.float64).reshape(-1, 4)
+        indices = self.select(ms_level)
+        rts = self.rts[indices]
+        if np.any(np.diff(rts) < 0):
+            # spectra are sorted by rt when creating a peakmap, but rts might be modified later:
+            return [self.chromatogram(mzmin, mzmax, rtmin, rtmax, ms_level)
+                    for (mzmin, mzmax, rtmin, rtmax) in windows]
+
+        first = np.searchsorted(rts, windows[:, 2], "left")
+        last = np.searchsorted(rts, windows[:, 3], "right")
+        counts = np.maximum(last - first, 0)
+
+        result = []
+        start = 0
+        while start < len(windows):
+            # we take at least one window, else as many as max_pairs allows:
+            cum_counts = np.cumsum(counts[start:])
+            end = start + max(1, np.searchsorted(cum_counts, max_pairs, "right"))
+            chunk_counts = counts[start:end]
+            total = int(chunk_counts.sum())
+            positions = (np.repeat(first[start:end] - (np.cumsum(chunk_counts) - chunk_counts),
+                                   chunk_counts) + np.arange(total))
+            spectra = indices[positions]
+            iis = self.intensities_in_range(spectra,
+                                            np.repeat(windows[start:end, 0], chunk_counts),
+                                            np.repeat(windows[start:end, 1], chunk_counts))
+            limits = np.zeros((len(chunk_counts) + 1,), dtype=np.int64)
+            limits[1:] = np.cumsum(chunk_counts)
+            for i0, i1 in zip(limits[:-1], limits[1:]):
+                result.append((self.rts[spectra[i0:i1]], iis[i0:i1]))
+            start = end
+        return result
@@ -0,0 +1,170 @@
+# encoding: utf-8
+from __future__ import print_function, division, absolute_import
+
+import os
+import struct
+import sys
+import time
+import zlib
+
+import dill
+import numpy as np
+
+from .peak_arrays import PeakArrays
+
+
+# file format for peakmaps referenced by PeakMapProxy objects, see Table.store:
+#
+#   magic line
+#   8 bytes little endian offset of the index
+#   chunks: peaks of SPECTRA_PER_CHUNK consecutive spectra, m/z values followed by the
+#           intensities as float64 values, compressed with zlib at a fast level.
+#   index:  pickled dict with the peakmaps meta data, peak offsets, rts, ms levels, ...
+#           of all spectra and the positions of the chunks.
+#
+# so one can read the peaks of some spectra without decompressing the full peakmap.
+
+MAGIC = "emzed_peakmap_cache 1\n"
+SPECTRA_PER_CHUNK = 32
+COMPRESSION_LEVEL = 1
+
+
+def is_peakmap_cache(path):
+    if not os.path.isfile(path):
+        return False
+    with open(path, "rb") as fp:
+        return fp.read(len(MAGIC)) == MAGIC
+
+
+def write_peakmap_cache(peakmap, path):
+    """writes ``peakmap`` to ``path``, see :py:class:`~.PeakMapCache` for reading"""
+    if sys.platform == "win32":
+        path = path.replace("/", "\\")  # needed for network shares
+
+    folder = os.path.dirname(path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+
+    arrays = peakmap.peakArrays()
+    offsets = arrays.offsets
+    n = len(arrays)
+
+    # atomic write, as PeakMap.dump_as_pickle does:
+    with open(path + ".incomplete", "wb") as fp:
+        fp.write(MAGIC)
+        offset_position = fp.tell()
+        fp.write(struct.pack("<Q", 0))
+
+        chunks = []
+        for start in range(0, n, SPECTRA_PER_CHUNK):
+            end = min(n, start + SPECTRA_PER_CHUNK)
+            peaks = arrays.peaks[offsets[start]:offsets[end]]
+            data = zlib.compress(np.ascontiguousarray(peaks.T).tostring(), COMPRESSION_LEVEL)
+            chunks.append((fp.tell(), len(data)))
+            fp.write(data)
+
+        index_start = fp.tell()
+        index = dict(meta=peakmap.meta, offsets=offsets, rts=arrays.rts,
+                     ms_levels=arrays.ms_levels, polarities=arrays.polarities,
+                     precursors=arrays.precursors, scan_numbers=arrays.scan_numbers,
+                     metas=arrays.metas, chunks=chunks)
+        dill.dump(index, fp)
+        fp.seek(offset_position)
+        fp.write(struct.pack("<Q", index_start))
+        fp.flush()
+        os.fsync(fp.fileno())
+
+    if os.path.exists(path):
+        os.remove(path)
+    for attempt in range(10):
+        try:
+            os.rename(path + ".incomplete", path)
+            break
+        except EnvironmentError:
+            time.sleep(.1)
+
+
+class PeakMapCache(object):
+
+    """reads peaks of selected spectra from a file written by :py:func:`write_peakmap_cache`.
+    only the index is read when the object is created.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as fp:
+            if fp.read(len(MAGIC)) != MAGIC:
+                raise IOError("%s is no peakmap cache file" % path)
+            index_start, = struct.unpack("<Q", fp.read(8))
+            fp.seek(index_start)
+            try:
+                index = dill.load(fp)
+            except Exception:
+                raise IOError("unpickling of index in %s failed, file might be corrupted" % path)
+        self.meta = index["meta"]
+        self.offsets = index["offsets"]
+        self.rts = index["rts"]
+        self.ms_levels = index["ms_levels"]
+        self.polarities = index["polarities"]
+        self.precursors = index["precursors"]
+        self.scan_numbers = index["scan_numbers"]
+        self.metas = index["metas"]
+        self.chunks = index["chunks"]
+
+    def __len__(self):
+        return len(self.rts)
+
+    def select(self, ms_level=None, rtmin=None, rtmax=None):
+        """returns indices of spectra with given ms level and rtmin <= rt <= rtmax. Parameters
+        with *None* value are not considered."""
+        flags = np.ones((len(self),), dtype=bool)
+        if ms_level is not None:
+            flags &= self.ms_levels == ms_level
+        if rtmin is not None:
+            flags &= self.rts >= rtmin
+        if rtmax is not None:
+            flags &= self.rts <= rtmax
+        return np.where(flags)[0]
+
+    def _read_chunks(self, chunk_indices):
+        """returns PeakArrays with all spectra of the given chunks"""
+        parts = []
+        spectra = []
+        with open(self.path, "rb") as fp:
+            for ci in chunk_indices:
+                position, size = self.chunks[ci]
+                fp.seek(position)
+                try:
+                    data = zlib.decompress(fp.read(size))
+                except zlib.error:
+                    raise IOError("compressed data in %s is invalid, file might be corrupted"
+                                  % self.path)
+                parts.append(np.fromstring(data, dtype=np.float64).reshape(2, -1).T)
+                start = ci * SPECTRA_PER_CHUNK
+                spectra.append(np.arange(start, min(len(self), start + SPECTRA_PER_CHUNK)))
+
+        if parts:
+            peaks = np.vstack(parts)
+            spectra = np.hstack(spectra)
+        else:
+            peaks = np.zeros((0, 2), dtype=np.float64)
+            spectra = np.zeros((0,), dtype=np.int64)
+        offsets = np.zeros((len(spectra) + 1,), dtype=np.int64)
+        offsets[1:] = np.cumsum(self.offsets[spectra + 1] - self.offsets[spectra])
+        return PeakArrays(peaks, offsets, self.rts[spectra], self.ms_levels[spectra],
+                          self.polarities[spectra],
+                          [self.precursors[i] for i in spectra],
+                          [self.scan_numbers[i] for i in spectra],
+                          [self.metas[i] for i in spectra]), spectra
+
+    def read(self, spectra_indices):
+        """returns PeakArrays with the given spectra, only the chunks holding these spectra
+        are read"""
+        spectra_indices = np.asarray(spectra_indices, dtype=np.int64)
+        chunk_indices = np.unique(spectra_indices // SPECTRA_PER_CHUNK)
+        arrays, spectra = self._read_chunks(chunk_indices)
+        return arrays.take(np.searchsorted(spectra, spectra_indices))
+
+    def read_all(self):
+        arrays, __ = self._read_chunks(range(len(self.chunks)))
+        return arrays
@@ -0,0 +1,46 @@
+# encoding: utf-8
+from __future__ import print_function, division, absolute_import
+
+import numpy as np
+
+
+class RowView(object):
+
+    """the rows ``source[i] for i in indices`` of a list of rows. ``source`` and the row
+    lists in it are shared with the table the rows come from and with other views, so a view
+    costs one integer per row instead of a copy of every row.
+
+    the shared rows must not be modified. tables copy the rows of a view when
+    ``Table.rows`` is accessed, and a table which shared its rows copies them once before
+    they are modified, see ``Table.rows``.
+    """
+
+    __slots__ = ("source", "indices")
+
+    def __init__(self, source, indices):
+        self.source = source
+        self.indices = np.asarray(indices, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.indices)
+
+    def rows(self):
+        """the rows of the view without copying them, so do not modify them"""
+        source = self.source
+        return [source[i] for i in self.indices.tolist()]
+
+    def copy_rows(self):
+        source = self.source
+        return [source[i][:] for i in self.indices.tolist()]
+
+    def take(self, indices):
+        """view to the rows ``indices`` of this view"""
+        return RowView(self.source, self.indices[np.asarray(indices, dtype=np.int64)])
+
+    def __getstate__(self):
+        # we do not pickle all shared rows:
+        return self.rows()
+
+    def __setstate__(self, rows):
+        self.source = rows
+        self.indices = np.arange(len(rows), dtype=np.int64)
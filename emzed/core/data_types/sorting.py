@@ -0,0 +1,105 @@
+# encoding: utf-8
+from __future__ import print_function, division, absolute_import
+
+import numbers
+
+import numpy as np
+
+
+def _python_values(values, missing):
+    values = list(values)
+    if missing is not None:
+        for i in np.where(missing)[0]:
+            values[i] = None
+    return values
+
+
+def _ranks(values, missing=None):
+    """computes integer ranks of ``values`` such that comparing ranks gives the same result as
+    comparing the values in python. None (or flags set in the boolean array ``missing``) get
+    rank -1, as python 2 considers None to be smaller than all other values.
+
+    returns None if values can not be ranked this way, eg for mixed types or nan values.
+    """
+    n = len(values)
+    if isinstance(values, np.ndarray) and values.dtype.kind in "iufb":
+        if missing is None:
+            missing = np.zeros((n,), dtype=bool)
+        else:
+            missing = np.asarray(missing, dtype=bool)
+        present = values[~missing]
+        if present.dtype.kind == "f" and np.isnan(present).any():
+            return None
+    else:
+        values = _python_values(values, missing)
+        missing = np.fromiter((v is None for v in values), dtype=bool, count=n)
+        present = [v for v in values if v is not None]
+        if all(isinstance(v, numbers.Real) for v in present):
+            if any(v != v for v in present):
+                # nan
+                return None
+            present = np.array(present)
+            if present.dtype.kind == "f":
+                # mixed ints and floats, avoid loss of precision due to conversion:
+                if any(not isinstance(v, float) and abs(v) >= 2 ** 53 for v in values
+                       if v is not None):
+                    return None
+        elif all(isinstance(v, str) for v in present) or all(isinstance(v, unicode)
+                                                              for v in present):
+            # np.unique on object arrays compares the values as python does:
+            present_ = np.empty((len(present),), dtype=object)
+            present_[:] = present
+            present = present_
+        else:
+            return None
+
+    ranks = np.zeros((n,), dtype=np.int64) - 1
+    if len(present):
+        __, inverse = np.unique(present, return_inverse=True)
+        ranks[~missing] = inverse
+    return ranks
+
+
+def _cmp_sort_permutation(columns, ascending):
+    """fall back for values which can not be ranked by numpy. this is the same as stable
+    sorting with python 2s cmp semantics"""
+
+    columns = [_python_values(values, missing) for (values, missing) in columns]
+
+    def compare(i1, i2):
+        for values, ai in zip(columns, ascending):
+            v1 = values[i1]
+            v2 = values[i2]
+            if v1 != v2:
+                if ai:
+                    return -1 if v1 < v2 else +1
+                else:
+                    return -1 if v1 > v2 else +1
+        return 0
+
+    n = len(columns[0])
+    return np.array(sorted(range(n), cmp=compare), dtype=np.int64)
+
+
+def sort_permutation(columns, ascending):
+    """computes the permutation for sorting rows according to the given ``columns``. This is
+    a stable sort, so rows with equal keys keep their order.
+
+    ``columns`` is a list of tuples ``(values, missing)`` where ``values`` is a sequence or numpy
+    array and ``missing`` is None or a boolean numpy array flagging missing values. None values
+    are considered to be smaller than all other values, which is python 2's ordering.
+
+    ``ascending`` is a list of booleans, one per column.
+
+    returns a numpy array of row indices.
+    """
+    assert len(columns) == len(ascending)
+    assert len(columns) > 0
+    keys = []
+    for (values, missing), asc in zip(columns, ascending):
+        ranks = _ranks(values, missing)
+        if ranks is None:
+            return _cmp_sort_permutation(columns, ascending)
+        keys.append(ranks if asc else -ranks)
+    # lexsort is stable and uses the last key as primary key:
+    return np.lexsort(keys[::-1])
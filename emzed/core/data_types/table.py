@@ -8,6 +8,7 @@ import csv
 import fnmatch
 import hashlib
 import inspect
+import itertools
 import locale
 import os
 import re
@@ -20,9 +21,20 @@ import pyopenms
 
 from .range_set import RangeSet
 
+from .row_view import RowView
+
+from .columnar import (Column, ColumnStore, COLUMNAR_MAGIC, write_columns, read_columns_header,
+                       read_columns)
+
+from .sorting import sort_permutation
+
+from .join_planner import JoinPlanner
+
+from .expression_compiler import compile_expression
+
 from .expressions import (BaseExpression, ColumnExpression, Value, _basic_num_types,
                           common_type_for, is_numpy_number_type,
-                          Lookup)
+                          Lookup, MultiDimLookup)
 
 from .base_classes import MutableTable
 
@@ -31,6 +43,9 @@ from . import tools
 from hdf5.object_store import ObjectProxy
 
 from .ms_types import PeakMap, PeakMapProxy
+from .peakmap_cache import write_peakmap_cache
+from .fingerprint import new_digest, update_with_array, update_with_values
+from .group_by import Groups
 
 from .symlink import symlink
 
@@ -317,6 +332,9 @@ class Table(MutableTable):
 
     _latest_internal_update_with_version = (2, 7, 5)
 
+    # first version which writes and reads tables stored with columnar=True:
+    _columnar_format_version = (2, 29, 4)
+
     _to_pickle = ("_colNames",
                   "_colTypes",
                   "_colFormats",
@@ -324,6 +342,17 @@ class Table(MutableTable):
                   "meta",
                   "rows")
 
+    # storage of the cells: either _rows is a list of lists, _columns is a ColumnStore or
+    # _view is a RowView to the rows of another table, see the rows property below.
+    # _shares_rows is set if views to _rows exist:
+    _rows = None
+    _columns = None
+    _view = None
+    _shares_rows = False
+
+    # tuple (fingerprint, objects in cells with their fingerprints), see fingerprint():
+    _fingerprint = None
+
     def __init__(self, colNames, colTypes, colFormats, rows=None, title=None,
                  meta=None):
 
@@ -391,6 +420,89 @@ class Table(MutableTable):
 
         self.resetInternals()
 
+    @property
+    def rows(self):
+        # rows will be modified in place by many methods. so the columns get outdated and
+        # we switch back to row wise storage, and rows shared with views are copied first:
+        if self._view is not None:
+            self._rows = self._view.copy_rows()
+            self._view = None
+        elif self._shares_rows:
+            self._rows = [row[:] for row in self._rows]
+            self._shares_rows = False
+        elif self._rows is None and self._columns is not None:
+            self._rows = self._columns.to_rows()
+            self._columns = None
+        return self._rows
+
+    @rows.setter
+    def rows(self, rows):
+        self._rows = rows
+        self._columns = None
+        self._view = None
+        self._shares_rows = False
+
+    def _setColumnStore(self, column_store):
+        self._rows = None
+        self._columns = column_store
+        self._view = None
+        self._shares_rows = False
+
+    def _setRowView(self, view):
+        self._rows = None
+        self._columns = None
+        self._view = view
+        self._shares_rows = False
+
+    def _rowView(self, indices):
+        """returns :py:class:`~emzed.core.data_types.row_view.RowView` to the rows with the
+        given indices without copying them"""
+        if self._view is not None:
+            return self._view.take(indices)
+        if self._shares_rows:
+            rows = self._rows
+        else:
+            # switches to row wise storage:
+            rows = self.rows
+            self._shares_rows = True
+        return RowView(rows, indices)
+
+    def _subTable(self, indices, t=None):
+        """returns table with the rows with the given indices. the rows are copied when the
+        table is modified. ``t`` is the empty table which gets the rows, default is
+        ``self.buildEmptyClone()``."""
+        if t is None:
+            t = self.buildEmptyClone()
+        if self._columns is not None:
+            t._setColumnStore(self._columns.take(indices))
+        else:
+            t._setRowView(self._rowView(indices))
+        t.resetInternals()
+        return t
+
+    def useColumnarStorage(self):
+        """switches **in place** to column wise storage of the table cells. columns of type
+        ``int``, ``float`` and ``bool`` are then kept as typed numpy arrays which speeds up
+        ``filter``, ``addColumn``, ``sortBy``, ``join`` and ``__getitem__`` for large tables
+        and reduces memory consumption. tables derived by these methods use column wise
+        storage too.
+
+        Accessing ``table.rows`` switches back to row wise storage.
+        """
+        if self._columns is None:
+            self._setColumnStore(ColumnStore.from_rows(self.rows, self._colTypes))
+            self.resetInternals()
+
+    def hasColumnarStorage(self):
+        return self._columns is not None
+
+    def _columnValues(self, ix):
+        """returns values of column with index ``ix`` as numpy array for evaluating
+        expressions if the table uses columnar storage, else None"""
+        if self._columns is not None:
+            return self._columns.columns[ix].to_array()
+        return None
+
     def __repr__(self):
         n = len(self)
         return "<Table at %#x '%s' with %d row%s>" % (id(self), self.title or "", n, "" if n == 1 else "s")
@@ -553,7 +665,7 @@ class Table(MutableTable):
         """
         returns the number of rows
         """
-        return len(self.rows)
+        return len(self)
 
     def __getitem__(self, ix):
         """
@@ -633,6 +745,9 @@ class Table(MutableTable):
         icol = _setup(icol, ncols)
         irow = _setup(irow, nrows)
 
+        if self._columns is not None:
+            return self._getitemColumnar(irow, icol, nrows, ncols)
+
         def select(li, ix, n, mode):
             if ix is None:
                 return li[:]
@@ -649,14 +764,38 @@ class Table(MutableTable):
         prototype.resetInternals()
         return prototype
 
+    def _getitemColumnar(self, irow, icol, nrows, ncols):
+        irow = np.array(irow, dtype=np.int64)
+        if np.any((irow < -nrows) | (irow >= nrows)):
+            i = irow[(irow < -nrows) | (irow >= nrows)][0]
+            raise IndexError("you tried to access row with out of bounds index %d" % i)
+        irow[irow < 0] += nrows
+        for i in icol:
+            if not -ncols <= i < ncols:
+                raise IndexError("you tried to access column with out of bounds index %d" % i)
+        icol = [i + ncols if i < 0 else i for i in icol]
+        prototype = self.buildEmptyClone(icol)
+        prototype._setColumnStore(self._columns.select_columns(icol).take(irow))
+        prototype.resetInternals()
+        return prototype
+
     def __eq__(self, other):
         if not isinstance(other, Table):
             return False
+        if self is other:
+            return True
         return self._colNames == other._colNames and \
             len(self) == len(other) and \
             self._colTypes == other._colTypes and \
             self._colFormats == other._colFormats and \
-            self.rows == other.rows
+            self._rowsWithoutConversion() == other._rowsWithoutConversion()
+
+    def _rowsWithoutConversion(self):
+        if self._columns is not None:
+            return self._columns.to_rows()
+        if self._view is not None:
+            return self._view.rows()
+        return self._rows
 
     def __ne__(self, other):
         return not (self == other)
@@ -669,6 +808,13 @@ class Table(MutableTable):
     def __getstate__(self):
         """ **for internal use**: filters some attributes for pickling. """
         dd = self.__dict__.copy()
+        # we always pickle row wise storage, so older emzed versions can load the data:
+        dd.pop("_columns", None)
+        dd.pop("_rows", None)
+        dd.pop("_view", None)
+        dd.pop("_shares_rows", None)
+        dd.pop("_fingerprint", None)
+        dd["rows"] = self._rowsWithoutConversion()
         # self.colFormatters can not be pickled
         del dd["colFormatters"]
         for name in self._colNames:
@@ -689,6 +835,9 @@ class Table(MutableTable):
             else:
                 raise Exception("can not unpickle table, internal mismatch")
 
+        if "rows" in dd:
+            dd["_rows"] = dd.pop("rows")
+
         self.__dict__ = dd
         self.resetInternals()
 
@@ -872,6 +1021,10 @@ class Table(MutableTable):
 
     def _getColumnCtx(self, needed):
         names = [n for (t, n) in needed if t == self]
+        if self._columns is not None:
+            return dict((n, (self._columnValues(self.getIndex(n)),
+                             self.primaryIndex.get(n),
+                             self.getColumn(n).type_)) for n in names)
         return dict((n, (self.getColumn(n).values,
                          self.primaryIndex.get(n),
                          self.getColumn(n).type_)) for n in names)
@@ -913,20 +1066,19 @@ class Table(MutableTable):
         if not column_names:
             return range(len(self))
 
-        idxs = [self.colIndizes[name] for name in column_names]
-        enumeration = dict()
-        i = 0
-        for row in self.rows:
-            key = tuple(row[i] for i in idxs)
-            if key not in enumeration:
-                enumeration[key] = i
-                i += 1
+        return self._groups(column_names).codes.tolist()
 
-        values = []
-        for row in self.rows:
-            key = tuple(row[i] for i in idxs)
-            values.append(enumeration.get(key))
-        return values
+    def _groups(self, col_names, key=None):
+        """groups the rows by the values of the given columns, see
+        :py:class:`~emzed.core.data_types.group_by.Groups`"""
+        columns = []
+        for name in col_names:
+            ix = self.getIndex(name)
+            values = self._columnValues(ix)
+            if values is None:
+                values = [row[ix] for row in self._rowsWithoutConversion()]
+            columns.append(values)
+        return Groups.from_columns(columns, len(self), key)
 
     def addEnumeration(self, colName="id", insertBefore=None, insertAfter=None, startWith=0):
         """ adds enumerated column as first column to table **in place**.
@@ -976,25 +1128,17 @@ class Table(MutableTable):
         if not len(self):
             return []   # empty permutation
 
-        idxs = [self.colIndizes[name] for name in colNames]
-
-        def compare(item1, item2):
-            __, row1 = item1
-            __, row2 = item2
-            for i, ai in zip(idxs, ascending):
-                v1 = row1[i]
-                v2 = row2[i]
-                if v1 != v2:
-                    if ai:
-                        return -1 if v1 < v2 else +1
-                    else:
-                        return -1 if v1 > v2 else +1
-            return 0
+        columns = []
+        for name in colNames:
+            if self._columns is not None:
+                column = self._columns.columns[self.colIndizes[name]]
+                missing = ~column.valid if column.is_typed else None
+                columns.append((column.data, missing))
+            else:
+                columns.append((self.getColumn(name).values, None))
 
-        decorated = list(enumerate(self.rows))
-        decorated.sort(cmp=compare)
-        perm, __ = zip(*decorated)
-        return perm
+        perm = sort_permutation(columns, ascending)
+        return tuple(perm.tolist())
 
     def findMatchingRows(self, filters):
         """accepts list of column names and functions operating on those columns,
@@ -1028,7 +1172,10 @@ class Table(MutableTable):
         return indices_of_fitting_rows
 
     def _applyRowPermutation(self, permutation):
-        self.rows = [self.rows[pi] for pi in permutation]
+        if self._columns is not None:
+            self._setColumnStore(self._columns.take(permutation))
+        else:
+            self.rows = [self.rows[pi] for pi in permutation]
         self.resetInternals()
 
     def copy(self):
@@ -1046,6 +1193,11 @@ class Table(MutableTable):
         indices = [self.getIndex(name) for name in names]
         types = [self._colTypes[i] for i in indices]
         formats = [self._colFormats[i] for i in indices]
+        if self._columns is not None:
+            result = Table._create(names, types, formats, [], self.title, self.meta.copy())
+            result._setColumnStore(self._columns.select_columns(indices))
+            result.resetInternals()
+            return result
         rows = [[row[i] for i in indices] for row in self.rows]
         return Table._create(names, types, formats, rows, self.title, self.meta.copy())
 
@@ -1115,6 +1267,10 @@ class Table(MutableTable):
         self._renameColumnsUnchecked(*dicts, **keyword_args)
 
     def __len__(self):
+        if self._columns is not None:
+            return len(self._columns)
+        if self._view is not None:
+            return len(self._view)
         return len(self.rows)
 
     def storeCSV(self, path, as_printed=True, row_indices=None):
@@ -1144,7 +1300,8 @@ class Table(MutableTable):
                         for (f, v) in zip(formatters, colNames)]
                 writer.writerow(data)
 
-    def store(self, path, forceOverwrite=False, compressed=True, peakmap_cache_folder=None, atomic=False):
+    def store(self, path, forceOverwrite=False, compressed=True, peakmap_cache_folder=None, atomic=False,
+              columnar=False):
         """Writes the table in binary format. All information, as corresponding peak maps too.
 
         The file name extension in ``path``must be ``.table``.
@@ -1160,6 +1317,11 @@ class Table(MutableTable):
         developer must care about consistency: if the peakmap folder is deleted the table may
         becom useless !
 
+        ``columnar`` writes the cells column wise: columns of type ``int``, ``float`` and
+        ``bool`` as binary arrays which are memory mapped when loading, all other columns are
+        pickled per column. :py:meth:`~.load` then only reads the requested columns. Files in
+        this format can not be read by emzed versions before 2.29.4.
+
         Latter the file can be loaded with :py:meth:`~.load`
         """
         if not forceOverwrite and os.path.exists(path):
@@ -1177,10 +1339,18 @@ class Table(MutableTable):
             self._introduce_proxies(peakmap_cache_folder, path)
 
         with open_for_write(path, "w+b", atomic) as fp:
-            fp.write("emzed_version=%s.%s.%s\n" %
-                     self._latest_internal_update_with_version)
-            data = tuple(getattr(self, a) for a in Table._to_pickle)
-            dill.dump(data, fp)
+            if columnar:
+                fp.write("emzed_version=%s.%s.%s\n" % self._columnar_format_version)
+                store = self._columns
+                if store is None:
+                    store = ColumnStore.from_rows(self.rows, self._colTypes)
+                attributes = dict((a, getattr(self, a)) for a in Table._to_pickle if a != "rows")
+                write_columns(fp, store, attributes)
+            else:
+                fp.write("emzed_version=%s.%s.%s\n" %
+                         self._latest_internal_update_with_version)
+                data = tuple(getattr(self, a) for a in Table._to_pickle)
+                dill.dump(data, fp)
 
         if peakmap_cache_folder is not None and peakmap_cache_folder.startswith("."):
             self._correct_proxies(path)
@@ -1205,6 +1375,28 @@ class Table(MutableTable):
         tab.resetInternals()
         return tab
 
+    @staticmethod
+    def _load_columnar(path, fp, columns):
+        attributes, layout = read_columns_header(fp)
+        names = attributes["_colNames"]
+        if columns is None:
+            col_indices = range(len(names))
+        else:
+            missing = [name for name in columns if name not in names]
+            if missing:
+                raise Exception("column(s) %s not in table" % ", ".join(missing))
+            col_indices = [names.index(name) for name in columns]
+
+        def select(li):
+            return [li[i] for i in col_indices]
+
+        tab = Table._create(select(names), select(attributes["_colTypes"]),
+                            select(attributes["_colFormats"]), [], attributes["title"],
+                            attributes["meta"])
+        tab._setColumnStore(read_columns(path, fp, layout, col_indices))
+        tab.resetInternals()
+        return tab
+
     @staticmethod
     def _try_to_load_old_version(pickle_data):
         import sys
@@ -1238,31 +1430,52 @@ class Table(MutableTable):
         self.resetInternals()
 
     @staticmethod
-    def load(path):
+    def load(path, columns=None):
         """loads a table stored with :py:meth:`~.store`
 
+           ``columns`` is an optional list of column names to load. for tables stored with
+           ``columnar=True`` only these columns are read from the file.
+
            **Note**: as this is a static method, it has to be called as
            ``tab = Table.load("xzy.table")``
         """
         with open(path, "rb") as fp:
+            version_str = fp.readline()
+            if version_str.startswith("emzed_version="):
+                v_number = tuple(map(int, version_str[14:].split(".")))
+                if v_number >= Table._columnar_format_version:
+                    if fp.read(len(COLUMNAR_MAGIC)) == COLUMNAR_MAGIC:
+                        tab = Table._load_columnar(path, fp, columns)
+                        tab._correct_proxies(path)
+                        tab.version = v_number
+                        tab.meta["loaded_from"] = os.path.abspath(path)
+                        return tab
+            fp.seek(0)
             data = fp.read()
-            version_str, __, pickle_data = data.partition("\n")
-            if not version_str.startswith("emzed_version="):
-                try:
-                    return Table._try_to_load_old_version(pickle_data)
-                except Exception:
-                    return Table._try_to_load_old_version(data)
-            v_number_str = version_str[14:]
-            v_number = tuple(map(int, v_number_str.split(".")))
+        tab = Table._load_pickled(path, data)
+        if columns is not None:
+            tab = tab.extractColumns(*columns)
+        return tab
+
+    @staticmethod
+    def _load_pickled(path, data):
+        version_str, __, pickle_data = data.partition("\n")
+        if not version_str.startswith("emzed_version="):
             try:
-                tab = Table._load_strict(pickle_data, v_number)
-                if v_number >= (2, 7, 5):
-                    tab._correct_proxies(path)
-                tab.version = v_number
-                tab.meta["loaded_from"] = os.path.abspath(path)
-                return tab
-            except Exception:
                 return Table._try_to_load_old_version(pickle_data)
+            except Exception:
+                return Table._try_to_load_old_version(data)
+        v_number_str = version_str[14:]
+        v_number = tuple(map(int, v_number_str.split(".")))
+        try:
+            tab = Table._load_strict(pickle_data, v_number)
+            if v_number >= (2, 7, 5):
+                tab._correct_proxies(path)
+            tab.version = v_number
+            tab.meta["loaded_from"] = os.path.abspath(path)
+            return tab
+        except Exception:
+            return Table._try_to_load_old_version(pickle_data)
 
     def buildEmptyClone(self, cols=None):
         """ returns empty table with same names, types, formatters,
@@ -1307,8 +1520,11 @@ class Table(MutableTable):
             del self._colNames[ix]
             del self._colFormats[ix]
             del self._colTypes[ix]
-            for row in self.rows:
-                del row[ix]
+            if self._columns is not None:
+                self._columns.drop_column(ix)
+            else:
+                for row in self.rows:
+                    del row[ix]
         if len(self._colNames) == 0:
             # in this case we have here len(table) empty lists as rows, so we empty the tabl
             # totally:
@@ -1323,22 +1539,13 @@ class Table(MutableTable):
 
         use_proxies = kw.get("efficient", False)
 
-        sub_rows = collections.OrderedDict()
-        indices = [self.getIndex(n) for n in colNames]
-
-        for row in self.rows:
-            key = tuple((row[i] for i in indices))
-            if key not in sub_rows:
-                sub_rows[key] = []
-            sub_rows[key].append(row)
-
-        for rows in sub_rows.values():
+        groups = self._groups(colNames)
+        for indices in groups:
             if use_proxies:
-                t = TProxy(self, rows)
+                t = TProxy(self, self._rowView(indices))
+                t.resetInternals()
             else:
-                t = self.buildEmptyClone()
-                t.rows = [r[:] for r in rows]
-            t.resetInternals()
+                t = self._subTable(indices)
             yield t
 
     def splitBy(self, *colNames, **kw):
@@ -1547,7 +1754,7 @@ class Table(MutableTable):
                                                        format_, insertBefore, insertAfter)
 
     def _addColumnByExpression(self, name, expr, type_, format_, insertBefore, insertAfter):
-        values, _, type2_ = expr._eval(None)
+        values, _, type2_ = compile_expression(expr).evaluate(None)
         # TODO: automatic table check for numpy values via decorator ?
         # switchable !?
         if type2_ in _basic_num_types:
@@ -1610,8 +1817,11 @@ class Table(MutableTable):
         self._colNames.insert(col_, name)
         self._colTypes.insert(col_, type_)
         self._colFormats.insert(col_, format_)
-        for row, v in zip(self.rows, values):
-            row.insert(col_, v)
+        if self._columns is not None:
+            self._columns.insert_column(col_, Column.from_values(values, type_))
+        else:
+            for row, v in zip(self.rows, values):
+                row.insert(col_, v)
 
         self.resetInternals()
 
@@ -1669,18 +1879,11 @@ class Table(MutableTable):
         result = self.buildEmptyClone()
         if byColumns is not None:
             assert isinstance(byColumns, (tuple, list))
-            ixi = [self.getIndex(name) for name in byColumns]
         else:
-            ixi = None
-        keysSeen = set()
-        for row in self.rows:
-            if ixi is not None:
-                key = computekey([row[i] for i in ixi])
-            else:
-                key = computekey(row)
-            if key not in keysSeen:
-                result.rows.append(row[:])
-                keysSeen.add(key)
+            byColumns = self._colNames
+        groups = self._groups(byColumns, key=computekey)
+        rows = self.rows
+        result.rows = [rows[i][:] for i in groups.first_rows]
         result.resetInternals()
         return result
 
@@ -1699,10 +1902,18 @@ class Table(MutableTable):
             print "#", expr
 
         ctx = {self: self._getColumnCtx(expr._neededColumns())}
-        flags, _, _ = expr._eval(ctx)
+        flags = compile_expression(expr).evaluate_flags(ctx)
         filteredTable = self.buildEmptyClone()
         filteredTable.primaryIndex = self.primaryIndex.copy()
-        if len(flags) == 1:
+        if self._columns is not None:
+            if len(flags) == 1:
+                indices = np.arange(len(self)) if flags[0] else []
+            else:
+                assert len(flags) == len(
+                    self), "result of filter expression does not match table size"
+                indices = np.where(flags)[0]
+            filteredTable._setColumnStore(self._columns.take(indices))
+        elif len(flags) == 1:
             if flags[0]:
                 filteredTable.rows = [r[:] for r in self.rows]
             else:
@@ -1710,8 +1921,8 @@ class Table(MutableTable):
         else:
             assert len(flags) == len(
                 self), "result of filter expression does not match table size"
-            filteredTable.rows = [self.rows[n][:]
-                                  for n, i in enumerate(flags) if i]
+            rows = self.rows
+            filteredTable.rows = [rows[n][:] for n in np.where(flags)[0]]
         filteredTable.resetInternals()
         return filteredTable
 
@@ -1824,6 +2035,11 @@ class Table(MutableTable):
            If you do not provide an expression, this method returns the full
            cross product.
 
+           Conditions as ``inRange``, ``approxEqual``, ``equals`` or ``<=`` / ``>=``
+           comparisons combined with ``&`` are used to restrict the rows of ``t`` which
+           have to be checked for every row of this table. Use ``debug=True`` to see which
+           strategy is used.
+
         """
         # no direct type check below, as databases decorate member tables:
         try:
@@ -1838,27 +2054,53 @@ class Table(MutableTable):
 
         if debug:
             print "# %s.join(%s, %s)" % (self._name, t._name, expr)
-        tctx = t._getColumnCtx(expr._neededColumns())
+        planner = JoinPlanner(self, t, expr)
+        if debug:
+            print "# strategy: %s" % planner.describe()
 
         cmdlineProgress = _CmdLineProgress(len(self))
-        rows = []
-        for ii, r1 in enumerate(self.rows):
-            r1ctx = dict(
-                (n, ([v], None, t)) for (n, v, t) in zip(self._colNames, r1, self._colTypes))
-            ctx = {self: r1ctx, t: tctx}
-            flags, _, _ = expr._eval(ctx)
-            if len(flags) == 1:
-                if flags[0]:
-                    rows.extend([r1[:] + row[:] for row in t.rows])
-            else:
-                rows.extend([r1[:] + t.rows[n][:]
-                             for (n, i) in enumerate(flags) if i])
+        left_indices = []
+        right_indices = []
+        for ii, matches in enumerate(planner.iter_matches()):
+            left_indices.extend([ii] * len(matches))
+            right_indices.extend(matches)
             cmdlineProgress.progress(ii)
         cmdlineProgress.finish()
-        table.rows = rows
-        table.resetInternals()
+        self._fillJoinTable(table, t, left_indices, right_indices)
         return table
 
+    def _iterRowValues(self):
+        """iterates over the rows without switching from columnar to row wise storage"""
+        if self._columns is not None and self._columns.columns:
+            return itertools.izip(*[c.to_list() for c in self._columns.columns])
+        return iter(self._rowsWithoutConversion())
+
+    def _fillJoinTable(self, table, t, left_indices, right_indices):
+        """fills ``table`` with the concatenated rows ``self[i] + t[j]`` for the index pairs
+        given by ``left_indices`` and ``right_indices``. negative indices in ``right_indices``
+        create rows with missing values from ``t``. """
+        if self._columns is not None or t._columns is not None:
+            left = self._columns
+            if left is None:
+                left = ColumnStore.from_rows(self.rows, self._colTypes)
+            right = t._columns
+            if right is None:
+                right_rows = t.rows
+                used = sorted(set(j for j in right_indices if j >= 0))
+                right = ColumnStore.from_rows([right_rows[j] for j in used], t._colTypes)
+                remap = np.zeros((len(right_rows) + 1,), dtype=np.int64) - 1
+                remap[used] = np.arange(len(used))
+                right_indices = remap[np.array(right_indices, dtype=np.int64)]
+            columns = left.take(left_indices).hstack(right.take(right_indices))
+            table._setColumnStore(columns)
+        else:
+            left_rows = self.rows
+            right_rows = t.rows
+            filler = [None] * len(t._colNames)
+            table.rows = [left_rows[i][:] + (right_rows[j][:] if j >= 0 else filler[:])
+                          for (i, j) in itertools.izip(left_indices, right_indices)]
+        table.resetInternals()
+
     def leftJoin(self, t, expr=True, debug=False, title=None):
         """performs an *left join* also known as *outer join* of two tables.
 
@@ -1895,51 +2137,73 @@ class Table(MutableTable):
 
         if debug:
             print "# %s.leftJoin(%s, %s)" % (self._name, t._name, expr)
-        tctx = t._getColumnCtx(expr._neededColumns())
+        planner = JoinPlanner(self, t, expr)
+        if debug:
+            print "# strategy: %s" % planner.describe()
 
-        filler = [None] * len(t._colNames)
         cmdlineProgress = _CmdLineProgress(len(self))
 
-        rows = []
-        for ii, r1 in enumerate(self.rows):
-            r1ctx = dict(
-                (n, ([v], None, t)) for (n, v, t) in zip(self._colNames, r1, self._colTypes))
-            ctx = {self: r1ctx, t: tctx}
-            flags, _, _ = expr._eval(ctx)
-            if len(flags) == 1:
-                if flags[0]:
-                    rows.extend([r1[:] + row[:] for row in t.rows])
-                else:
-                    rows.extend([r1[:] + filler[:]])
-            elif np.any(flags):
-                rows.extend([r1[:] + t.rows[n][:]
-                             for (n, i) in enumerate(flags) if i])
-            else:
-                rows.extend([r1[:] + filler[:]])
+        left_indices = []
+        right_indices = []
+        for ii, matches in enumerate(planner.iter_matches()):
+            if not len(matches):
+                matches = [-1]
+            left_indices.extend([ii] * len(matches))
+            right_indices.extend(matches)
             cmdlineProgress.progress(ii)
 
         cmdlineProgress.finish()
 
-        table.rows = rows
-        table.resetInternals()
+        self._fillJoinTable(table, t, left_indices, right_indices)
         return table
 
     def _prepare_fast_join(self, other, column_name, column_name_other, rel_tol, abs_tol):
-        assert rel_tol is None or abs_tol is None, ("you are not allowed to provide rel_tol and"
-                                                    " abs_tol at the same time")
-        self.requireColumn(column_name)
-        if column_name_other is None:
-            column_name_other = column_name
-        other.requireColumn(column_name_other)
+        column_names = column_name
+        if isinstance(column_names, basestring):
+            column_names = [column_names]
+        column_names_other = column_name_other
+        if column_names_other is None:
+            column_names_other = column_names
+        elif isinstance(column_names_other, basestring):
+            column_names_other = [column_names_other]
+        n = len(column_names)
+        assert len(column_names_other) == n, "number of column names does not match"
+
+        rel_tols = rel_tol if isinstance(rel_tol, (list, tuple)) else [rel_tol] * n
+        abs_tols = abs_tol if isinstance(abs_tol, (list, tuple)) else [abs_tol] * n
+        assert len(rel_tols) == n and len(abs_tols) == n, "need one tolerance per column"
+        for rel_tol, abs_tol in zip(rel_tols, abs_tols):
+            assert rel_tol is None or abs_tol is None, ("you are not allowed to provide rel_tol "
+                                                        "and abs_tol at the same time")
+        for name in column_names:
+            self.requireColumn(name)
+        for name in column_names_other:
+            other.requireColumn(name)
         table = self._buildJoinTable(other, title=None)
 
-        lookup = other.buildLookup(column_name_other, abs_tol, rel_tol)
-
-        idx = other.getIndex(column_name_other)
-        return table, lookup, idx
+        if n == 1:
+            lookup = other.buildLookup(column_names_other[0], abs_tols[0], rel_tols[0])
+        else:
+            lookup = other.buildLookup(column_names_other, abs_tols, rel_tols)
+        return table, lookup, column_names
 
     def buildLookup(self, column_name, abs_tol, rel_tol):
-        return Lookup(self.getColumn(column_name).values, abs_tol, rel_tol)
+        """builds a lookup for finding exact or approximate matches in the given column.
+
+        ``column_name`` may also be a list of column names, ``abs_tol`` and ``rel_tol`` are
+        then lists with a tolerance or None per column. The result is a
+        :py:class:`~emzed.core.data_types.expressions.MultiDimLookup` in this case.
+        """
+        if isinstance(column_name, basestring):
+            return Lookup(self.getColumn(column_name).values, abs_tol, rel_tol)
+        columns = [self.getColumn(name).values for name in column_name]
+        return MultiDimLookup(columns, abs_tol, rel_tol)
+
+    def _findFastJoinMatches(self, lookup, column_names):
+        columns = [self.getColumn(name).values for name in column_names]
+        if isinstance(lookup, MultiDimLookup):
+            return lookup.find_all(columns)
+        return lookup.find_all(columns[0])
 
     def fastJoin(self, other, column_name, column_name_other=None, rel_tol=None, abs_tol=None):
         """Fast joining for combining tables based on equality of a given column.
@@ -1958,6 +2222,11 @@ class Table(MutableTable):
 
         You can use *rel_tol* or *abs_tol* for approximate matching of numerical values.
 
+        For matching on more than one column you can provide lists of column names. Then
+        *rel_tol* and *abs_tol* can be lists with one tolerance or None per column::
+
+            tn = t.fastJoin(t2, ["mz", "rt"], rel_tol=[5e-6, None], abs_tol=[None, 30])
+
         Remark:
 
         For a more flexible but still fast way to join on exact or approximate matches use
@@ -1966,46 +2235,29 @@ class Table(MutableTable):
             tn = t.join(t2, t.mz.equals(t2.mz, rel_tol=5e-6) & t.rt.equals(t2.rt, abs_tol=30))
 
         """
-        table, lookup, __ = self._prepare_fast_join(other, column_name, column_name_other,
-                                                    rel_tol, abs_tol)
-        idx = self.getIndex(column_name)
-        rows = []
-        cmdlineProgress = _CmdLineProgress(len(self))
-        for ii, row in enumerate(self.rows):
-            if row[idx] is None:
-                continue
-            matches = lookup.find(row[idx])
-            if matches:
-                rows.extend([row[:] + other.rows[i][:] for i in matches])
-            cmdlineProgress.progress(ii)
-        cmdlineProgress.finish()
-        table.rows = rows
-        table.resetInternals()
+        table, lookup, column_names = self._prepare_fast_join(other, column_name,
+                                                              column_name_other, rel_tol,
+                                                              abs_tol)
+        left_indices, right_indices = self._findFastJoinMatches(lookup, column_names)
+        self._fillJoinTable(table, other, left_indices, right_indices)
         return table
 
     def fastLeftJoin(self, other, column_name, column_name_other=None, rel_tol=None, abs_tol=None):
         """Same optimization as fastJoin described above, but performas a fast ``leftJoin``
         instead.
         """
-        table, lookup, __ = self._prepare_fast_join(other, column_name, column_name_other,
-                                                    rel_tol, abs_tol)
-        idx = self.getIndex(column_name)
-        rows = []
-        no = len(other._colNames)
-        cmdlineProgress = _CmdLineProgress(len(self))
-        for ii, row in enumerate(self.rows):
-            if row[idx] is None:
-                rows.append(row[:] + [None] * no)
-                continue
-            matches = lookup.find(row[idx])
-            if matches:
-                rows.extend([row[:] + other.rows[i][:] for i in matches])
-            else:
-                rows.append(row[:] + [None] * no)
-            cmdlineProgress.progress(ii)
-        cmdlineProgress.finish()
-        table.rows = rows
-        table.resetInternals()
+        table, lookup, column_names = self._prepare_fast_join(other, column_name,
+                                                              column_name_other, rel_tol,
+                                                              abs_tol)
+        left_indices, right_indices = self._findFastJoinMatches(lookup, column_names)
+        matched = np.zeros((len(self),), dtype=bool)
+        matched[left_indices] = True
+        unmatched = np.where(~matched)[0]
+        left_indices = np.concatenate((left_indices, unmatched))
+        right_indices = np.concatenate((right_indices, -np.ones_like(unmatched)))
+        # stable sort keeps the order of the matches:
+        order = np.argsort(left_indices, kind="mergesort")
+        self._fillJoinTable(table, other, left_indices[order], right_indices[order])
         return table
 
     def _postfixValues(self):
@@ -2118,21 +2370,22 @@ class Table(MutableTable):
         _p(["------"] * len(ix))
         print >> out
         fms = [self.colFormatters[i] for i in ix]
+        rows = self._rowsWithoutConversion()
         if max_lines is not None and len(self) > max_lines:
             to_print_head = max_lines // 2
             to_print_tail = max_lines - to_print_head
-            for row in self.rows[:to_print_head]:
+            for row in rows[:to_print_head]:
                 ri = [row[i] for i in ix]
                 _p(fmt(value) for (fmt, value) in zip(fms, ri))
                 print >> out
             leave_out = len(self) - to_print_head - to_print_tail
             print >> out,  "... (%d rows) ..." % leave_out
-            for row in self.rows[-to_print_tail:]:
+            for row in rows[-to_print_tail:]:
                 ri = [row[i] for i in ix]
                 _p(fmt(value) for (fmt, value) in zip(fms, ri))
                 print >> out
         else:
-            for row in self.rows:
+            for row in rows:
                 ri = [row[i] for i in ix]
                 _p(fmt(value) for (fmt, value) in zip(fms, ri))
                 print >> out
@@ -2436,8 +2689,8 @@ class Table(MutableTable):
 
     def collapse(self, *col_names, **kw):
         """colapse a table by grouping according to columns ``col_names``. This creates a
-        subtable for every group, but is in "standard" mode not memory efficient if the number
-        of groups is in the range of several thousands. As this method is mostly used for
+        subtable for every group, the subtables share the rows with this table until they are
+        modified. As this method is mostly used for
         preparing a table before visual inspection, the "efficient" mode is available, where
         the sub tables may be inspected, but access to the columns via attribute access is
         not available any more.
@@ -2464,20 +2717,16 @@ class Table(MutableTable):
         master_types = [self.getColType(n) for n in col_names] + [Table]
         master_formats = [self.getColFormat(n) for n in col_names] + ["%r"]
 
-        grouped_rows = collections.OrderedDict()
-        for row in self:
-            key_values = tuple([row[n] for n in col_names])
-            if key_values not in grouped_rows:
-                grouped_rows[key_values] = []
-            grouped_rows[key_values].append(list(row))
-
+        key_columns = [self.getColumn(n).values for n in col_names]
+        groups = self._groups(col_names)
         final_rows = []
-        for key_values, rows in grouped_rows.items():
-            key_values = list(key_values)
+        for indices in groups:
+            key_values = [values[indices[0]] for values in key_columns]
             if efficient:
-                t = TProxy(self, rows)
+                t = TProxy(self, self._rowView(indices))
             else:
-                t = Table._create(self._colNames, self._colTypes, self._colFormats, rows)
+                t = self._subTable(indices, Table._create(self._colNames, self._colTypes,
+                                                          self._colFormats))
             final_rows.append(key_values + [t])
 
         final_rows.sort()
@@ -2532,6 +2781,7 @@ class Table(MutableTable):
         return table_to_separate, table_to_keep
 
     def _resetUniqueId(self):
+        self._fingerprint = None
         if "unique_id" in self.meta:
             del self.meta["unique_id"]
 
@@ -2551,7 +2801,7 @@ class Table(MutableTable):
             update(self._colNames)
             update(self._colTypes)
             update(self._colFormats)
-            for row in self.rows:
+            for row in self._iterRowValues():
                 for val in row:
                     if hasattr(val, "uniqueId"):
                         h.update(val.uniqueId())
@@ -2560,6 +2810,40 @@ class Table(MutableTable):
             self.meta["unique_id"] = h.hexdigest()
         return self.meta["unique_id"]
 
+    def fingerprint(self):
+        """returns digest of column names, types, formats and all cells. this is much faster
+        to compute than :py:meth:`~.uniqueId`, but might change for future emzed versions, so
+        do not store it.
+        """
+        if self._fingerprint is not None:
+            fingerprint, objects = self._fingerprint
+            # peakmaps and spectra might have been modified in place:
+            if all(obj.fingerprint() == fp for (obj, fp) in objects):
+                return fingerprint
+
+        h = new_digest()
+        h.update(cPickle.dumps((self._colNames, self._colTypes, self._colFormats), protocol=2))
+        objects = dict()
+        for ix, type_ in enumerate(self._colTypes):
+            if self._columns is not None:
+                column = self._columns.columns[ix]
+            else:
+                values = [row[ix] for row in self._rowsWithoutConversion()]
+                # same digest as for column wise storage:
+                if type_ in Column._dtypes:
+                    column = Column.from_values(values, type_)
+                else:
+                    column = Column(values)
+            if column.is_typed:
+                update_with_array(h, column.data)
+                update_with_array(h, column.valid)
+                continue
+            for value in update_with_values(h, column.data):
+                if id(value) not in objects:
+                    objects[id(value)] = (value, value.fingerprint())
+        self._fingerprint = (h.hexdigest(), objects.values())
+        return self._fingerprint[0]
+
     def compressPeakMaps(self):
         """
         sometimes duplicate peakmaps occur as different objects in a table, that is: different id()
@@ -2569,23 +2853,28 @@ class Table(MutableTable):
         # simulate set like behaviour. we do not use a Python set as we do not want to
         # overwrite PeakMap.__hash__
         #
-        # PeakMap.uniqueId() *is sensitive for the content of the peakmap* but would slow down
-        # calls of hash(peak_map).
+        # PeakMap.fingerprint() *is sensitive for the content of the peakmap* but would slow
+        # down calls of hash(peak_map).
         peak_maps = dict()
         for row in self.rows:
             for cell in row:
                 if isinstance(cell, PeakMap):
-                    peak_maps[cell.uniqueId()] = cell
+                    peak_maps[cell.fingerprint()] = cell
         for row in self.rows:
             for i, cell in enumerate(row):
                 if isinstance(cell, PeakMap):
-                    row[i] = peak_maps[cell.uniqueId()]
+                    row[i] = peak_maps[cell.fingerprint()]
         self.resetInternals()
 
     def _correct_proxies(self, table_path):
         abs_pathes = dict()
         base_path = os.path.dirname(table_path)
-        for row in self.rows:
+        if self._columns is not None:
+            # typed columns hold no proxies, and we keep the column wise storage:
+            rows = zip(*[c.data for c in self._columns.columns if not c.is_typed])
+        else:
+            rows = self.rows
+        for row in rows:
             for i, cell in enumerate(row):
                 if isinstance(cell, PeakMapProxy):
                     if cell._path.startswith("."):
@@ -2608,7 +2897,7 @@ class Table(MutableTable):
                         else:
                             pickle_path = os.path.abspath(os.path.join(folder, fname))
                         if not os.path.exists(pickle_path):
-                            cell.dump_as_pickle(pickle_path)
+                            write_peakmap_cache(cell, pickle_path)
                         if folder.startswith("."):
                             proxies[id_] = PeakMapProxy(os.path.join(folder, fname), cell.meta)
                         else:
@@ -2807,33 +3096,34 @@ class Table(MutableTable):
 class TProxy(Table):
 
     """memory efficient view to an existing table with some limitations.
-    may be used for creating sub tables in Table.collapse """
+    may be used for creating sub tables in Table.collapse. ``view`` is a
+    :py:class:`~emzed.core.data_types.row_view.RowView` to the rows of ``t``, which are
+    copied when ``rows`` is accessed, as for other sub tables.
+    """
 
-    __slots__ = ["_t", "_rows"]
+    __slots__ = ["_t", "_view"]
 
-    def __init__(self, t, rows):
+    def __init__(self, t, view):
         self._t = t
-        self._rows = rows
-
-    @property
-    def rows(self):
-        return self._rows
+        self._setRowView(view)
 
     def __getattr__(self, name):
         if name in self._t._colNames:
             ix = self._t.getIndex(name)
-            col = ColumnExpression(self._t, name, ix, self._t._colTypes[ix], rows=self._rows)
+            col = ColumnExpression(self._t, name, ix, self._t._colTypes[ix],
+                                   rows=self._rowsWithoutConversion())
             return col
         return getattr(self._t, name)
 
     def __repr__(self):
-        n = len(self.rows)
+        n = len(self)
         return "<TProxy to %#x with %d row%s>" % (id(self._t), n, "" if n == 1 else "s")
 
     def __getstate__(self):
-        return (self._t, self._rows)
+        # same state as older versions, which kept a list of rows:
+        return (self._t, self._rowsWithoutConversion())
 
     def __setstate__(self, data):
-        (self._t, self._rows) = data
+        (self._t, self.rows) = data
 
     __str__ = Table.__str__
@@ -23,9 +23,8 @@ from guiqwt.shapes import RectangleShape
 from guiqwt.signals import (SIG_MOVE, SIG_START_TRACKING, SIG_STOP_NOT_MOVING, SIG_STOP_MOVING,)
 from guiqwt.tools import SelectTool, InteractiveTool
 
-from emzed_optimizations.sample import sample_image
-
-from lru_cache import lru_cache
+from ..data_types.image_pyramid import image_pyramid
+from ..data_types.memory_cache import cached, MB
 from functools import partial
 
 from helpers import protect_signal_handler, set_rt_formatting_on_x_axis
@@ -125,6 +124,9 @@ class PeakMapImageBase(object):
         self.gamma = 1.0
         self.is_log = 1
 
+        # pyramids are computed on first drawing of the given peakmap:
+        self.pyramids = {}
+
     def get_peakmap_bounds(self):
         return self.rtmin, self.rtmax, self.mzmin, self.mzmax
 
@@ -135,8 +137,8 @@ class PeakMapImageBase(object):
         return self.total_imax
 
     def _set(self, field, value):
-        if getattr(self, field) != value:
-            self.compute_image.invalidate_cache()
+        # the cached intensities do not depend on the contrast settings, so we do not
+        # invalidate them here:
         setattr(self, field, value)
 
     def set_imin(self, v):
@@ -151,18 +153,33 @@ class PeakMapImageBase(object):
     def set_logarithmic_scale(self, v):
         self._set("is_log", v)
 
-    @lru_cache(maxsize=100)
+    def _pyramid(self, idx):
+        if idx not in self.pyramids:
+            pm = self.peakmaps[idx]
+            self.pyramids[idx] = image_pyramid(pm, min(pm.getMsLevels()))
+        return self.pyramids[idx]
+
+    @cached("peakmap explorer images", 128 * MB)
+    def sample_intensities(self, idx, NX, NY, rtmin, rtmax, mzmin, mzmax):
+        """NY x NX image of summed up intensities of the dominant ms level of the given
+        peakmap"""
+        data = self._pyramid(idx).sample(rtmin, rtmax, mzmin, mzmax, NX, NY)
+        if data is None:
+            # we zoomed in further than the resolution of the pyramid, so we sample from the
+            # peaks in the visible range:
+            pm = self.peakmaps[idx]
+            data = pm.peakArrays().sample_image(min(pm.getMsLevels()), rtmin, rtmax, mzmin,
+                                                mzmax, NX, NY)
+        return data.astype(np.float32)
+
     def compute_image(self, idx, NX, NY, rtmin, rtmax, mzmin, mzmax):
 
         if rtmin >= rtmax or mzmin >= mzmax:
             dilated = np.zeros((1, 1))
         else:
-            # optimized:
             # one additional row / col as we loose one row and col during smoothing:
-
-            # sample_image only works on level1, therefore we have to use getDominatingPeakmap()
-            pm = self.peakmaps[idx].getDominatingPeakmap()
-            data = sample_image(pm, rtmin, rtmax, mzmin, mzmax, NX + 1, NY + 1)
+            data = self.sample_intensities(idx, int(NX) + 1, int(NY) + 1, rtmin, rtmax, mzmin,
+                                           mzmax).astype(np.float64)
 
             imin = self.imin
             imax = self.imax
@@ -1,10 +1,13 @@
 # -*- coding: utf-8 -*-
 
+import collections
 from datetime import datetime
 import hashlib
 import os
 import re
 
+import numpy as np
+
 from PyQt4.QtGui import *
 from PyQt4.QtCore import *
 
@@ -428,22 +431,29 @@ class TableModel(QAbstractTableModel):
         rtmins = []
         rtmaxs = []
         allrts = []
-        for p in self.table.supportedPostfixes(self.eicColNames()):
-            values = self.table.getValues(self.table.rows[data_row_idx])
+        # we extract the eics of postfixes refering to the same peakmap at once:
+        windows = collections.OrderedDict()
+        values = self.table.getValues(self.table.rows[data_row_idx])
+        for i, p in enumerate(self.table.supportedPostfixes(self.eicColNames())):
             pm = values["peakmap" + p]
             mzmin = values["mzmin" + p]
             mzmax = values["mzmax" + p]
             rtmin = values["rtmin" + p]
             rtmax = values["rtmax" + p]
+            eics.append(([], []))
             if mzmin is None or mzmax is None or rtmin is None or rtmax is None or pm is None:
-                chromo = [], []
-            else:
-                chromo = pm.chromatogram(mzmin, mzmax, rtmin, rtmax)
-                mzmins.append(mzmin)
-                mzmaxs.append(mzmax)
-                rtmins.append(rtmin)
-                rtmaxs.append(rtmax)
-            eics.append(chromo)
+                continue
+            windows.setdefault(id(pm), (pm, []))[1].append((i, (mzmin, mzmax, rtmin, rtmax)))
+            mzmins.append(mzmin)
+            mzmaxs.append(mzmax)
+            rtmins.append(rtmin)
+            rtmaxs.append(rtmax)
+
+        for pm, rows in windows.values():
+            chromos = pm.chromatograms([w for (i, w) in rows])
+            for (i, __), chromo in zip(rows, chromos):
+                eics[i] = chromo
+        for chromo in eics:
             allrts.extend(chromo[0])
         if not mzmins:
             return eics, 0, 0, 0, 0, sorted(allrts)
@@ -513,6 +523,9 @@ class TableModel(QAbstractTableModel):
                 filters = self.last_filters
 
         visible_rows = self.table.findMatchingRows(filters.items())
+        if isinstance(visible_rows, np.ndarray):
+            # hdf5 tables return index arrays, but we need fast "in" checks:
+            visible_rows = set(visible_rows.tolist())
 
         if force_reset or visible_rows != self.visible_rows:
             self.visible_rows = visible_rows
@@ -2,13 +2,11 @@
 from __future__ import print_function
 
 
-import numpy as np
-
 from PyQt4 import QtCore, QtGui
 
 from _filter_criteria_widget import _FilterCriteriaWidget
 
-from ...data_types.hdf5_table_proxy import UfuncWrapper
+from ...data_types.hdf5_table_proxy import RangeFilter
 from ...data_types.col_types import CheckState
 
 from fnmatch import fnmatch
@@ -46,26 +44,10 @@ class _ChooseNumberRange(_ChooseRange):
         pass
 
 
-from functools import partial
-
-
 def ufunc_range_filter(v1, v2):
     if v1 is None and v2 is None:
         return None
-
-    def cond_v1_v2(vec, v1=v1, v2=v2):
-        return np.logical_and(np.greater_equal(v2, vec), np.greater_equal(vec, v1))
-
-    if v2 is None:
-        f = partial(np.less_equal, v1)
-    elif v1 is None:
-        f = partial(np.greater_equal, v2)
-    elif v1 == v2:
-        f = partial(np.equal, v2)
-    else:
-        f = cond_v1_v2
-
-    return UfuncWrapper(f)
+    return RangeFilter(v1, v2)
 
 
 class ChooseFloatRange(_ChooseNumberRange):
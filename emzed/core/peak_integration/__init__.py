@@ -3,6 +3,7 @@ from savitzky_golay import SGIntegrator
 from assymetric_gauss  import AsymmetricGaussIntegrator
 from trapez import TrapezIntegrator, TrapezIntegratorWithBaseline
 from simplified_emg import SimplifiedEMGIntegrator
+from batch_emg import BatchEMGIntegrator
 from no_integration import NoIntegration
 from max_integrator import MaxIntegrator
 from sum_integrator import SumIntegrator
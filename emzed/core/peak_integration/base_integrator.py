@@ -14,6 +14,15 @@ class BaseIntegrator(object):
         self.peakMap = peakMap
 
     def integrate(self, mzmin, mzmax, rtmin, rtmax, msLevel=None):
+        return self.integrateWindows([(mzmin, mzmax, rtmin, rtmax)], msLevel)[0]
+
+    def integrateWindows(self, windows, msLevel=None):
+        """integrates all ``windows``, which is a list of ``(mzmin, mzmax, rtmin, rtmax)``
+        tuples or a n x 4 array. returns a list of dictionaries as :py:meth:`~.integrate`
+        does.
+
+        the chromatograms of all windows are extracted from the peakmap at once.
+        """
 
         assert self.peakMap is not None, "call setPeakMap() before integrate()"
 
@@ -25,18 +34,38 @@ class BaseIntegrator(object):
 
         self.allrts = self.peakMap.get_rts(msLevel)
 
-        rts, chromatogram = self.peakMap.chromatogram(mzmin, mzmax, rtmin, rtmax, msLevel)
-        if len(rts) == 0:
-            return dict(area=0.0, rmse=0.0, params=None, eic=None, baseline=None)
-
-        drt = 2 * (rtmax - rtmin)
-        eic = self.peakMap.chromatogram(mzmin, mzmax, rtmin - drt, rtmax + drt, msLevel)
-        allrts, fullchrom = eic
-
-        area, rmse, params = self.integrator(allrts, fullchrom, rts, chromatogram)
-        baseline = self.getBaseline(rts, params)
-
-        return dict(area=area, rmse=rmse, params=params, eic=eic, baseline=baseline)
+        windows = np.array(windows, dtype=float).reshape(-1, 4)
+        drt = 2 * (windows[:, 3] - windows[:, 2])
+        extended = windows.copy()
+        extended[:, 2] -= drt
+        extended[:, 3] += drt
+        chromatograms = self.peakMap.chromatograms(np.vstack((windows, extended)), msLevel)
+
+        n = len(windows)
+        chromatograms, eics = chromatograms[:n], chromatograms[n:]
+        indices = [i for (i, (rts, __)) in enumerate(chromatograms) if len(rts)]
+        fits = self.integrateChromatograms([chromatograms[i] for i in indices],
+                                           [eics[i] for i in indices])
+
+        results = [dict(area=0.0, rmse=0.0, params=None, eic=None, baseline=None)
+                   for __ in range(n)]
+        for i, (area, rmse, params) in zip(indices, fits):
+            rts, __ = chromatograms[i]
+            baseline = self.getBaseline(rts, params)
+            results[i] = dict(area=area, rmse=rmse, params=params, eic=eics[i],
+                              baseline=baseline)
+        return results
+
+    def integrateChromatograms(self, chromatograms, eics):
+        """``chromatograms`` is a list of tuples ``(rts, intensities)`` of the integration
+        windows, ``eics`` the same for the extended windows. returns a list of tuples
+        ``(area, rmse, params)``.
+
+        calls :py:meth:`~.integrator` for every chromatogram, sub classes may override this
+        method to process all chromatograms at once.
+        """
+        return [self.integrator(allrts, fullchrom, rts, chrom)
+                for ((rts, chrom), (allrts, fullchrom)) in zip(chromatograms, eics)]
 
     @abc.abstractmethod
     def integrator(self, allrts, fullchrom, rts, chrom):
@@ -0,0 +1,188 @@
+from simplified_emg import SimplifiedEMGIntegrator
+import numpy as np
+import math
+
+
+def _levenberg_marquardt(fun, params, x, y, mask, ftol=1.49012e-8, xtol=1.49012e-8,
+                         max_iter=200):
+    """fits ``fun(params, x)`` to ``y`` for many problems at once. ``params`` is a matrix
+    with one row of start parameters per problem, ``x``, ``y`` and ``mask`` are matrices
+    with one row per problem, values where ``mask`` is False are ignored, so problems may
+    have different numbers of data points.
+
+    returns the fitted parameters and an array of status codes, 1 (converged according to
+    ``ftol``), 2 (converged according to ``xtol``) or 5 (no convergence within ``max_iter``
+    iterations), similar to ``scipy.optimize.leastsq``.
+    """
+    params = np.array(params, dtype=float)
+    x = np.asarray(x, dtype=float)
+    y = np.where(mask, y, 0.0)
+    n, n_params = params.shape
+
+    def residuals(p, rows):
+        with np.errstate(all="ignore"):
+            r = np.where(mask[rows], fun(p, x[rows]) - y[rows], 0.0)
+        return r
+
+    def squared_sums(r):
+        s = (r * r).sum(axis=1)
+        s[~np.isfinite(s)] = np.inf
+        return s
+
+    all_rows = np.arange(n)
+    r = residuals(params, all_rows)
+    ssq = squared_sums(r)
+    lambdas = np.zeros((n,)) + 1e-3
+    status = np.zeros((n,), dtype=int)
+    status[ssq == 0.0] = 1
+    # invalid start values:
+    status[~np.isfinite(ssq)] = 5
+
+    eps = math.sqrt(np.finfo(float).eps)
+    for __ in range(max_iter):
+        rows = np.where(status == 0)[0]
+        if not len(rows):
+            break
+        p = params[rows]
+        r = residuals(p, rows)
+        ssq_rows = ssq[rows]
+
+        # jacobian from forward differences, as leastsq does:
+        jacobian = np.zeros((len(rows), x.shape[1], n_params))
+        for j in range(n_params):
+            h = eps * np.abs(p[:, j])
+            h[h == 0.0] = eps
+            p_shifted = p.copy()
+            p_shifted[:, j] += h
+            jacobian[:, :, j] = (residuals(p_shifted, rows) - r) / h[:, None]
+        jacobian[~np.isfinite(jacobian)] = 0.0
+
+        jtj = np.einsum("nki,nkj->nij", jacobian, jacobian)
+        gradient = np.einsum("nki,nk->ni", jacobian, r)
+        diagonal = np.maximum(np.einsum("nii->ni", jtj), 1e-12)
+        lhs = jtj + lambdas[rows][:, None, None] * (diagonal[:, :, None]
+                                                    * np.eye(n_params)[None, :, :])
+        delta = np.linalg.solve(lhs, -gradient[:, :, None])[:, :, 0]
+
+        p_new = p + delta
+        ssq_new = squared_sums(residuals(p_new, rows))
+        improved = ssq_new < ssq_rows
+
+        lambdas_before = lambdas[rows]
+        lambdas[rows] = np.where(improved, lambdas[rows] / 10.0, lambdas[rows] * 10.0)
+        accepted = rows[improved]
+        params[accepted] = p_new[improved]
+        ssq[accepted] = ssq_new[improved]
+
+        # as MINPACK we only stop according to ftol if the actual and the predicted
+        # reduction are small and the linear model predicts the actual reduction well, else
+        # a step which by chance reduced the sum of squares only a little would stop the fit:
+        jdelta = np.einsum("nki,ni->nk", jacobian, delta)
+        predicted = ((jdelta * jdelta).sum(axis=1)
+                     + 2.0 * lambdas_before * (diagonal * delta * delta).sum(axis=1))[improved]
+        reduction = (ssq_rows - ssq_new)[improved]
+        converged_f = ((reduction <= ftol * ssq_rows[improved])
+                       & (predicted <= ftol * ssq_rows[improved])
+                       & (reduction <= 2.0 * predicted))
+        step = np.sqrt((delta * delta).sum(axis=1))[improved]
+        converged_x = step <= xtol * np.sqrt((p_new * p_new).sum(axis=1))[improved]
+        status[accepted[converged_x]] = 2
+        status[accepted[converged_f]] = 1
+        status[accepted[ssq_new[improved] == 0.0]] = 1
+
+        # no improvement possible any more, the parameters are optimal within the
+        # numerical precision:
+        status[rows[~improved & (lambdas[rows] > 1e16)]] = 2
+
+    status[status == 0] = 5
+    return params, status
+
+
+class BatchEMGIntegrator(SimplifiedEMGIntegrator):
+
+    """same model as :py:class:`~.SimplifiedEMGIntegrator`, but fits all chromatograms passed
+    to :py:meth:`~.integrateWindows` at once with a vectorized Levenberg-Marquardt algorithm
+    instead of calling ``scipy.optimize.leastsq`` per chromatogram.
+    """
+
+    def __str__(self):
+        info = "default" if self.xtol is None else "%.2e" % self.xtol
+        return "BatchEMGIntegrator, xtol=%s" % info
+
+    @staticmethod
+    def _fun_eval_batch(params, rts, sqrt_two_pi=math.sqrt(math.pi), sqrt_2=math.sqrt(2.0)):
+        h, z, w, s = [p[:, None] for p in params[:, :4].T]
+        # avoid zero division
+        s = np.where(s * s == 0.0, 1e-6, s)
+        inner = w * w / 2.0 / s / s - (rts - z) / s
+        # avoid overflow
+        inner = np.minimum(inner, 200)
+        nominator = np.exp(inner)
+        # avoid zero division
+        w = np.where(w == 0, 1e-6, w)
+        denominator = 1 + np.exp(-2.4055 / sqrt_2 * ((rts - z) / w - w / s))
+        return h * w / s * sqrt_two_pi * nominator / denominator
+
+    @staticmethod
+    def _fun_eval_baseline_batch(params, rts):
+        return BatchEMGIntegrator._fun_eval_batch(params, rts) + params[:, 4:5]
+
+    def _fit(self, fun, params, rts, intensities, mask):
+        if self.xtol is None:
+            return _levenberg_marquardt(fun, params, rts, intensities, mask, ftol=0.005)
+        return _levenberg_marquardt(fun, params, rts, intensities, mask, xtol=self.xtol)
+
+    def integrateChromatograms(self, chromatograms, eics):
+
+        needed_data = 5 if self.fit_baseline else 4
+        results = [None] * len(chromatograms)
+        fit_indices = []
+        for i, (rts, chromatogram) in enumerate(chromatograms):
+            if len(rts) < needed_data:
+                allrts, fullchrom = eics[i]
+                results[i] = self.integrator(allrts, fullchrom, rts, chromatogram)
+            else:
+                fit_indices.append(i)
+
+        if not fit_indices:
+            return results
+
+        # padded matrices, one row per chromatogram:
+        sizes = np.array([len(chromatograms[i][0]) for i in fit_indices])
+        mask = np.arange(sizes.max())[None, :] < sizes[:, None]
+        rts = np.zeros(mask.shape)
+        intensities = np.zeros(mask.shape)
+        rts[mask] = np.hstack([chromatograms[i][0] for i in fit_indices])
+        intensities[mask] = np.hstack([chromatograms[i][1] for i in fit_indices])
+        # padded values shall not cause overflows:
+        last_rts = rts[np.arange(len(sizes)), sizes - 1]
+        rts = np.where(mask, rts, last_rts[:, None])
+
+        imax = np.argmax(np.where(mask, intensities, -np.inf), axis=1)
+        rows = np.arange(len(sizes))
+        start = np.zeros((len(sizes), 4))
+        start[:, 0] = intensities[rows, imax] * 2
+        start[:, 1] = rts[rows, imax]
+        start[:, 2] = 0.2
+        start[:, 3] = 0.3
+
+        params, ok = self._fit(BatchEMGIntegrator._fun_eval_batch, start, rts, intensities,
+                               mask)
+
+        fitted_baseline = np.zeros((len(sizes),), dtype=bool)
+        if self.fit_baseline:
+            start_bl = np.hstack((params, params[:, :1] / 2.0))
+            params_bl, ok_bl = self._fit(BatchEMGIntegrator._fun_eval_baseline_batch,
+                                         start_bl, rts, intensities, mask)
+            fitted_baseline = params_bl[:, 4] >= 0
+
+        for j, i in enumerate(fit_indices):
+            rts, chromatogram = chromatograms[i]
+            allrts, __ = eics[i]
+            if fitted_baseline[j]:
+                param, status = params_bl[j], ok_bl[j]
+            else:
+                param, status = params[j], ok[j]
+            results[i] = self._evaluate_fit(allrts, np.array(rts), chromatogram, param, status,
+                                            fitted_baseline[j])
+        return results
@@ -11,6 +11,9 @@ class NoIntegration(base_integrator.BaseIntegrator):
     def integrate(self, *a, **kw):
         return dict(area=None, rmse=None, params=None, eic=None, baseline=None)
 
+    def integrateWindows(self, windows, *a, **kw):
+        return [self.integrate() for __ in windows]
+
     def getSmoothed(self, *a, **kw):
         """has to be implemented"""
         return [], []
@@ -65,7 +65,6 @@ class SimplifiedEMGIntegrator(BaseIntegrator):
 
         param = (h, z, w, s)
         err = SimplifiedEMGIntegrator._err
-        fun = SimplifiedEMGIntegrator._fun_eval
 
         # we use usual emg model as start model if fit with baseline is requested.
 
@@ -88,9 +87,15 @@ class SimplifiedEMGIntegrator(BaseIntegrator):
             if beta >= 0 and ok_bl:  # success:
                 param = param_bl
                 ok = ok_bl
-                fun = SimplifiedEMGIntegrator._fun_eval_baseline
                 fitted_baseline = True
 
+        return self._evaluate_fit(allrts, rts, chromatogram, param, ok, fitted_baseline)
+
+    def _evaluate_fit(self, allrts, rts, chromatogram, param, ok, fitted_baseline):
+        if fitted_baseline:
+            fun = SimplifiedEMGIntegrator._fun_eval_baseline
+        else:
+            fun = SimplifiedEMGIntegrator._fun_eval
         w = param[1]
         if ok not in [1, 2, 3, 4] or w <= 0:  # failed
             area = 0.0
@@ -4,11 +4,15 @@
 from utils import _prepare_path
 
 
-def loadPeakMap(path=None):
+def loadPeakMap(path=None, rtmin=None, rtmax=None, mzmin=None, mzmax=None, imin=None,
+                mslevelmin=None, mslevelmax=None):
     """ loads mzXML, mzML and mzData files
 
         If *path* is missing, a dialog for file selection is opened
         instead.
+
+        Only spectra and peaks within the given limits are loaded, for
+        example ``loadPeakMap(path, rtmin=300, rtmax=600, mslevelmax=1)``.
     """
 
     # local import in order to keep namespaces clean
@@ -18,7 +22,7 @@ def loadPeakMap(path=None):
     if path is None:
         return None
 
-    return PeakMap.load(path)
+    return PeakMap.load(path, rtmin, rtmax, mzmin, mzmax, imin, mslevelmin, mslevelmax)
 
 
 def loadTable(path=None, compress_after_load=True):
@@ -1,11 +1,21 @@
 # encoding: utf-8
 
-import sys
+import collections
 import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+
+
+# number of rows we pass to the integrator at once:
+_BATCH_SIZE = 1000
+
+_RESULT_NAMES = ("area", "rmse", "params", "eic", "baseline")
 
 
 def integrate(ftable, integratorid="std", msLevel=None, showProgress=True, n_cpus=-1,
-              min_size_for_parallel_execution=500, post_fixes=None):
+              min_size_for_parallel_execution=500, post_fixes=None, chunk_size=100):
     """ integrates features  in ftable.
         returns processed table. ``ftable`` is not changed inplace.
 
@@ -16,6 +26,9 @@ def integrate(ftable, integratorid="std", msLevel=None, showProgress=True, n_cpu
             n_cpus = 0 means "use all cpu cores"
             n_cpus = -1 means "use all but one cpu cores", etc
 
+        for n_cpus > 1 the rows are processed in chunks of ``chunk_size`` rows, every
+        worker process fetches the next chunk when it finished the previous one.
+
     """
 
     needed_columns = ["mzmin", "mzmax", "rtmin", "rtmax", "peakmap"]
@@ -36,16 +49,16 @@ def integrate(ftable, integratorid="std", msLevel=None, showProgress=True, n_cpu
     if sys.platform == "win32":
         # if subprocesses use python.exe a console window pops up for each
         # subprocess. this is quite ugly..
-        import os.path
         multiprocessing.set_executable(os.path.join(
                                        os.path.dirname(sys.executable),
                                        "pythonw.exe")
                                        )
     import time
-    from ..core.data_types import Table
 
     started = time.time()
 
+    assert chunk_size > 0, "chunk_size must be positive"
+
     messages, n_cpus = check_num_cpus(n_cpus, len(ftable), min_size_for_parallel_execution)
 
     if showProgress:
@@ -58,34 +71,8 @@ def integrate(ftable, integratorid="std", msLevel=None, showProgress=True, n_cpu
     if n_cpus == 1:
         __, result = _integrate((0, ftable, post_fixes, integratorid, msLevel, showProgress,))
     else:
-        pool = multiprocessing.Pool(n_cpus)
-        args = []
-        all_pms = []
-        for i in range(n_cpus):
-            partial = ftable[i::n_cpus]
-            show_progress = (i == 0)  # only first process prints progress status
-            args.append(
-                (i, partial, post_fixes, integratorid, msLevel, show_progress))
-            all_pms.append(partial.peakmap.values)
-
-        # map_async() avoids bug of map() when trying to stop jobs using ^C
-        results = pool.map_async(_integrate, args).get()
-
-        results.sort()  # sorts by first entry which is the index of the partial table
-        tables = [t for (i, t) in results]
-
-        # as peakmaps are serialized/unserialized for paralell execution, lots of duplicate
-        # peakmaps come back after. we reset those columns to their state before spreading
-        # them:
-        for t, pms in zip(tables, all_pms):
-            t.replaceColumn("peakmap", pms, type_=ftable.getColType("peakmap"),
-                            format_=ftable.getColFormat("peakmap"))
-
-        # at least needed on win, else worker processes accumulate:
-        pool.close()
-
-        tables = [t for t in tables if len(t) > 0]
-        result = Table.stackTables(tables)
+        result = _integrate_parallel(ftable, post_fixes, integratorid, msLevel, showProgress,
+                                     n_cpus, chunk_size)
 
     if showProgress:
         needed = time.time() - started
@@ -99,58 +86,184 @@ def integrate(ftable, integratorid="std", msLevel=None, showProgress=True, n_cpu
     return result
 
 
-def _integrate((idx, ftable, supportedPostfixes, integratorid, msLevel, showProgress)):
+def _get_integrator(integratorid):
     from ..algorithm_configs import peakIntegrators
-    import sys
-
     integrator = dict(peakIntegrators).get(integratorid)
     if integrator is None:
         raise Exception("unknown integrator '%s'" % integratorid)
+    return integrator
 
-    resultTable = ftable.copy()
 
-    lastcent = -1
-    for postfix in supportedPostfixes:
-        areas = []
-        rmses = []
-        peak_shape_params = []
-        eics = []
-        baselines = []
-        for i, row in enumerate(ftable.rows):
+def _collect_windows(ftable, postfix):
+    """returns dictionary mapping id(peakmap) to tuples (peakmap, row_indices, windows), the
+    windows are tuples (mzmin, mzmax, rtmin, rtmax). rows with missing values are skipped.
+    """
+    windows = collections.OrderedDict()
+    for i, row in enumerate(ftable.rows):
+        rtmin = ftable.getValue(row, "rtmin" + postfix)
+        rtmax = ftable.getValue(row, "rtmax" + postfix)
+        mzmin = ftable.getValue(row, "mzmin" + postfix)
+        mzmax = ftable.getValue(row, "mzmax" + postfix)
+        peakmap = ftable.getValue(row, "peakmap" + postfix)
+        if rtmin is None or rtmax is None or mzmin is None or mzmax is None\
+                or peakmap is None:
+            continue
+        __, row_indices, row_windows = windows.setdefault(id(peakmap), (peakmap, [], []))
+        row_indices.append(i)
+        row_windows.append((mzmin, mzmax, rtmin, rtmax))
+    return windows
+
+
+class _Progress(object):
+
+    def __init__(self, n):
+        self.n = max(n, 1)
+        self.done = 0
+        self.lastcent = -1
+
+    def update(self, n_done):
+        self.done += n_done
+        # integer div here !
+        cent = (self.done * 20) / self.n
+        if cent != self.lastcent:
+            print cent * 5,
+            try:
+                sys.stdout.flush()
+            except IOError:
+                # migh t happen on win cmd console
+                pass
+            self.lastcent = cent
+
+
+def _integrate((idx, ftable, supportedPostfixes, integratorid, msLevel, showProgress)):
+
+    integrator = _get_integrator(integratorid)
+
+    collected = [(postfix, _collect_windows(ftable, postfix)) for postfix in supportedPostfixes]
+    progress = _Progress(sum(len(w) for (__, pm_windows) in collected
+                             for (__, __, w) in pm_windows.values()))
+    results = dict()
+    for postfix, pm_windows in collected:
+        n = len(ftable)
+        columns = [[None] * n for __ in _RESULT_NAMES]
+        for peakmap, row_indices, windows in pm_windows.values():
+            integrator.setPeakMap(peakmap)
+            for start in range(0, len(windows), _BATCH_SIZE):
+                batch = windows[start:start + _BATCH_SIZE]
+                for i, result in zip(row_indices[start:start + _BATCH_SIZE],
+                                     integrator.integrateWindows(batch, msLevel)):
+                    for column, name in zip(columns, _RESULT_NAMES):
+                        column[i] = result[name]
+                if showProgress:
+                    progress.update(len(batch))
+        results[postfix] = columns
+
+    return idx, _create_result_table(ftable, supportedPostfixes, integratorid, results)
+
+
+# worker processes keep the memory mapped peakmaps, keys are paths:
+_attached_peakmaps = dict()
+
+
+def _integrate_windows((task_index, path, windows, integratorid, msLevel)):
+    from ..core.data_types import PeakMap
+    from ..core.data_types.peak_arrays import PeakArrays
+
+    try:
+        peakmap = _attached_peakmaps.get(path)
+        if peakmap is None:
+            # read only memory mapping, so the operating system shares the data among all
+            # workers and no pickling is needed:
+            arrays = PeakArrays.load(path, mmap_mode="r")
+            peakmap = PeakMap._fromNormalizedArrays(arrays)
+            _attached_peakmaps[path] = peakmap
+        return task_index, _integrate_chunk(peakmap, windows, integratorid, msLevel), None
+    except Exception:
+        # we report the problem instead of raising it, else imap_unordered would not tell
+        # us which chunk failed:
+        import traceback
+        return task_index, None, traceback.format_exc()
+
+
+def _integrate_chunk(peakmap, windows, integratorid, msLevel):
+    integrator = _get_integrator(integratorid)
+    integrator.setPeakMap(peakmap)
+    results = integrator.integrateWindows(windows, msLevel)
+    return [[result[name] for result in results] for name in _RESULT_NAMES]
+
+
+def _integrate_parallel(ftable, supportedPostfixes, integratorid, msLevel, showProgress,
+                        n_cpus, chunk_size):
+    """writes the peaks of every peakmap once to memory mapped files and sends only the
+    windows to the worker processes. the windows are split into chunks of ``chunk_size``
+    rows which are handed out to the next idle worker, so a few expensive rows do not
+    delay the other workers."""
+    import numpy as np
+
+    folder = tempfile.mkdtemp(prefix="emzed_integrate_")
+    pool = multiprocessing.Pool(n_cpus)
+    try:
+        paths = dict()
+        tasks = []
+        for postfix in supportedPostfixes:
+            windows = _collect_windows(ftable, postfix)
+            for key, (peakmap, row_indices, pm_windows) in windows.items():
+                if key not in paths:
+                    paths[key] = os.path.join(folder, str(len(paths)))
+                    peakmap.peakArrays().save(paths[key])
+                for start in range(0, len(row_indices), chunk_size):
+                    chunk = np.array(pm_windows[start:start + chunk_size], dtype=float)
+                    tasks.append((postfix, peakmap, row_indices[start:start + chunk_size],
+                                  (len(tasks), paths[key], chunk, integratorid, msLevel)))
+
+        n = len(ftable)
+        results = dict((postfix, [[None] * n for __ in _RESULT_NAMES])
+                       for postfix in supportedPostfixes)
+
+        def merge(task_index, worker_columns):
+            postfix, __, indices, __ = tasks[task_index]
+            for column, values in zip(results[postfix], worker_columns):
+                for i, value in zip(indices, values):
+                    column[i] = value
             if showProgress:
-                # integer div here !
-                cent = ((i + 1) * 20) / len(ftable) / len(supportedPostfixes)
-                if cent != lastcent:
-                    print cent * 5,
-                    try:
-                        sys.stdout.flush()
-                    except IOError:
-                        # migh t happen on win cmd console
-                        pass
-                    lastcent = cent
-            rtmin = ftable.getValue(row, "rtmin" + postfix)
-            rtmax = ftable.getValue(row, "rtmax" + postfix)
-            mzmin = ftable.getValue(row, "mzmin" + postfix)
-            mzmax = ftable.getValue(row, "mzmax" + postfix)
-            peakmap = ftable.getValue(row, "peakmap" + postfix)
-            if rtmin is None or rtmax is None or mzmin is None or mzmax is None\
-                    or peakmap is None:
-                area = rmse = params = eic = baseline = None
+                progress.update(len(indices))
+
+        progress = _Progress(sum(len(indices) for (__, __, indices, __) in tasks))
+        failed = []
+        chunk_results = pool.imap_unordered(_integrate_windows,
+                                            [args for (__, __, __, args) in tasks])
+        for __ in range(len(tasks)):
+            # next() with timeout avoids bug when trying to stop jobs using ^C
+            task_index, worker_columns, error = chunk_results.next(2 ** 31)
+            if error is not None:
+                failed.append((task_index, error))
             else:
-                integrator.setPeakMap(peakmap)
-                result = integrator.integrate(mzmin, mzmax, rtmin, rtmax, msLevel)
-                # take existing values which are not integration realated:
-                area = result["area"]
-                rmse = result["rmse"]
-                params = result["params"]
-                eic = result["eic"]
-                baseline = result["baseline"]
-
-            areas.append(area)
-            rmses.append(rmse)
-            peak_shape_params.append(params)
-            eics.append(eic)
-            baselines.append(baseline)
+                merge(task_index, worker_columns)
+
+        # at least needed on win, else worker processes accumulate:
+        pool.close()
+        pool.join()
+    finally:
+        pool.terminate()
+        shutil.rmtree(folder, ignore_errors=True)
+
+    # we keep the results of the other chunks and retry the failed ones here, so a real
+    # problem raises with a meaningful traceback:
+    for task_index, error in sorted(failed):
+        print
+        print "WARNING: integration in worker process failed, retry in main process:"
+        print error
+        __, peakmap, __, (__, __, windows, __, __) = tasks[task_index]
+        merge(task_index, _integrate_chunk(peakmap, windows, integratorid, msLevel))
+
+    return _create_result_table(ftable, supportedPostfixes, integratorid, results)
+
+
+def _create_result_table(ftable, supportedPostfixes, integratorid, results):
+    resultTable = ftable.copy()
+
+    for postfix in supportedPostfixes:
+        areas, rmses, peak_shape_params, eics, baselines = results[postfix]
 
         resultTable._updateColumnWithoutNameCheck("method" + postfix,
                                                   integratorid, str, "%s",
@@ -174,7 +287,7 @@ def _integrate((idx, ftable, supportedPostfixes, integratorid, msLevel, showProg
     resultTable.meta["integrated"] = True, "\n"
     resultTable.title = "integrated: " + (resultTable.title or "")
     resultTable.resetInternals()
-    return idx, resultTable
+    return resultTable
 
 
 def check_num_cpus(n_cpus, table_size, min_table_size):
@@ -0,0 +1,57 @@
+import glob
+import os
+import time
+
+from emzed.core.batch_runner import BatchRunner
+
+
+class _Counter(BatchRunner):
+
+    def setup(self, config):
+        self.factor = config["factor"]
+
+    def process(self, path):
+        with open(path) as fp:
+            content = fp.read()
+        if content == "fail":
+            raise Exception("invalid content")
+        return int(content) * self.factor
+
+    def outputPath(self, destinationDir, path):
+        return os.path.join(destinationDir, os.path.basename(path) + ".out")
+
+    def write(self, result, destinationDir, path):
+        with open(self.outputPath(destinationDir, path), "w") as fp:
+            fp.write(str(result))
+
+
+def test_batch_runner(tmpdir):
+    folder = tmpdir.join("inputs").strpath
+    os.makedirs(folder)
+    for i in range(10):
+        with open(os.path.join(folder, "%02d.txt" % i), "w") as fp:
+            fp.write("fail" if i == 3 else str(i))
+
+    destination = tmpdir.join("outputs").strpath
+    pattern = os.path.join(folder, "*.txt")
+    config = [("std", "", dict(factor=2))]
+
+    for n_workers in (1, 3):
+        runner = _Counter(config, collectResults=True)
+        results = runner.run(pattern, destination, "std", n_workers=n_workers)
+        # the failing input does not stop the batch:
+        assert sorted(results) == [2 * i for i in range(10) if i != 3]
+        assert len(os.listdir(destination)) == 9
+
+    # results are ordered like the inputs, which come from glob:
+    results = _Counter(config, True).run(pattern, destination, "std", n_workers=3, factor=1)
+    expected = [os.path.basename(p) for p in glob.glob(pattern)]
+    assert results == [int(name[:2]) for name in expected if name != "03.txt"]
+
+    # only the failed input and the modified input are processed again:
+    time.sleep(1.1)
+    with open(os.path.join(folder, "05.txt"), "w") as fp:
+        fp.write("50")
+    results = _Counter(config, True).run(pattern, destination, "std", n_workers=2,
+                                         skip_existing=True, factor=1)
+    assert results == [50]
@@ -1,4 +1,5 @@
-from emzed.core.data_types import PeakMap, Spectrum
+from emzed.core.data_types import PeakMap, Spectrum, Table
+from emzed.core.data_types.peak_arrays import PeakArrays
 from pyopenms import (FileHandler, Precursor, MSExperiment,
                       InstrumentSettings, IonSource)
 import numpy as np
@@ -318,3 +319,197 @@ class TestMSTypes(object):
         assert spec_new.polarity == spec.polarity
         assert np.linalg.norm(spec_new.peaks - spec.peaks) == 0.0
 
+    def test_fingerprints(self):
+        mzs = np.array([ 0.0, 1.0, 2.0, 3.0, 4.0, 5.0 ]).reshape(-1,1)
+        peaks = np.hstack((mzs, np.ones_like(mzs)))
+        spec = Spectrum(peaks, 0.0, 1, "0")
+        pm = PeakMap([spec, Spectrum(peaks, 1.0, 1, "0")])
+
+        def check(fun):
+            spec = pm.spectra[0]
+            before = spec.fingerprint(), pm.fingerprint()
+            exec(fun, dict(spec=spec, pm=pm))
+            after = spec.fingerprint(), pm.fingerprint()
+            assert before[0] != after[0]
+            assert before[1] != after[1]
+
+        check("spec.peaks[:, 0] += 1")
+        check("spec.peaks *= 2")
+        check("spec.rt += 0.5")
+        check("spec.msLevel += 1")
+        check("spec.precursors = [(1, 1, 0)]")
+        check("spec.polarity = '+'")
+
+        from cPickle import loads, dumps
+        from emzed.core.data_types.fingerprint import fingerprint
+
+        back = loads(dumps(pm))
+        assert back.fingerprint() == pm.fingerprint()
+        assert fingerprint(back) == pm.fingerprint()
+        back.spectra[1].peaks[0, 1] = 2.0
+        assert back.fingerprint() != pm.fingerprint()
+
+        t = Table(["id", "pm"], [int, object], ["%d", None], [[1, pm], [2, back], [None, pm]])
+        before = t.fingerprint()
+        assert before == t.copy().fingerprint()
+        t.useColumnarStorage()
+        assert before == t.fingerprint()
+        back.spectra[1].rt = 2.0
+        assert before != t.fingerprint()
+
+    def test_peak_arrays(self, tmpdir):
+        mzs = np.array([0.0, 1.0, 2.0, 3.0, 4.0, 5.0]).reshape(-1, 1)
+        peaks = np.hstack((mzs, np.ones_like(mzs)))
+        spectra = [Spectrum(peaks, 0.0, 1, "0"),
+                   Spectrum(peaks[:3], 1.0, 1, "0"),
+                   Spectrum(peaks, 1.5, 2, "0"),
+                   Spectrum(peaks[2:], 2.0, 1, "0")]
+        pm = PeakMap(spectra)
+
+        arrays = pm.peakArrays()
+        assert arrays.offsets.tolist() == [0, 6, 9, 15, 19]
+        assert arrays.rts.tolist() == [0.0, 1.0, 1.5, 2.0]
+        assert np.all(pm.spectra[1].peaks == peaks[:3])
+        # spectra are views to the arrays now:
+        assert np.may_share_memory(pm.spectra[1].peaks, arrays.peaks)
+
+        rts, iis = pm.chromatogram(1.0, 2.5, 0.5, 2.0)
+        assert rts.tolist() == [1.0, 2.0]
+        assert iis.tolist() == [2.0, 1.0]
+
+        windows = [(1.0, 2.5, 0.5, 2.0), (4.5, 10.0, None, None), (3.0, 4.0, 2.0, 1.0)]
+        chromatograms = pm.chromatograms(windows)
+        assert [(rts.tolist(), iis.tolist()) for (rts, iis) in chromatograms] == \
+            [([1.0, 2.0], [2.0, 1.0]), ([0.0, 1.0, 2.0], [1.0, 0.0, 1.0]), ([], [])]
+        assert pm.msNPeaks(1, 0.0, 1.0).shape == (9, 2)
+        assert pm.levelNSpecsInRange(2, 0.0, 2.0) == [spectra[2]]
+
+        # modifying spectra updates the arrays:
+        pm.spectra[1].peaks[:, 1] *= 2
+        pm.spectra[3].rt = 3.0
+        rts, iis = pm.chromatogram(1.0, 2.5)
+        assert rts.tolist() == [0.0, 1.0, 3.0]
+        assert iis.tolist() == [2.0, 4.0, 1.0]
+
+        # memory mapped arrays:
+        folder = tmpdir.join("arrays").strpath
+        pm.peakArrays().save(folder)
+        arrays = PeakArrays.load(folder, mmap_mode="r")
+        assert not arrays.peaks.flags.writeable
+        assert np.all(arrays.peaks == pm.peakArrays().peaks)
+
+        # peakmap without spectra objects:
+        pm2 = PeakMap.fromPeakArrays(arrays)
+        assert pm2._spectra is None
+        assert len(pm2) == 4
+        assert pm2.getMsLevels() == [1, 2]
+        assert pm2.spectra == pm.spectra
+        assert copy.deepcopy(pm2).uniqueId() == pm.uniqueId()
+
+    def test_extract_does_not_share_peaks(self):
+        mzs = np.array([0.0, 1.0, 2.0, 3.0, 4.0, 5.0]).reshape(-1, 1)
+        peaks = np.hstack((mzs, np.ones_like(mzs)))
+        spectra = [Spectrum(peaks, rt, 1, "0") for rt in (0.0, 1.0, 2.0, 3.0)]
+        pm = PeakMap(spectra)
+
+        pm2 = pm.extract(rtmin=1.0, rtmax=2.5, mzmin=2.0, mzmax=3.0)
+        assert pm2.allRts() == [1.0, 2.0]
+        assert pm2.spectra[0].peaks.tolist() == [[2.0, 1.0], [3.0, 1.0]]
+
+        pm2.spectra[0].peaks[:, 1] = 7.0
+        assert pm.spectra[1].peaks[:, 1].tolist() == [1.0] * 6
+
+        pm3 = pm.filter(lambda s: s.rt >= 3.0).getDominatingPeakmap()
+        assert pm3.allRts() == [3.0]
+        assert pm3.spectra[0] == spectra[3]
+
+        # metas are copied as deep as before:
+        spectra[1].meta["source"] = ["a"]
+        pm4 = pm.extract(rtmin=1.0)
+        pm4.spectra[0].meta["source"].append("b")
+        assert spectra[1].meta["source"] == ["a"]
+
+    def test_modifications_are_tracked_per_peakmap(self):
+        mzs = np.array([0.0, 1.0, 2.0, 3.0]).reshape(-1, 1)
+        peaks = np.hstack((mzs, np.ones_like(mzs)))
+        pm = PeakMap([Spectrum(peaks, rt, 1, "0") for rt in (0.0, 1.0)])
+        other = PeakMap([Spectrum(peaks, rt, 1, "0") for rt in (0.0, 1.0)])
+        arrays = other.peakArrays()
+        other.fingerprint()
+
+        pm.spectra[0].peaks *= 2
+        assert other.peakArrays() is arrays
+        assert other._fingerprint[1] == other._modifications
+
+        # spectra shared by two peakmaps notify both:
+        shared = PeakMap(other.spectra)
+        shared.peakArrays()
+        other.spectra[0].rt = 0.5
+        assert other.peakArrays() is not arrays
+        assert shared.peakArrays().rts.tolist() == [0.5, 1.0]
+
+        # spectra of peakmaps created from arrays are sorted by rt:
+        arrays = PeakArrays(np.vstack((peaks, peaks)), [0, 4, 8], [2.0, 1.0], [1, 1], ["0", "0"])
+        assert PeakMap._fromNormalizedArrays(arrays).allRts() == [1.0, 2.0]
+
+    def test_image_pyramid(self, tmpdir):
+        from emzed.core.data_types.image_pyramid import ImagePyramid
+
+        np.random.seed(42)
+        spectra = []
+        for i in range(40):
+            peaks = np.random.random((30, 2)) * (100.0, 1000.0) + (100.0, 1.0)
+            peaks = peaks[np.argsort(peaks[:, 0])]
+            spectra.append(Spectrum(peaks, 10.0 * i, 1 + (i % 4 == 3), "+"))
+        arrays = PeakMap(spectra).peakArrays()
+
+        pyramid = ImagePyramid.from_peak_arrays(arrays, 1, rt_bins=16, mz_bins=32)
+        assert [s.shape for s in pyramid.sums] == [(32, 16), (16, 8), (8, 4), (4, 2), (2, 1),
+                                                   (1, 1)]
+        total = arrays.intensities[arrays.peak_indices(arrays.select(1))].sum()
+        assert abs(pyramid.sums[-1][0, 0] - total) < 1e-3 * total
+
+        box = (pyramid.rtmin, pyramid.rtmax, pyramid.mzmin, pyramid.mzmax)
+        for nx, ny in ((16, 32), (8, 16), (4, 8)):
+            image = pyramid.sample(*(box + (nx, ny)))
+            expected = arrays.sample_image(1, *(box + (nx, ny)))
+            assert image.shape == (ny, nx)
+            assert np.allclose(image, expected, rtol=1e-5)
+
+        # bins overlapping two pixels are split among them:
+        assert pyramid.sample(*(box + (3, 5))).shape == (5, 3)
+        assert abs(pyramid.sample(*(box + (3, 5))).sum() - total) < 1e-3 * total
+
+        image = pyramid.sample(*(box + (4, 8)))
+        maxs = pyramid.sample(*(box + (4, 8)), how="max")
+        assert np.all(maxs <= image + 1e-3)
+        assert abs(maxs.max() - arrays.intensities[arrays.peak_indices(arrays.select(1))].max()
+                   ) < 1e-3
+
+        # pixels smaller than the finest bins:
+        assert pyramid.sample(0.0, 10.0, 100.0, 101.0, 100, 100) is None
+
+        path = tmpdir.join("pyramid.npz").strpath
+        pyramid.save(path)
+        loaded = ImagePyramid.load(path)
+        assert loaded.rtmin == pyramid.rtmin and loaded.mzmax == pyramid.mzmax
+        assert all(np.all(s0 == s1) for s0, s1 in zip(loaded.sums, pyramid.sums))
+        assert all(np.all(m0 == m1) for m0, m1 in zip(loaded.maxs, pyramid.maxs))
+
+    def test_image_pyramid_non_aligned_pixels(self):
+        from emzed.core.data_types.image_pyramid import ImagePyramid
+
+        # one peak with intensity 1 in every bin of the finest level:
+        n_rt, n_mz = 1024, 512
+        peaks = np.ones((n_rt * n_mz, 2))
+        peaks[:, 0] = np.tile(np.arange(n_mz, dtype=float), n_rt)
+        arrays = PeakArrays(peaks, np.arange(n_rt + 1) * n_mz, np.arange(n_rt, dtype=float),
+                            [1] * n_rt, ["0"] * n_rt)
+        pyramid = ImagePyramid.from_peak_arrays(arrays, 1, rt_bins=n_rt, mz_bins=n_mz)
+
+        # all pixels cover the same area, so there must be no bands:
+        box = (pyramid.rtmin, pyramid.rtmax, pyramid.mzmin, pyramid.mzmax)
+        for nx, ny in ((700, 500), (300, 70), (33, 17)):
+            image = pyramid.sample(*(box + (nx, ny)))
+            assert np.allclose(image, n_rt * n_mz / float(nx * ny), rtol=1e-4)
+            assert np.all(pyramid.sample(*(box + (nx, ny)), how="max") == 1.0)
@@ -103,3 +103,53 @@ def test_logical_with_Nones_2():
     assert t.none_and_a.values == t.a_and_none.values
     assert t.none_or_a.values == t.a_or_none.values
     assert t.none_xor_a.values == t.a_xor_none.values
+
+
+def test_compiled_expressions():
+    from emzed.core.data_types.expression_compiler import compile_expression
+    t = emzed.utils.toTable("mz", [100.0, None, 200.0, 300.0, 250.0], type_=float)
+    t.addColumn("rt", [10.0, 20.0, None, 30.0, 40.0], type_=float)
+    t.addColumn("z", [1, 0, 2, None, 0], type_=int)
+    t.addColumn("b", [True, None, False, True, False], type_=bool)
+
+    exprs = [(t.mz >= 150) & (t.mz <= 300) & (t.rt >= 20) & (t.rt <= 40),
+             (t.mz > 150) | (t.rt < 20),
+             ~(t.mz > 150) ^ t.z.isNone(),
+             t.mz / 2 + t.rt,
+             (t.mz * 2 > t.rt) & (t.z != 0),
+             # numpy does not subtract boolean arrays:
+             (t.mz > 150) - (t.rt > 20),
+             t.b - t.b,
+             t.b + (t.z > 0)]
+    for expr in exprs:
+        ctx = {t: t._getColumnCtx(expr._neededColumns())}
+        expected, __, expected_type = expr._eval(ctx)
+        values, __, type_ = compile_expression(expr).evaluate(ctx)
+        assert type_ == expected_type
+        assert list(values) == list(expected), expr
+        flags = compile_expression(expr).evaluate_flags(ctx)
+        assert flags.tolist() == [bool(v) for v in expected]
+
+    # boolean operands without missing values, in both storages and for single rows:
+    for n in (3, 1):
+        for columnar in (False, True):
+            t2 = emzed.utils.toTable("a", [1, 0, 2][:n], type_=int)
+            t2.addColumn("b", [1, 2, 0][:n], type_=int)
+            t2.addColumn("bo", [True, False, True][:n], type_=bool)
+            if columnar:
+                t2.useColumnarStorage()
+            expr = (t2.a > 0) - (t2.b > 0)
+            ctx = {t2: t2._getColumnCtx(expr._neededColumns())}
+            expected = expr._eval(ctx)[0]
+            assert list(compile_expression(expr).evaluate(ctx)[0]) == list(expected)
+            assert len(t2.filter(expr)) == sum(map(bool, expected))
+            assert len(t2.filter(t2.bo - t2.bo)) == 0
+            assert len(t2.filter(t2.bo + (t2.a > 0))) == sum(t2.bo.values)
+
+    # shared subexpressions and columns are evaluated once:
+    compiled = compile_expression((t.mz > 150) & (t.mz > 150) & (t.mz < 300))
+    assert len(compiled.steps) == 7
+
+    assert t.filter((t.mz >= 150) & (t.rt <= 40)).mz.values == (300.0, 250.0)
+    t.addColumn("mz_per_z", t.mz / t.z, type_=float)
+    assert t.mz_per_z.values == (100.0, None, 100.0, None, None)
@@ -17,6 +17,7 @@ from emzed.core.data_types.hdf5.accessors import (Hdf5TableWriter, Hdf5TableAppe
                                                   Hdf5TableReader)
 
 from emzed.core.data_types.hdf5.bit_matrix import (BitMatrix,)
+from emzed.core.data_types.hdf5.column_flags import ColumnFlags
 
 
 from emzed.utils import toTable
@@ -114,6 +115,42 @@ def test_hdf5_table_appender(table, tmpdir):
     append_to_hdf5([table, table, table], path, atomic=False)
 
 
+def test_bulk_writes(tmpdir, monkeypatch):
+    # small blocks, so rows are appended in several steps:
+    monkeypatch.setattr(Hdf5TableWriter, "BLOCK_SIZE", 3)
+    ts_0 = TimeSeries(map(datetime.fromordinal, range(1, 4)), [1.0, 2.0, 3.0], "a")
+    ts_1 = TimeSeries(map(datetime.fromordinal, range(5, 7)), [1.0, 2.0], "b", [True, False])
+    t = toTable("i", (1, None, 3, 4, None, 6, 7), type_=int)
+    t.addColumn("f", (1.0, 2.0, None, 4.0, 5.0, 6.0, 7.0), type_=float)
+    t.addColumn("s", ("x", "y", "x", None, "x", "y", "z"), type_=str)
+    t.addColumn("ts", (ts_0, ts_1, ts_0, None, ts_1, ts_0, ts_0), type_=TimeSeries)
+    t.addColumn("o", ({1: 2}, None, [3], None, None, (4,), {}), type_=object)
+
+    path = tmpdir.join("test.hdf5").strpath
+    to_hdf5(t, path)
+    append_to_hdf5(t, path)
+
+    prox = Hdf5TableProxy(path)
+    assert len(prox) == 14
+    tt = prox.toTable()
+    for name in ("i", "f", "s"):
+        assert tt.getColumn(name).values == getattr(t, name).values * 2
+    assert tt.o.values == t.o.values * 2
+    series = tt.ts.values
+    assert series[3] is None
+    assert [(list(ts.x), list(ts.y), ts.label, ts.is_blank) for ts in series[:3]] == \
+        [(list(ts.x), list(ts.y), ts.label, ts.is_blank) for ts in (ts_0, ts_1, ts_0)]
+    prox.close()
+
+    # strings are stored once per writer, time series once per file:
+    from tables import open_file
+    file_ = open_file(path, "r")
+    col_index = t.getColNames().index("s")
+    assert getattr(file_.root, "string_blob_starts__%d" % col_index).nrows == 2 * 3
+    assert file_.root.ts_index.nrows == 2
+    file_.close()
+
+
 def test_atomic_hdf5_writer(table, tmpdir, regtest):
     path = tmpdir.join("test.hdf5").strpath
     with atomic_hdf5_writer(path) as add:
@@ -175,6 +212,17 @@ def test_round_trip(tproxy, table, regtest):
     return
 
 
+def test_peak_arrays_of_proxy(tproxy, table):
+    pm0 = tproxy.toTable().peakmap.values[0]
+    pm1 = table.peakmap.values[0]
+    a0 = pm0.peakArrays()
+    a1 = pm1.peakArrays()
+    assert np.all(a0.peaks == a1.peaks)
+    assert np.all(a0.offsets == a1.offsets)
+    assert np.all(a0.rts == a1.rts)
+    assert np.all(a0.ms_levels == a1.ms_levels)
+
+
 def test_round_trip_objects(tmpdir, regtest):
     # test roundtrip:
     col = [{i: i + 1} for i in range(5)]
@@ -454,6 +502,139 @@ def test_bit_matrix(tmpdir):
         file_.close()
 
 
+def test_bit_matrix_evicted_blocks_are_written(tmpdir):
+    from tables import open_file
+    path = tmpdir.join("data.bin").strpath
+    file_ = open_file(path, "w")
+    bm = BitMatrix(file_, "flags", 11, cache_block_size=10)
+    bm.cache.max_bytes = 300   # keeps about one block
+    bm.resize(100)
+    for row in range(0, 100, 7):
+        bm.set_bit(row, 3)
+    bm.flush()
+    file_.close()
+
+    file_ = open_file(path, "r")
+    bm = BitMatrix(file_, "flags", 11, cache_block_size=10)
+    assert list(np.where(bm.flags_in_col(3))[0]) == list(range(0, 100, 7))
+    file_.close()
+
+
+def test_column_flags(tmpdir):
+    from tables import open_file
+    path = tmpdir.join("data.bin").strpath
+    file_ = open_file(path, "w")
+    flags = ColumnFlags(file_, "flags", 3)
+    flags.resize(10000)
+    flags.set_flags(0, [3, 4, 5, 9999])
+    flags.set_flags(1, np.arange(10000) % 3 == 0)
+    flags.set_bit(7, 2)
+    flags.unset_bit(4, 0)
+    flags.flush()
+    # few runs are run length encoded, column 2 has no flags set anymore:
+    flags.unset_bit(7, 2)
+    flags.resize(10003)
+    flags.set_bit(10002, 1)
+    flags.flush()
+    file_.close()
+
+    file_ = open_file(path, "r")
+    assert file_.root.flags__0._v_attrs.encoding == "runs"
+    assert file_.root.flags__1._v_attrs.encoding == "bits"
+    assert not hasattr(file_.root, "flags__2")
+
+    flags = ColumnFlags(file_, "flags", 3)
+    assert flags.n_rows == 10003
+    assert list(np.where(flags.flags_in_col(0))[0]) == [3, 5, 9999]
+    expected = [i for i in range(10003) if i % 3 == 0 and i < 10000] + [10002]
+    assert list(np.where(flags.flags_in_col(1))[0]) == expected
+    assert not flags.flags_in_col(2).any()
+    assert list(flags.positions_in_row(9999)) == [0, 1]
+    assert flags.flags_in_rows([3, 4, 10002]).tolist() == [[True, True, False],
+                                                          [False, False, False],
+                                                          [False, True, False]]
+    file_.close()
+
+
+def test_column_flags_rows_see_modifications(tmpdir):
+    from tables import open_file
+    file_ = open_file(tmpdir.join("data.bin").strpath, "w")
+    flags = ColumnFlags(file_, "flags", 3)
+    flags.resize(20)
+    assert not flags.flags_in_rows([5]).any()
+    flags.set_bit(5, 1)
+    assert flags.flags_in_rows([5]).tolist() == [[False, True, False]]
+    flags.set_flags(2, [5, 6])
+    flags.unset_bit(5, 1)
+    assert flags.flags_in_rows([5, 6]).tolist() == [[False, False, True], [False, False, True]]
+    flags.resize(30)
+    flags.set_bit(25, 0)
+    assert flags.flags_in_rows([25]).tolist() == [[True, False, False]]
+
+    # evicted columns are read again:
+    flags.cache.max_bytes = 1
+    flags.set_bit(26, 0)
+    assert flags.flags_in_rows([25, 26]).tolist() == [[True, False, False], [True, False, False]]
+    file_.close()
+
+
+def test_convert_row_flags(tmpdir, monkeypatch):
+    from tables import open_file
+    t = toTable("a", (1, None, 2, None), type_=int)
+    t.addColumn("b", (None, "x", None, "y"), type_=str)
+    path = tmpdir.join("test.hdf5").strpath
+
+    # create file in the layout of version 2.26.20 which had row wise flags:
+    monkeypatch.setattr(Hdf5TableWriter, "LATEST_HDF5_TABLE_VERSION", (2, 26, 20))
+    to_hdf5(t, path)
+    monkeypatch.undo()
+
+    file_ = open_file(path, "a")
+    flags = ColumnFlags(file_, "missing_flags", 2)
+    old_flags = BitMatrix(file_, "flags", 2)
+    old_flags.resize(4)
+    for row in range(4):
+        for col in flags.positions_in_row(row):
+            old_flags.set_bit(row, col)
+    old_flags.flush()
+    for col in range(2):
+        if hasattr(file_.root, "missing_flags__%d" % col):
+            file_.remove_node(file_.root, "missing_flags__%d" % col)
+    del file_.root._v_attrs.missing_flags_n_rows
+    file_.close()
+
+    with open(path, "rb") as fh:
+        content = fh.read()
+
+    with pytest.warns(UserWarning):
+        prox = Hdf5TableProxy(path)
+    assert prox.a.values == (1, None, 2, None)
+    assert prox.b.values == (None, "x", None, "y")
+    assert prox.rows[3] == [None, "y"]
+    prox.close()
+
+    # reading does not modify the file:
+    with open(path, "rb") as fh:
+        assert fh.read() == content
+
+    # appending converts the flags and updates the version:
+    with pytest.warns(UserWarning):
+        appender = Hdf5TableAppender(path)
+    appender.append_table(t)
+    appender.close()
+
+    prox = Hdf5TableProxy(path)
+    assert prox.hdf5_meta == dict(hdf5_table_version=Hdf5TableWriter.LATEST_HDF5_TABLE_VERSION)
+    assert prox.a.values == (1, None, 2, None) * 2
+    assert prox.b.values == (None, "x", None, "y") * 2
+    prox.close()
+
+    file_ = open_file(path, "r")
+    assert ColumnFlags.exists(file_, "missing_flags")
+    assert not hasattr(file_.root, "flags")
+    file_.close()
+
+
 @pytest.fixture
 def proxy_small_table(tmpdir):
     t = toTable("a", (1, 1, 2, 2, None), type_=int)
@@ -591,3 +772,167 @@ def test_table_in_tables(tmpdir, regtest):
     print(from_hdf5.collapsed[0], file=regtest)
 
     assert table.uniqueId() == from_hdf5.uniqueId()
+
+
+def test_perm_consistent_with_table(proxy_small_table):
+
+    prox = proxy_small_table
+    t = prox.toTable()
+    for names in ("a", "d", ("a", "d"), ("d", "a")):
+        for order in (True, False, (True, False), (False, True)):
+            if isinstance(order, tuple) and not isinstance(names, tuple):
+                continue
+            assert prox.sortPermutation(names, order) == list(t.sortPermutation(names, order))
+
+
+def test_filter(tmpdir):
+    from emzed.core.data_types.hdf5_table_proxy import RangeFilter
+
+    t = toTable("a", (1, 1, 2, 2, None, 3), type_=int)
+    t.addColumn("f", (1.0, None, 2.0, 3.0, 4.0, 0.0), type_=float)
+    t.addColumn("d", ("4", "4", "2", "1", None, "2"), type_=str)
+    path = tmpdir.join("test.hdf5").strpath
+    to_hdf5(t, path)
+
+    prox = Hdf5TableProxy(path)
+    assert prox.reader.row_table.cols.a.is_indexed
+
+    for f in (lambda t: t.a > 1,
+              lambda t: t.a != 2,
+              lambda t: t.f.inRange(0.5, 3.0),
+              lambda t: (t.a <= 2) | (t.f == 0.0),
+              lambda t: t.a.isIn([1, 3, None]),
+              lambda t: (t.d == "2") & (t.f > 1),
+              lambda t: t.a.isNone() | (t.a < t.f)):
+        assert prox.filter(f(prox)).rows == t.filter(f(t)).rows
+
+    rows = prox.findMatchingRows([("a", RangeFilter(1, 2)), ("f", RangeFilter(None, 2.5))])
+    assert rows.tolist() == [0, 2]
+    rows = prox.findMatchingRows([("d", lambda d: d == "4"), ("f", None)])
+    assert rows.tolist() == [0, 1]
+    prox.close()
+
+
+def test_lazy(tmpdir):
+
+    t = toTable("a", (1, 1, 2, 2, None, 3, 4, 2), type_=int)
+    t.addColumn("f", (1.0, None, 2.0, 3.0, 4.0, 0.0, 5.0, 6.0), type_=float)
+    t.addColumn("d", ("4", "4", "2", "1", None, "2", "1", "2"), type_=str)
+    path = tmpdir.join("test.hdf5").strpath
+    to_hdf5(t, path)
+
+    other = toTable("a", (2, 3, 4), type_=int)
+    other.addColumn("name", ("two", "three", "four"), type_=str)
+
+    prox = Hdf5TableProxy(path)
+    lazy = prox.lazy(chunk_size=3).filter((prox.a >= 2) & (prox.d != "1"))
+    lazy = lazy.addColumn("g", lazy.f * 2, type_=float)
+    lazy = lazy.filter(lazy.g > 1.0)
+    lazy = lazy.join(other, lazy.a == other.a).dropColumns("d")
+    assert lazy.getColNames() == ["a", "f", "g", "a__0", "name__0"]
+    assert all(len(chunk) <= 3 for chunk in lazy.chunks())
+
+    expected = t.filter((t.a >= 2) & (t.d != "1"))
+    expected.addColumn("g", expected.f * 2, type_=float)
+    expected = expected.filter(expected.g > 1.0)
+    expected = expected.join(other, expected.a == other.a)
+    expected.dropColumns("d")
+    assert lazy.toTable().rows == expected.rows
+
+    result_path = tmpdir.join("result.hdf5").strpath
+    lazy.store(result_path)
+    result = Hdf5TableProxy(result_path)
+    assert result.getColNames() == expected.getColNames()
+    assert result.toTable().rows == expected.rows
+    result.close()
+
+    empty_path = tmpdir.join("empty.hdf5").strpath
+    prox.lazy().filter(prox.a > 10).store(empty_path)
+    result = Hdf5TableProxy(empty_path)
+    assert len(result) == 0
+    assert result.getColNames() == ["a", "f", "d"]
+    result.close()
+    prox.close()
+
+
+def test_lazy_rejects_values_depending_on_other_rows(tmpdir):
+
+    t = toTable("a", range(10), type_=int)
+    t.addColumn("b", range(10, 0, -1), type_=int)
+    path = tmpdir.join("test.hdf5").strpath
+    to_hdf5(t, path)
+
+    prox = Hdf5TableProxy(path)
+    lazy = prox.lazy(chunk_size=3)
+
+    # evaluated per chunk these would give chunk wise maxima resp. means:
+    with pytest.raises(Exception):
+        lazy.addColumn("m", lazy.a.max, type_=int)
+    with pytest.raises(Exception):
+        lazy.filter(lazy.b >= lazy.b.mean)
+    with pytest.raises(Exception):
+        lazy.replaceColumn("a", lazy.a.max.group_by(lazy.b), type_=int)
+    with pytest.raises(Exception):
+        lazy.addColumn("c", range(10), type_=int)
+    with pytest.raises(Exception):
+        lazy.addColumn("c", np.arange(10), type_=int)
+
+    lazy = lazy.addColumn("c", lazy.a + lazy.b, type_=int).addColumn("d", 1, type_=int)
+    assert lazy.toTable().c.values == (10,) * 10
+    assert lazy.toTable().d.values == (1,) * 10
+    prox.close()
+
+
+def test_mz_index(tmpdir):
+
+    np.random.seed(42)
+    spectra = []
+    for i in range(150):
+        mzs = np.sort(np.random.uniform(100.0, 110.0, size=np.random.randint(0, 40)))
+        peaks = np.vstack((mzs, np.random.uniform(0.0, 1000.0, size=len(mzs)))).T
+        spectra.append(Spectrum(peaks, 10.0 + i, 1 + i % 2, "+"))
+    pm = PeakMap(spectra)
+    t = toTable("peakmap", [pm], type_=PeakMap)
+
+    path_plain = tmpdir.join("plain.hdf5").strpath
+    path_tiles = tmpdir.join("tiles.hdf5").strpath
+    to_hdf5(t, path_plain)
+    to_hdf5(t, path_tiles, mz_index=True)
+
+    plain = Hdf5TableProxy(path_plain)
+    tiles = Hdf5TableProxy(path_tiles)
+    assert not hasattr(plain.reader.file_.root, "ms1_tile_table")
+    assert hasattr(tiles.reader.file_.root, "ms1_tile_table")
+
+    pm_plain = plain.peakmap.values[0]
+    pm_tiles = tiles.peakmap.values[0]
+    assert pm_plain._tiles(1) is None
+    assert pm_tiles._tiles(1) is not None
+
+    for ms_level in (1, 2):
+        for (mzmin, mzmax, rtmin, rtmax) in [(100.0, 110.0, 0.0, 200.0),
+                                             (104.99, 105.01, 50.0, 120.0),
+                                             (101.5, 108.2, 12.0, 12.0),
+                                             (102.0, 103.0, 300.0, 400.0),
+                                             (200.0, 300.0, 0.0, 200.0)]:
+            rt0, ii0 = pm_plain.chromatogram(mzmin, mzmax, rtmin, rtmax, ms_level)
+            rt1, ii1 = pm_tiles.chromatogram(mzmin, mzmax, rtmin, rtmax, ms_level)
+            rt2, ii2 = pm.chromatogram(mzmin, mzmax, rtmin, rtmax, ms_level)
+            assert np.all(rt0 == rt1)
+            assert np.all(rt1 == rt2)
+            assert np.allclose(ii0, ii1)
+            assert np.allclose(ii1, ii2, rtol=1e-5)
+
+    plain.close()
+    tiles.close()
+
+    # appending to a file with m/z index extends the index:
+    pm_2 = PeakMap([Spectrum(np.array([[105.0, 1.0], [106.0, 2.0]]), 20.0, 1, "+")])
+    append_to_hdf5(toTable("peakmap", [pm_2], type_=PeakMap), path_tiles)
+    tiles = Hdf5TableProxy(path_tiles)
+    pm_tiles = tiles.peakmap.values[1]
+    assert pm_tiles._tiles(1) is not None
+    rts, iis = pm_tiles.chromatogram(105.5, 107.0, 0.0, 100.0)
+    assert rts.tolist() == [20.0]
+    assert iis.tolist() == [2.0]
+    tiles.close()
@@ -0,0 +1,159 @@
+# encoding: utf-8
+from __future__ import print_function
+
+import gc
+import weakref
+
+import numpy as np
+
+from emzed.core.data_types import memory_cache
+from emzed.core.data_types.memory_cache import (Cache, cached, estimate_size, cache_stats,
+                                                 set_memory_limit, get_memory_limit)
+
+
+def test_estimate_size():
+    data = np.zeros((1000,))
+    assert estimate_size(data) == 8000
+    assert estimate_size((data, data)) > 16000
+    assert estimate_size({"a": data}) > 8000
+
+    strings = np.array(["x" * 100] * 10000, dtype=object)
+    assert estimate_size(strings) > 10000 * 100
+    assert estimate_size(set(range(1000))) > 1000 * 24
+
+
+def test_byte_budget():
+    evicted = []
+    cache = Cache("test budget", 10000, on_evict=lambda k, v: evicted.append(k))
+    for i in range(5):
+        cache[i] = np.zeros((200,))   # 1600 bytes + overhead
+
+    assert len(cache) == 5
+    assert cache.get(0) is not None   # 0 is most recently used now
+    cache[5] = np.zeros((200,))
+    cache[6] = np.zeros((200,))
+    assert sorted(cache.keys()) == [0, 3, 4, 5, 6]
+    assert evicted == [1, 2]
+    assert cache.bytes <= 10000
+
+    # values which exceed the budget are not cached:
+    cache[7] = np.zeros((10000,))
+    assert 7 not in cache
+    assert len(cache) == 5
+
+    assert cache.get(8) is None
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["evictions"] == 2
+    assert stats["name"] == "test budget"
+    assert stats in cache_stats()
+
+    del cache[0]
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.bytes == 0
+    assert evicted == [1, 2]
+
+
+def test_global_limit():
+    limit = get_memory_limit()
+    c1 = Cache("test global 1", 100000)
+    c2 = Cache("test global 2", 100000)
+    try:
+        memory_cache.clear_all()
+        set_memory_limit(8000)
+        c1[0] = np.zeros((250,))   # 2000 bytes + overhead
+        c2[0] = np.zeros((250,))
+        c1[1] = np.zeros((250,))
+        # least recently used entry over all caches is evicted:
+        c2[1] = np.zeros((250,))
+        assert 0 not in c1
+        assert 0 in c2 and 1 in c1 and 1 in c2
+        assert memory_cache.total_bytes() <= 8000
+    finally:
+        set_memory_limit(limit)
+
+
+def test_total_bytes():
+
+    def sum_of_caches():
+        return sum(cache.bytes for cache in memory_cache._caches)
+
+    assert memory_cache.total_bytes() == sum_of_caches()
+    before = memory_cache.total_bytes()
+    c1 = Cache("test total 1", 100000)
+    c1.update((i, np.zeros((200,))) for i in range(10))
+    c1[3] = np.zeros((100,))
+    del c1[4]
+    assert memory_cache.total_bytes() == before + c1.bytes == sum_of_caches()
+
+    c2 = Cache("test total 2", 100000)
+    c2[0] = np.zeros((200,))
+    c1.clear()
+    assert memory_cache.total_bytes() == before + c2.bytes
+
+    # bytes of garbage collected caches are released:
+    del c2
+    gc.collect()
+    assert memory_cache.total_bytes() == before == sum_of_caches()
+
+
+def test_cached_decorator():
+    calls = []
+
+    @cached("test decorator", 10000)
+    def square(x):
+        calls.append(x)
+        return x * x
+
+    @cached("test generator", 10000)
+    def numbers(n):
+        for i in range(n):
+            yield i
+
+    assert square(3) == 9
+    assert square(3) == 9
+    assert calls == [3]
+    assert square.cache.hits == 1
+    assert square.cache.misses == 1
+
+    # generators are cached as lists, every call returns a new iterator:
+    assert list(numbers(3)) == [0, 1, 2]
+    assert list(numbers(3)) == [0, 1, 2]
+    assert numbers.cache.hits == 1
+
+    # instances of cached methods are not kept alive by the cache:
+    class Squarer(object):
+
+        @cached("test method", 10000)
+        def square(self, x):
+            return x * x
+
+    squarer = Squarer()
+    assert squarer.square(3) == 9
+    assert squarer.square(3) == 9
+    assert Squarer.square.cache.hits == 1
+    ref = weakref.ref(squarer)
+    del squarer
+    gc.collect()
+    assert ref() is None
+    # entries of garbage collected instances are removed with the next call:
+    assert len(Squarer.square.cache) == 1
+    assert Squarer().square(2) == 4
+    assert len(Squarer.square.cache) == 1
+
+
+def test_sizeof():
+    cache = Cache("test sizeof", 10000, sizeof=lambda value: 1000)
+    cache[0] = np.zeros((10000,))
+    assert cache.bytes == 1000 + memory_cache.ENTRY_OVERHEAD
+
+
+def test_bulk_access():
+    cache = Cache("test bulk", 10000)
+    cache.update((i, i * i) for i in range(5))
+    assert len(cache) == 5
+    assert cache.get_many([1, 3, 7]) == {1: 1, 3: 9}
+    assert cache.hits == 2
+    assert cache.misses == 1
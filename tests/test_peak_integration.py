@@ -50,6 +50,31 @@ def testIntegration(path, regtest):
     _compare_tables(t1, t3)
 
 
+def test_integrate_in_chunks(path):
+    ft = io.loadTable(path("data/features.table"))
+    t1 = utils.integrate(ft, "trapez", n_cpus=1)
+    t2 = utils.integrate(ft, "trapez", n_cpus=2, min_size_for_parallel_execution=1,
+                         chunk_size=3)
+    _compare_tables(t1, t2)
+
+
+def test_integrate_hdf5_peakmaps_in_parallel(path, tmpdir):
+    from emzed.core.data_types.hdf5_table_proxy import Hdf5TableProxy
+    ft = io.loadTable(path("data/features.table"))
+    ft.setColType("peakmap", PeakMap)
+    io.to_hdf5(ft, tmpdir.join("ft.hdf5").strpath)
+    proxy = Hdf5TableProxy(tmpdir.join("ft.hdf5").strpath)
+    try:
+        ft = proxy.toTable()
+        t1 = utils.integrate(ft, "trapez", n_cpus=1)
+        t2 = utils.integrate(ft, "trapez", n_cpus=2, min_size_for_parallel_execution=1,
+                             chunk_size=3)
+    finally:
+        proxy.close()
+    # the proxies sum float32 intensities:
+    assert np.allclose(t1.area.values, t2.area.values, rtol=1e-6)
+
+
 def _testIntegration(path, n_cpus, integrator_id, check_values, regtest):
 
     # test with and without unicode:
@@ -228,6 +253,55 @@ def test_with_baseline(regtest):
     print("baseline=%.3f" % params[2], file=regtest)
 
 
+def test_batch_emg():
+    rts = np.arange(0.0, 10.0, 0.1)
+    chromatograms = []
+    eics = []
+    for i, (z, h, baseline) in enumerate([(5.0, 20.0, 0.0), (4.0, 1e5, 1e3), (6.0, 3.0, 1.0)]):
+        chromo = np.exp(-(rts - z) ** 2 / 3.0) * h + baseline
+        chromatograms.append((rts[20 + i:-20], chromo[20 + i:-20]))
+        eics.append((rts, chromo))
+    # too few data points for fitting:
+    chromatograms.append((rts[:3], chromo[:3]))
+    eics.append((rts, chromo))
+
+    for id_, batch_id in (("emg_exact", "emg_batch"),
+                          ("emg_with_baseline", "emg_with_baseline_batch")):
+        integrator = dict(peakIntegrators)[id_]
+        batch_integrator = dict(peakIntegrators)[batch_id]
+        expected = integrator.integrateChromatograms(chromatograms, eics)
+        results = batch_integrator.integrateChromatograms(chromatograms, eics)
+        assert len(results) == len(expected)
+        for (area, rmse, params), (area_e, rmse_e, params_e) in zip(results, expected):
+            assert abs(area - area_e) <= 1e-2 * abs(area_e)
+            assert abs(rmse - rmse_e) <= 1e-2 * abs(rmse_e) + 1e-6 * abs(area_e)
+            assert len(params) == len(params_e)
+
+
+def test_batch_emg_noisy():
+    # a fit must not stop after a step which by chance reduced the residuals only a little:
+    rng = np.random.RandomState(42)
+    rts = np.arange(0.0, 10.0, 0.1)
+    chromatograms = []
+    eics = []
+    for i in range(60):
+        z = rng.uniform(3.5, 6.5)
+        h = 10 ** rng.uniform(2, 6)
+        w = rng.uniform(0.5, 2.5)
+        chromo = np.exp(-(rts - z) ** 2 / w) * h
+        chromo = np.maximum(chromo + rng.normal(0, 0.05 * h, size=rts.shape), 0)
+        chromatograms.append((rts[15:-15], chromo[15:-15]))
+        eics.append((rts, chromo))
+
+    integrator = dict(peakIntegrators)["emg_exact"]
+    batch_integrator = dict(peakIntegrators)["emg_batch"]
+    expected = integrator.integrateChromatograms(chromatograms, eics)
+    results = batch_integrator.integrateChromatograms(chromatograms, eics)
+    for (area, rmse, __), (area_e, rmse_e, __) in zip(results, expected):
+        assert abs(area - area_e) <= 1e-2 * abs(area_e)
+        assert rmse <= 1.01 * rmse_e
+
+
 def testPeakIntegration(regtest):
 
     integrator = dict(peakIntegrators)["asym_gauss"]
@@ -293,6 +367,15 @@ def testTrapezIntegrationSimple():
     # multiple levels shall rise exception:
     ex(lambda: integrator.integrate(0.4, 3.0, 0, 3))
 
+    windows = [(1.4, 2.5, 0, 3), (0.4, 2.5, 0, 2), (10.0, 20.0, 0, 3)]
+    results = integrator.integrateWindows(windows, msLevel=1)
+    assert [r["area"] for r in results] == [5.0, 6.0, 0.0]
+    # same as integrate for a window without peaks:
+    rts, intensities = results[2]["eic"]
+    assert not intensities.any()
+    single = integrator.integrate(10.0, 20.0, 0, 3, msLevel=1)
+    assert list(rts) == list(single["eic"][0])
+
 
 def ex(f):
     e0 = None
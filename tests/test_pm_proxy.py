@@ -147,3 +147,78 @@ def test_as_pickle(path, tmpdir):
     pm.dump_as_pickle(path)
     pm = PeakMap.load_as_pickle(path)
     print(pm)
+
+
+def test_partial_loading(tmpdir):
+
+    import numpy as np
+    from emzed.core.data_types import Table, Spectrum, PeakMap
+    from emzed.core.data_types.ms_types import PeakMapProxy
+
+    np.random.seed(42)
+    spectra = []
+    for i in range(100):
+        peaks = np.random.random((20, 2)) * (100.0, 1000.0) + (100.0, 1.0)
+        spectra.append(Spectrum(peaks, 10.0 * i, 1 + i % 2, "+"))
+    pm = PeakMap(spectra)
+
+    t = emzed.utils.toTable("id", (1, 2), type_=int)
+    t.addColumn("peakmap", pm, type_=object)
+    path = tmpdir.join("t.table").strpath
+    t.store(path, True, True, tmpdir.strpath)
+
+    proxy = Table.load(path).peakmap.uniqueValue()
+    assert isinstance(proxy, PeakMapProxy)
+
+    rts, iis = proxy.chromatogram(120.0, 160.0, 100.0, 400.0)
+    rts_expected, iis_expected = pm.chromatogram(120.0, 160.0, 100.0, 400.0)
+    assert np.all(rts == rts_expected)
+    assert np.all(iis == iis_expected)
+
+    extracted = proxy.extract(rtmin=200.0, rtmax=500.0, mzmin=130.0, mslevelmin=2)
+    expected = pm.extract(rtmin=200.0, rtmax=500.0, mzmin=130.0, mslevelmin=2)
+    assert len(extracted) == len(expected)
+    for s0, s1 in zip(extracted, expected):
+        assert s0.rt == s1.rt
+        assert np.all(s0.peaks == s1.peaks)
+
+    assert [s.rt for s in proxy.specsInRange(95.0, 125.0)] == [100.0, 110.0, 120.0]
+    assert not proxy._loaded
+
+    assert len(proxy) == 100  # triggers loading
+    assert proxy._loaded
+    assert proxy.uniqueId() == pm.uniqueId()
+
+    proxy.squeeze()
+    assert not proxy._loaded
+    assert "_peak_arrays" not in proxy.__dict__
+    assert proxy.chromatogram(120.0, 160.0, 100.0, 400.0)[0].tolist() == rts_expected.tolist()
+
+
+def test_image_pyramid_next_to_cache(tmpdir):
+
+    import numpy as np
+    from emzed.core.data_types import Table, Spectrum, PeakMap
+    from emzed.core.data_types.image_pyramid import image_pyramid, pyramid_path
+
+    np.random.seed(42)
+    spectra = [Spectrum(np.random.random((20, 2)) * (100.0, 1000.0) + (100.0, 1.0), 10.0 * i, 1,
+                        "+") for i in range(30)]
+    pm = PeakMap(spectra)
+    assert pyramid_path(pm, 1) is None
+
+    t = emzed.utils.toTable("id", (1,), type_=int)
+    t.addColumn("peakmap", pm, type_=object)
+    path = tmpdir.join("t.table").strpath
+    t.store(path, True, True, tmpdir.strpath)
+
+    proxy = Table.load(path).peakmap.uniqueValue()
+    path = pyramid_path(proxy, 1)
+    assert path is not None and not os.path.exists(path)
+    pyramid = image_pyramid(proxy, 1)
+    assert os.path.exists(path)
+
+    proxy = Table.load(tmpdir.join("t.table").strpath).peakmap.uniqueValue()
+    loaded = image_pyramid(proxy, 1)
+    assert not proxy._loaded
+    assert np.all(loaded.sums[0] == pyramid.sums[0])
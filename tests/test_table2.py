@@ -6,7 +6,7 @@ from datetime import datetime
 import os
 
 from emzed.core.data_types import Table, PeakMap, Blob, TimeSeries
-from emzed.core.data_types.table import relative_path
+from emzed.core.data_types.table import relative_path, TProxy
 import emzed.utils
 import emzed.mass
 import numpy as np
@@ -715,6 +715,54 @@ def test_collapse(regtest):
     print(10, ts0, file=regtest)
 
 
+
+def test_split_and_collapse_share_rows():
+    t = emzed.utils.toTable("id", [1, 1, 2], type_=int)
+    t.addColumn("a", [1, 2, 3], type_=int)
+
+    t1, t2 = t.splitBy("id")
+    t3 = t.collapse("id", efficient=False).collapsed.values[1]
+
+    # modifying a sub table or the table itself does not modify the other tables:
+    t1.replaceColumn("a", t1.a + 10, type_=int)
+    t.addColumn("b", t.a * 2, type_=int)
+    assert t1.rows == [[1, 11], [1, 12]]
+    assert t2.rows == [[2, 3]]
+    assert t3.rows == [[2, 3]]
+    assert t.rows == [[1, 1, 2], [1, 2, 4], [2, 3, 6]]
+
+    t.useColumnarStorage()
+    t1, t2 = t.splitBy("id")
+    assert t1.hasColumnarStorage()
+    assert t2.rows == [[2, 3, 6]]
+
+
+def test_collapse_efficient_sub_tables_are_copied_on_write():
+    t = emzed.utils.toTable("id", [1, 1, 2], type_=int)
+    t.addColumn("a", [1, 2, 3], type_=int)
+
+    p1, p2 = t.collapse("id").collapsed.values
+    assert isinstance(p1, TProxy)
+    assert len(p1) == 2
+    assert p1.a.values == (1, 2)
+
+    p1.rows[0][1] = 10
+    p2.addRow([2, 4])
+    assert p1.rows == [[1, 10], [1, 2]]
+    assert p2.rows == [[2, 3], [2, 4]]
+    assert len(p2) == 2
+    assert t.rows == [[1, 1], [1, 2], [2, 3]]
+
+    # the sub tables do not see modifications of the table either:
+    p1, p2 = t.collapse("id").collapsed.values
+    t.rows[2][1] = 30
+    assert p2.rows == [[2, 3]]
+
+    p2.useColumnarStorage()
+    assert len(p2) == 1
+    assert p2.rows == [[2, 3]]
+
+
 def test_unique_id(regtest):
     ti = emzed.utils.toTable("id", [1, 1, 2])
     t = emzed.utils.toTable("t", (ti, ti, None))
@@ -152,3 +152,110 @@ def test_special_col_conversion(regtest):
     print(t, file=regtest)
     df = t.to_pandas(do_format=True)
     print(df, file=regtest)
+
+
+def test_sort_permutation_with_nones_and_mixed_order():
+    t = emzed.utils.toTable("a", (2, None, 1, 2, None, 1), type_=int)
+    t.addColumn("b", ("x", "y", None, "x", "z", "a"), type_=str)
+    t.addColumn("c", (1.0, 2.0, 3.0, 0.5, None, 3.0), type_=float)
+
+    assert t.sortPermutation("a") == (1, 4, 2, 5, 0, 3)
+    assert t.sortPermutation("a", False) == (0, 3, 2, 5, 1, 4)
+    assert t.sortPermutation(("a", "b"), (True, False)) == (4, 1, 5, 2, 0, 3)
+    assert t.sortPermutation(("b", "c"), (True, False)) == (2, 5, 0, 3, 1, 4)
+
+    t.useColumnarStorage()
+    assert t.sortPermutation(("a", "b"), (True, False)) == (4, 1, 5, 2, 0, 3)
+
+    t.sortBy("c", ascending=True)
+    assert t.primaryIndex == {"c": True}
+    assert t.c.values == (None, 0.5, 1.0, 2.0, 3.0, 3.0)
+    t.sortBy("c", ascending=False)
+    assert t.primaryIndex == {}
+
+
+def test_join_strategies():
+    from emzed.core.data_types.join_planner import JoinPlanner
+
+    t1 = emzed.utils.toTable("mz", (100.0, 200.0, 300.0, None), type_=float)
+    t1.addColumn("rt", (10.0, 20.0, 30.0, 40.0), type_=float)
+    t2 = emzed.utils.toTable("mz", (100.001, 199.0, 200.002, 300.0), type_=float)
+    t2.addColumn("rtmin", (5.0, 15.0, 15.0, 35.0), type_=float)
+    t2.addColumn("rtmax", (15.0, 25.0, 25.0, 45.0), type_=float)
+
+    cases = [(t1.mz.approxEqual(t2.mz, 0.01), "sort-merge"),
+             (t1.rt.inRange(t2.rtmin, t2.rtmax), "interval"),
+             (t1.mz.equals(t2.mz, abs_tol=0.01) & t1.rt.inRange(t2.rtmin, t2.rtmax), "lookup"),
+             (t1.mz > t2.mz, "range scan"),
+             ((t1.mz > t2.mz) | (t1.rt > t2.rtmin), "nested loop"),
+             ]
+
+    for expr, strategy in cases:
+        assert JoinPlanner(t1, t2, expr).describe().startswith(strategy)
+        expected = [[i, j] for (i, r1) in enumerate(t1.rows) for (j, r2) in enumerate(t2.rows)
+                    if expr._eval({t1: dict((n, ([v], None, float))
+                                            for n, v in zip(t1.getColNames(), r1)),
+                                   t2: t2._getColumnCtx(expr._neededColumns())})[0][j]]
+        tn = t1.join(t2, expr)
+        assert tn.rows == [t1.rows[i] + t2.rows[j] for (i, j) in expected]
+        tn = t1.leftJoin(t2, expr)
+        assert len(tn) == len(expected) + len(set(range(4)) - set(i for i, j in expected))
+
+    tn = t1.join(t2, t1.mz.approxEqual(t2.mz, 0.01) & t1.rt.inRange(t2.rtmin, t2.rtmax))
+    assert tn.mz.values == (100.0, 200.0)
+    assert tn.mz__0.values == (100.001, 200.002)
+
+
+def test_fast_join_multiple_columns():
+    t1 = emzed.utils.toTable("mz", (100.0, 200.0, 200.0, None, 300.0), type_=float)
+    t1.addColumn("rt", (10.0, 20.0, 80.0, 40.0, 30.0), type_=float)
+    t2 = emzed.utils.toTable("mz", (100.0004, 199.0, 200.0009, 200.0, 300.0), type_=float)
+    t2.addColumn("rt", (12.0, 20.0, 25.0, 100.0, None), type_=float)
+
+    tn = t1.fastJoin(t2, ["mz", "rt"], rel_tol=[5e-6, None], abs_tol=[None, 30.0])
+    expr = t1.mz.equals(t2.mz, rel_tol=5e-6) & t1.rt.equals(t2.rt, abs_tol=30.0)
+    assert tn.rows == t1.join(t2, expr).rows
+    assert [(r[0], r[1], r[3]) for r in tn.rows] == [(100.0, 10.0, 12.0), (200.0, 20.0, 25.0),
+                                                     (200.0, 80.0, 100.0)]
+
+    tn = t1.fastLeftJoin(t2, ["mz", "rt"], rel_tol=[5e-6, None], abs_tol=[None, 30.0])
+    assert tn.rows == t1.leftJoin(t2, expr).rows
+    assert len(tn) == 5
+
+    lookup = t2.buildLookup(["mz", "rt"], [None, 30.0], [5e-6, None])
+    assert lookup.find((200.0, 20.0)) == [2]
+    assert lookup.find((None, 20.0)) == []
+
+
+def test_vectorized_grouped_aggregates():
+    import numpy as np
+    np.random.seed(42)
+    n = 1000
+    t = emzed.utils.toTable("g1", np.random.randint(0, 20, n).tolist(), type_=int)
+    t.addColumn("g2", ["a" if v else "b" for v in np.random.randint(0, 2, n)], type_=str)
+    t.addColumn("ivalues", np.random.randint(0, 100, n).tolist(), type_=int)
+    t.addColumn("fvalues", np.random.random(n).tolist(), type_=float)
+
+    groups = t.enumerateBy("g1", "g2")
+    assert len(set(groups)) == len(t.splitBy("g1", "g2"))
+
+    efuns = dict(min=min, max=max, sum=sum, mean=np.mean, median=np.median, std=np.std,
+                 count=len)
+    for name in ("ivalues", "fvalues"):
+        grouped = dict()
+        for v, g in zip(getattr(t, name).values, groups):
+            grouped.setdefault(g, []).append(v)
+        for agg, efun in efuns.items():
+            t.addColumn("result", getattr(getattr(t, name), agg).group_by(t.g1, t.g2))
+            expected = [efun(grouped[g]) for g in groups]
+            assert np.allclose(t.result.values, expected), (name, agg)
+            if agg in ("mean", "median", "std"):
+                assert t.getColType("result") is float
+            elif agg == "count":
+                assert t.getColType("result") is int
+            else:
+                assert t.getColType("result") is t.getColType(name)
+            t.dropColumns("result")
+
+    tu = t.uniqueRows(byColumns=("g1", "g2"))
+    assert tu.rows == [t.rows[groups.index(g)] for g in range(len(tu))]
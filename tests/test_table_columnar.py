@@ -0,0 +1,122 @@
+import cPickle
+
+import numpy as np
+
+from emzed.core.data_types import Table
+
+
+def _create_tables():
+    rows = [[0, 1.0, "a", True, (0,)],
+            [1, None, "b", False, (1,)],
+            [2, 3.0, None, None, None],
+            [3, 2.0, "a", True, (3,)],
+            ]
+    names = ["i", "f", "s", "b", "o"]
+    types = [int, float, str, bool, object]
+    formats = ["%d", "%.1f", "%s", "%s", "%r"]
+    t0 = Table(names, types, formats, [r[:] for r in rows])
+    t1 = Table(names, types, formats, [r[:] for r in rows])
+    t1.useColumnarStorage()
+    return t0, t1
+
+
+def _rows(t):
+    return t._rowsWithoutConversion()
+
+
+def test_columnar_storage_roundtrip():
+    t0, t1 = _create_tables()
+    assert t1.hasColumnarStorage()
+    assert len(t1) == 4
+    assert t1.f.values == (1.0, None, 3.0, 2.0)
+    assert t1.b.values == (True, False, None, True)
+    assert t1 == t0
+    assert t1.hasColumnarStorage()
+
+    t2 = cPickle.loads(cPickle.dumps(t1))
+    assert t2 == t0
+
+    # accessing rows switches back to row wise storage:
+    assert t1.rows == t0.rows
+    assert not t1.hasColumnarStorage()
+    t1.rows[0][0] = 7
+    t1.resetInternals()
+    assert t1.i.values == (7, 1, 2, 3)
+
+
+def test_columnar_filter_and_getitem():
+    t0, t1 = _create_tables()
+    for expr in (lambda t: t.f > 1.5,
+                 lambda t: t.s == "a",
+                 lambda t: t.b.isNone(),
+                 lambda t: (t.f >= 1.0) & (t.i < 3)):
+        r1 = t1.filter(expr(t1))
+        assert r1.hasColumnarStorage()
+        assert _rows(r1) == t0.filter(expr(t0)).rows
+
+    for ix in (slice(None, None, -1), [1, 2, -1], 3, (slice(1, 3), [0, 2]),
+               np.arange(2), [True, False, False, True]):
+        r1 = t1[ix]
+        assert r1.hasColumnarStorage()
+        assert _rows(r1) == t0[ix].rows
+
+
+def test_columnar_add_column_and_sort():
+    t0, t1 = _create_tables()
+    for t in (t0, t1):
+        t.addColumn("g", t.f * 2, type_=float)
+        t.addColumn("h", t.s + "x", type_=str, insertBefore="i")
+        t.sortBy(["s", "i"], [True, False])
+        t.dropColumns("o")
+    assert t1.hasColumnarStorage()
+    assert _rows(t1) == t0.rows
+    assert t1.g.max() == t0.g.max()
+    assert t1.primaryIndex == t0.primaryIndex
+
+
+def test_columnar_joins():
+    t0, t1 = _create_tables()
+    o0, o1 = _create_tables()
+
+    r0 = t0.join(o0, t0.f < o0.f)
+    r1 = t1.join(o1, t1.f < o1.f)
+    assert r1.hasColumnarStorage()
+    assert _rows(r1) == r0.rows
+
+    r0 = t0.leftJoin(o0, t0.i == o0.i + 1)
+    r1 = t1.leftJoin(o1, t1.i == o1.i + 1)
+    assert r1.hasColumnarStorage()
+    assert _rows(r1) == r0.rows
+
+    # mixed storage:
+    r1 = t1.leftJoin(o0, t1.i == o0.i + 1)
+    assert _rows(r1) == r0.rows
+
+
+def test_columnar_store_and_load(tmpdir):
+    t0, t1 = _create_tables()
+    t0.title = "title"
+    t0.meta["x"] = 42
+    path = tmpdir.join("test.table").strpath
+    t0.store(path, columnar=True)
+
+    t2 = Table.load(path)
+    assert t2.hasColumnarStorage()
+    assert t2 == t0
+    assert t2.title == "title"
+    assert t2.meta["x"] == 42
+
+    t3 = Table.load(path, columns=["s", "f"])
+    assert t3.getColNames() == ["s", "f"]
+    assert _rows(t3) == [["a", 1.0], ["b", None], [None, 3.0], ["a", 2.0]]
+
+    t1.store(path, forceOverwrite=True, columnar=True)
+    assert Table.load(path) == t0
+
+    empty = t0.buildEmptyClone()
+    empty.store(path, forceOverwrite=True, columnar=True)
+    assert Table.load(path) == empty
+
+    # the pickle based format supports columns too:
+    t0.store(path, forceOverwrite=True)
+    assert _rows(Table.load(path, columns=["i"])) == [[0], [1], [2], [3]]
@@ -46,6 +46,30 @@ def test_load_map(path, tmpdir):
     assert ds3.uniqueId() == ds2.uniqueId()
 
 
+def test_load_map_with_filters(path, tmpdir):
+    from_ = path(u"data/SHORT_MS2_FILE.mzData")
+    ds = emzed.io.loadPeakMap(from_)
+    emzed.io.storePeakMap(ds, tmpdir.join("filtertest.mzML").strpath)
+
+    rtmin, rtmax = ds.rtRange()
+    rtmid = (rtmin + rtmax) / 2.0
+    filters = dict(rtmin=rtmid, mzmin=300.0, mzmax=800.0, imin=1000.0, mslevelmax=1)
+
+    # mzML is streamed, mzData is filtered after loading:
+    for p in (tmpdir.join("filtertest.mzML").strpath, from_):
+        full = emzed.io.loadPeakMap(p)
+        filtered = emzed.io.loadPeakMap(p, **filters)
+        assert 0 < len(filtered) < len(full)
+        expected = [s for s in full.spectra if s.rt >= rtmid and s.msLevel == 1]
+        expected = [(s.rt, s.peaks[(s.peaks[:, 0] >= 300.0) & (s.peaks[:, 0] <= 800.0)
+                                   & (s.peaks[:, 1] >= 1000.0)]) for s in expected]
+        expected = [(rt, peaks) for (rt, peaks) in expected if len(peaks)]
+        assert len(filtered) == len(expected)
+        for spec, (rt, peaks) in zip(filtered.spectra, expected):
+            assert spec.rt == rt
+            assert (spec.peaks == peaks).all()
+
+
 def test_merge_tables():
     t1 = emzed.utils.toTable("a", [1, 2])
     t2 = emzed.utils.mergeTables([t1, t1])